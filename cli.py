@@ -0,0 +1,234 @@
+"""Command-line tools for FireCloud project templates.
+
+Usage:
+  python cli.py expand [--input FILE] [--output FILE]
+      [--processes N] [--template TEMPLATE]
+  python cli.py plan [--input FILE] [--output FILE]
+      [--quotas FILE] [--deployment-minutes N]
+  python cli.py migrate [--input FILE] [--output FILE]
+  python cli.py drift [--input FILE] [--output FILE]
+      [--base-properties FILE]
+
+'expand' reads one JSON object of template properties per input line, and
+expands each of them (including all child templates, each validated against
+its own schema) and validates the result, over a pool of worker processes. One JSON result per line is written in
+input order, holding either the expanded 'config' or the 'errors' found.
+
+'plan' reads the output of 'expand' and writes the minute, relative to the
+start of the batch, at which each deployment should be started so that API
+write quotas are respected (see quota_planner.py). The optional quotas file
+holds a list of {"service": ..., "scope": "shared"|"project"|"host",
+"limit": ...} objects overriding the defaults.
+
+'migrate' reads one exported project per line, as {"labels": {...},
+"parameterRecord": ..., "properties": {...}} (parameterRecord being the
+firecloud-project-parameters metadata value of the parameter record object in
+the storage logs bucket, if any), and writes the config migrating each
+project to the current template version (see migration.py).
+
+'drift' reads exported live project state, grouped by project (see drift.py
+for the format), and writes one report per project listing where it differs
+from what the template would deploy. The optional base properties file holds
+a JSON object of properties shared by all projects.
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import sys
+
+import drift
+import expansion
+import migration
+import quota_planner
+import validation
+
+DEFAULT_TEMPLATE = 'firecloud_project.py'
+
+
+def expand_request(template, index, properties):
+  """Validates and expands a single request.
+
+  Returns:
+    A result record: the request index and projectId, plus either the
+    expanded 'config' or a list of 'errors'.
+  """
+  result = {'index': index}
+  if isinstance(properties, dict) and 'projectId' in properties:
+    result['projectId'] = properties['projectId']
+  try:
+    config = expansion.expand(template, properties,
+                              check=validation.check_template_call)
+    errors = validation.validate_manifest(config)
+  except validation.ValidationError as e:
+    errors = e.errors
+  except Exception as e:  # pylint: disable=broad-except
+    errors = ['{}: {}'.format(type(e).__name__, e)]
+  if errors:
+    result['errors'] = errors
+  else:
+    result['config'] = config
+  return result
+
+
+def _expand_line(args):
+  template, index, line = args
+  try:
+    properties = json.loads(line)
+  except ValueError as e:
+    return {'index': index, 'errors': ['invalid JSON: {}'.format(e)]}
+  return expand_request(template, index, properties)
+
+
+def expand_all(lines, template=DEFAULT_TEMPLATE, processes=None,
+               chunksize=8):
+  """Expands requests in parallel, yielding results in input order.
+
+  Arguments:
+    lines: an iterable of JSON-encoded property objects. Blank lines are
+      skipped, but still count towards the result index.
+    template: the template to expand, relative to the repository root.
+    processes: the number of worker processes; defaults to the CPU count.
+      With 1, requests are expanded in this process.
+    chunksize: the number of requests handed to a worker at a time.
+
+  Yields:
+    One result record per non-blank line, as returned by expand_request.
+  """
+  work = ((template, i, line) for i, line in enumerate(lines) if line.strip())
+  if processes == 1:
+    for item in work:
+      yield _expand_line(item)
+    return
+  pool = multiprocessing.Pool(processes)
+  try:
+    for result in pool.imap(_expand_line, work, chunksize):
+      yield result
+  finally:
+    pool.terminate()
+    pool.join()
+
+
+def expand_command(args):
+  failures = 0
+  with _open(args.input, 'r', sys.stdin) as lines, \
+      _open(args.output, 'w', sys.stdout) as out:
+    for result in expand_all(lines, args.template, args.processes,
+                             args.chunksize):
+      failures += 'errors' in result
+      out.write(json.dumps(result, sort_keys=True) + '\n')
+  return 1 if failures else 0
+
+
+def plan_command(args):
+  quotas = dict(quota_planner.DEFAULT_QUOTAS)
+  if args.quotas:
+    with open(args.quotas) as f:
+      for quota in json.load(f):
+        quotas[(quota['service'], quota['scope'])] = quota['limit']
+
+  with _open(args.input, 'r', sys.stdin) as lines:
+    results = [json.loads(line) for line in lines if line.strip()]
+  deployments = [(r.get('projectId', str(r['index'])), r['config'])
+                 for r in results if 'config' in r]
+  schedule = quota_planner.plan(deployments, quotas, args.deployment_minutes)
+  with _open(args.output, 'w', sys.stdout) as out:
+    for entry in schedule:
+      out.write(json.dumps(entry, sort_keys=True) + '\n')
+  return 0
+
+
+def migrate_command(args):
+  failures = 0
+  with _open(args.input, 'r', sys.stdin) as lines, \
+      _open(args.output, 'w', sys.stdout) as out:
+    for index, line in enumerate(lines):
+      if not line.strip():
+        continue
+      result = {'index': index}
+      try:
+        project = json.loads(line)
+        if 'projectId' in project.get('properties', {}):
+          result['projectId'] = project['properties']['projectId']
+        result['config'] = migration.generate_migration(
+          project.get('labels', {}), project.get('properties', {}),
+          project.get('parameterRecord'))
+      except Exception as e:  # pylint: disable=broad-except
+        failures += 1
+        result['errors'] = ['{}: {}'.format(type(e).__name__, e)]
+      out.write(json.dumps(result, sort_keys=True) + '\n')
+  return 1 if failures else 0
+
+
+def drift_command(args):
+  base_properties = None
+  if args.base_properties:
+    with open(args.base_properties) as f:
+      base_properties = json.load(f)
+
+  drifted = 0
+  with _open(args.input, 'r', sys.stdin) as lines, \
+      _open(args.output, 'w', sys.stdout) as out:
+    records = (json.loads(line) for line in lines if line.strip())
+    for report in drift.detect_drift(records, base_properties):
+      drifted += bool(report.get('errors') or report.get('drift'))
+      out.write(json.dumps(report, sort_keys=True) + '\n')
+  return 1 if drifted else 0
+
+
+@contextlib.contextmanager
+def _open(path, mode, stream):
+  """Opens a file, or passes through a standard stream for '-' or None."""
+  if path in (None, '-'):
+    yield stream
+  else:
+    with open(path, mode) as f:
+      yield f
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+    prog='python cli.py',
+    description='Tools for FireCloud project templates.')
+  subparsers = parser.add_subparsers(dest='command')
+
+  expand_parser = subparsers.add_parser(
+    'expand', help='Validate and expand project requests in parallel.')
+  expand_parser.add_argument('--input', help='JSON lines input; default stdin.')
+  expand_parser.add_argument('--output', help='JSON lines output; default stdout.')
+  expand_parser.add_argument('--template', default=DEFAULT_TEMPLATE)
+  expand_parser.add_argument('--processes', type=int, default=None)
+  expand_parser.add_argument('--chunksize', type=int, default=8)
+  expand_parser.set_defaults(func=expand_command)
+
+  plan_parser = subparsers.add_parser(
+    'plan', help='Schedule expanded deployments within API write quotas.')
+  plan_parser.add_argument('--input', help='expand output; default stdin.')
+  plan_parser.add_argument('--output', help='JSON lines output; default stdout.')
+  plan_parser.add_argument('--quotas', help='JSON file of quota overrides.')
+  plan_parser.add_argument('--deployment-minutes', type=int, default=1)
+  plan_parser.set_defaults(func=plan_command)
+
+  migrate_parser = subparsers.add_parser(
+    'migrate', help='Generate configs migrating projects to the current version.')
+  migrate_parser.add_argument('--input', help='JSON lines input; default stdin.')
+  migrate_parser.add_argument('--output', help='JSON lines output; default stdout.')
+  migrate_parser.set_defaults(func=migrate_command)
+
+  drift_parser = subparsers.add_parser(
+    'drift', help='Compare exported project state with the template.')
+  drift_parser.add_argument('--input', help='JSON lines input; default stdin.')
+  drift_parser.add_argument('--output', help='JSON lines output; default stdout.')
+  drift_parser.add_argument('--base-properties',
+                            help='JSON file of properties shared by all projects.')
+  drift_parser.set_defaults(func=drift_command)
+
+  args = parser.parse_args(argv)
+  if not hasattr(args, 'func'):
+    parser.print_help()
+    return 2
+  return args.func(args)
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,80 @@
+import json
+import os
+import tempfile
+import unittest
+
+import cli
+
+
+def request(project_id, **properties):
+  properties.update({
+      'billingAccountId': '111-111',
+      'parentOrganization': '12345',
+      'projectId': project_id,
+  })
+  return json.dumps(properties)
+
+
+class CliTest(unittest.TestCase):
+
+  def setUp(self):
+    self.lines = [
+        request('project-one', highSecurityNetwork=True),
+        request('project-two'),
+        request('Invalid_Project'),
+        '',
+        '{not json',
+        request('project-three', highSecurityNetwork='yes'),
+        request('project-four', privateIpGoogleAccess=True,
+                highSecurityNetwork=True),
+    ]
+
+  def assertExpectedResults(self, results):
+    self.assertEqual([r['index'] for r in results], [0, 1, 2, 4, 5, 6])
+    self.assertEqual([r.get('projectId') for r in results], [
+        'project-one', 'project-two', 'Invalid_Project', None,
+        'project-three', 'project-four'
+    ])
+    self.assertEqual(['errors' in r for r in results],
+                     [False, False, True, True, True, False])
+    self.assertIn('does not match', results[2]['errors'][0])
+    self.assertIn('expected boolean', results[4]['errors'][0])
+    names = [x['name'] for x in results[5]['config']['resources']]
+    self.assertIn('private-google-access-dns-zone', names)
+
+  def test_expand_in_process(self):
+    self.assertExpectedResults(list(cli.expand_all(self.lines, processes=1)))
+
+  def test_expand_in_pool_keeps_input_order(self):
+    self.assertExpectedResults(
+        list(cli.expand_all(self.lines, processes=2, chunksize=1)))
+
+  def test_expand_validates_child_template_calls(self):
+    """Each template call is checked against its own template's schema."""
+    line = request('project-five', sharedVpc={
+        'hostProject': 'network-host',
+        'network': 'shared',
+        'subnetworks': [{'region': 'us-central1'}],
+    })
+    result = next(cli.expand_all([line], processes=1))
+    self.assertEqual(result['errors'], [
+        'templates/shared_vpc_attachment.py: properties.subnetworks[0]: '
+        'missing required property name'
+    ])
+
+  def test_expand_command(self):
+    with tempfile.TemporaryDirectory() as tmp:
+      input_path = os.path.join(tmp, 'requests.jsonl')
+      output_path = os.path.join(tmp, 'results.jsonl')
+      with open(input_path, 'w') as f:
+        f.write('\n'.join(self.lines))
+      status = cli.main(['expand', '--input', input_path, '--output',
+                         output_path, '--processes', '2'])
+      with open(output_path) as f:
+        results = [json.loads(line) for line in f]
+    self.assertEqual(status, 1)
+    self.assertExpectedResults(results)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,213 @@
+"""Detects drift between exported live project state and the template.
+
+The input is a stream of JSON lines, one exported object per line:
+
+  {"projectId": ..., "kind": KIND, "resource": {...}}
+
+where KIND is one of:
+  project:     the CRM project, with "labels" and "projectNumber", plus the
+               firecloud-project-parameters metadata value of its parameter
+               record object (in the storage logs bucket) as
+               "parameterRecord" if it has one.
+  properties:  the project's template properties, overriding the recorded
+               ones (required for projects without a parameter record).
+  network, subnetwork, firewall:
+               compute resources, as returned by the compute API.
+  bucketAcl:   {"bucket": NAME, "items": [...]}, as returned by
+               bucketAccessControls.list.
+  iamPolicy:   the project IAM policy, as returned by getIamPolicy.
+
+Lines must be grouped by project. Each project is compared against the
+manifest generate_config would produce for it, and discarded once its report
+is written, so memory use is bounded by the largest single project rather
+than by the fleet.
+"""
+import itertools
+import json
+
+import expansion
+import migration
+from templates import project as project_template
+
+TEMPLATE = 'firecloud_project.py'
+
+# Fields compared per compute resource kind.
+COMPARED_FIELDS = {
+  'network': ['autoCreateSubnetworks'],
+  'subnetwork': ['ipCidrRange', 'privateIpGoogleAccess'],
+  'firewall': ['direction', 'sourceRanges', 'targetTags', 'allowed', 'priority'],
+}
+
+# Deployment Manager resource types, by the kind they are exported as.
+RESOURCE_KINDS = {
+  'gcp-types/compute-v1:networks': 'network',
+  'gcp-types/compute-beta:subnetworks': 'subnetwork',
+  'gcp-types/compute-v1:firewalls': 'firewall',
+}
+
+
+def _key(kind, resource):
+  """Returns the key identifying a resource of a kind within a project."""
+  if kind == 'subnetwork':
+    return '{}/{}'.format(resource['region'].rsplit('/', 1)[-1], resource['name'])
+  return resource['name']
+
+
+def _pin(value, project):
+  """Replaces references to the project resource by its live values."""
+  text = json.dumps(value)
+  text = text.replace('$(ref.project.projectId)', project['projectId'])
+  text = text.replace('$(ref.project.projectNumber)',
+                      str(project.get('projectNumber', '')))
+  return json.loads(text)
+
+
+def index_expected(config, project):
+  """Indexes the resources of an expanded manifest by kind and key.
+
+  Arguments:
+    config: the expanded manifest.
+    project: the exported project, for resolving references to it.
+
+  Returns:
+    A dict mapping each kind to a dict of expected resources by key. Bucket
+    ACLs map bucket names to sets of (entity, role) pairs, and the IAM policy
+    maps roles to sets of members, whether the manifest grants them or, in
+    deferred mode, outputs them as iamPolicies. 'unmanaged' maps kinds to the keys of live
+    resources the template leaves alone: the default VPC network and its
+    firewall rules, unless the manifest removes them.
+  """
+  index = {'network': {}, 'subnetwork': {}, 'firewall': {}, 'bucketAcl': {},
+           'iamPolicy': {}, 'unmanaged': {
+             'network': set([project_template.DEFAULT_NETWORK]),
+             'firewall': set(project_template.DEFAULT_NETWORK_FIREWALLS),
+           }}
+  for resource in _pin(config['resources'], project):
+    properties = resource.get('properties', {})
+    kind = RESOURCE_KINDS.get(resource.get('type'))
+    if resource.get('action', '').endswith('.networks.delete'):
+      # With removeDefaultVPC, a remaining default network is drift.
+      index['unmanaged'] = {}
+    elif kind:
+      index[kind][_key(kind, properties)] = properties
+    elif 'acl[]' in properties:
+      index['bucketAcl'][properties['name']] = set(
+        (acl['properties']['entity'], acl['properties']['role'])
+        for acl in properties['acl[]'])
+    elif resource.get('action', '').endswith('.projects.setIamPolicy'):
+      # Only the project's own policy; not that of Shared VPC subnetworks.
+      for grant in properties['gcpIamPolicyPatch'].get('add', []):
+        index['iamPolicy'].setdefault(grant['role'], set()).update(grant['members'])
+  for output in config.get('outputs', []):
+    if output['name'] == 'iamPolicies':
+      # With iamPolicyPatchMode deferred, the grants are applied after the
+      # deployment (see iam_policy.py), but are expected all the same.
+      for grant in _pin(output['value'], project):
+        index['iamPolicy'].setdefault(grant['role'], set()).update(grant['members'])
+  return index
+
+
+def index_live(records):
+  """Indexes a project's exported records by kind and key."""
+  index = {'network': {}, 'subnetwork': {}, 'firewall': {}, 'bucketAcl': {},
+           'iamPolicy': {}}
+  for record in records:
+    kind, resource = record['kind'], record['resource']
+    if kind in COMPARED_FIELDS:
+      index[kind][_key(kind, resource)] = resource
+    elif kind == 'bucketAcl':
+      index[kind][resource['bucket']] = set(
+        (item['entity'], item['role']) for item in resource.get('items', []))
+    elif kind == 'iamPolicy':
+      for binding in resource.get('bindings', []):
+        if 'condition' not in binding:
+          index[kind].setdefault(binding['role'], set()).update(binding['members'])
+  return index
+
+
+def compare(expected, live):
+  """Compares expected and live indexes.
+
+  Returns:
+    A list of drift records: dicts with the 'kind' and 'name' of the resource
+    and an 'issue' of 'missing', 'unexpected' or 'changed', plus the
+    'field', 'expected' and 'actual' values where relevant.
+  """
+  drift = []
+  for kind, fields in sorted(COMPARED_FIELDS.items()):
+    # Auto-mode networks create their own subnetworks, which the template
+    # doesn't describe.
+    if kind == 'subnetwork' and not expected[kind] and any(
+        n.get('autoCreateSubnetworks') for n in expected['network'].values()):
+      continue
+    unmanaged = expected.get('unmanaged', {}).get(kind, set())
+    for name in sorted(set(expected[kind]) | (set(live[kind]) - unmanaged)):
+      if name not in live[kind]:
+        drift.append({'kind': kind, 'name': name, 'issue': 'missing'})
+      elif name not in expected[kind]:
+        drift.append({'kind': kind, 'name': name, 'issue': 'unexpected'})
+      else:
+        for field in fields:
+          want = expected[kind][name].get(field)
+          have = live[kind][name].get(field)
+          if want is not None and want != have:
+            drift.append({'kind': kind, 'name': name, 'issue': 'changed',
+                          'field': field, 'expected': want, 'actual': have})
+
+  for bucket, entries in sorted(expected['bucketAcl'].items()):
+    if bucket not in live['bucketAcl']:
+      drift.append({'kind': 'bucketAcl', 'name': bucket, 'issue': 'missing'})
+    elif entries != live['bucketAcl'][bucket]:
+      drift.append({'kind': 'bucketAcl', 'name': bucket, 'issue': 'changed',
+                    'expected': sorted(entries),
+                    'actual': sorted(live['bucketAcl'][bucket])})
+
+  # Other writers add their own grants, so only missing members are drift.
+  for role, members in sorted(expected['iamPolicy'].items()):
+    missing = members - live['iamPolicy'].get(role, set())
+    if missing:
+      drift.append({'kind': 'iamPolicy', 'name': role, 'issue': 'missing',
+                    'expected': sorted(missing)})
+  return drift
+
+
+def detect_project_drift(project_id, records, base_properties=None):
+  """Compares one project's exported records against its expected manifest.
+
+  Returns:
+    A report dict with the 'projectId' and either its 'drift' records or the
+    'errors' that prevented the comparison.
+  """
+  report = {'projectId': project_id}
+  project = {'projectId': project_id}
+  properties = {}
+  for record in records:
+    if record['kind'] == 'project':
+      project.update(record['resource'])
+    elif record['kind'] == 'properties':
+      properties.update(record['resource'])
+
+  try:
+    recorded = migration.recorded_properties(project.get('labels', {}),
+                                             project.get('parameterRecord'))
+    properties = dict(base_properties or {}, **dict(recorded, **properties))
+    properties.setdefault('projectId', project_id)
+    config = expansion.expand(TEMPLATE, properties)
+  except Exception as e:  # pylint: disable=broad-except
+    report['errors'] = ['{}: {}'.format(type(e).__name__, e)]
+    return report
+
+  report['drift'] = compare(index_expected(config, project), index_live(records))
+  return report
+
+
+def detect_drift(records, base_properties=None):
+  """Yields a drift report per project of a grouped record stream.
+
+  Arguments:
+    records: an iterable of exported records, grouped by projectId.
+    base_properties: properties shared by all projects, such as
+      fcBillingGroup, which the recorded parameters take precedence over.
+  """
+  for project_id, group in itertools.groupby(records, lambda r: r['projectId']):
+    yield detect_project_drift(project_id, list(group), base_properties)
@@ -0,0 +1,143 @@
+import copy
+import unittest
+
+import drift
+import expansion
+import firecloud_project
+
+
+class DriftTest(unittest.TestCase):
+
+  def setUp(self):
+    self.properties = {
+        'billingAccountId': '111-111',
+        'parentOrganization': '12345',
+        'projectId': 'my-project',
+        'projectOwnersGroup': 'proxy-group-owners@firecloud.org',
+        'highSecurityNetwork': True,
+        'privateIpGoogleAccess': True,
+    }
+
+  def export(self, project_id, properties):
+    """Returns the records a faithful deployment of properties would export."""
+    config = expansion.expand('firecloud_project.py', properties)
+    project = {'projectId': project_id, 'projectNumber': '987654321'}
+    records = []
+    iam_policy = {'bindings': [{'role': 'roles/viewer',
+                                'members': ['user:someone@example.com']}]}
+    for resource in drift._pin(config['resources'], project):
+      properties = resource.get('properties', {})
+      if resource['name'] == 'project':
+        project['labels'] = properties['labels']
+        records.append({'kind': 'project', 'resource': project})
+      elif resource['name'] == 'write-parameter-record':
+        project['parameterRecord'] = properties['metadata'][
+            'firecloud-project-parameters']
+      elif resource.get('type') in drift.RESOURCE_KINDS:
+        records.append({'kind': drift.RESOURCE_KINDS[resource['type']],
+                        'resource': copy.deepcopy(properties)})
+      elif 'acl[]' in properties:
+        records.append({'kind': 'bucketAcl', 'resource': {
+            'bucket': properties['name'],
+            'items': [acl['properties'] for acl in properties['acl[]']]}})
+      elif 'gcpIamPolicyPatch' in properties:
+        iam_policy['bindings'] += properties['gcpIamPolicyPatch']['add']
+    records.append({'kind': 'iamPolicy', 'resource': iam_policy})
+    for record in records:
+      record['projectId'] = project_id
+    return records
+
+  def test_faithful_deployment_has_no_drift(self):
+    """A project deployed as recorded reports no drift."""
+    records = self.export('my-project', self.properties)
+    self.assertEqual(list(drift.detect_drift(records)),
+                     [{'projectId': 'my-project', 'drift': []}])
+
+  def test_reports_drift_per_project(self):
+    """Changes to live state are reported against the right project."""
+    other = dict(self.properties, projectId='other-project',
+                 highSecurityNetwork=False, privateIpGoogleAccess=False)
+    first = self.export('my-project', self.properties)
+    second = self.export('other-project', other)
+
+    for record in first:
+      resource = record['resource']
+      if record['kind'] == 'subnetwork' and resource['region'] == 'us-central1':
+        resource['privateIpGoogleAccess'] = False
+      elif record['kind'] == 'firewall' and resource['name'] == 'leonardo-ssl':
+        resource['sourceRanges'] = ['0.0.0.0/0', '10.0.0.0/8']
+      elif record['kind'] == 'iamPolicy':
+        resource['bindings'] = resource['bindings'][:1]
+    first = [r for r in first if r['kind'] != 'bucketAcl']
+    first.append({'projectId': 'my-project', 'kind': 'firewall',
+                  'resource': {'name': 'default-allow-ssh'}})
+    second.append({'projectId': 'other-project', 'kind': 'firewall',
+                   'resource': {'name': 'allow-all'}})
+
+    reports = list(drift.detect_drift(first + second))
+    self.assertEqual([r['projectId'] for r in reports],
+                     ['my-project', 'other-project'])
+    issues = [(d['kind'], d['name'], d['issue'], d.get('field'))
+              for d in reports[0]['drift']]
+    self.assertEqual(issues[:4], [
+        ('firewall', 'default-allow-ssh', 'unexpected', None),
+        ('firewall', 'leonardo-ssl', 'changed', 'sourceRanges'),
+        ('subnetwork', 'us-central1/subnetwork', 'changed',
+         'privateIpGoogleAccess'),
+        ('bucketAcl', 'cromwell-auth-my-project', 'missing', None),
+    ])
+    self.assertEqual(set(i[0] for i in issues[4:]), {'iamPolicy'})
+    self.assertEqual(reports[1]['drift'], [
+        {'kind': 'firewall', 'name': 'allow-all', 'issue': 'unexpected'}
+    ])
+
+  def test_default_network_keeps_default_vpc(self):
+    """The default VPC is only drift where the template removes it."""
+    properties = dict(self.properties, highSecurityNetwork=False,
+                      privateIpGoogleAccess=False)
+    records = self.export('my-project', properties)
+    records.append({'projectId': 'my-project', 'kind': 'network',
+                    'resource': {'name': 'default',
+                                 'autoCreateSubnetworks': True}})
+    for name in ('default-allow-internal', 'default-allow-ssh'):
+      records.append({'projectId': 'my-project', 'kind': 'firewall',
+                      'resource': {'name': name}})
+    self.assertEqual(next(drift.detect_drift(records))['drift'], [])
+
+  def test_deferred_iam_policies(self):
+    """Grants deferred to iam_policy.py are expected all the same."""
+    properties = dict(self.properties, iamPolicyPatchMode='deferred')
+    records = self.export('my-project', properties)
+    report = next(drift.detect_drift(records))
+    self.assertIn({'kind': 'iamPolicy', 'name': 'roles/viewer',
+                   'issue': 'missing',
+                   'expected': ['group:proxy-group-owners@firecloud.org']},
+                  report['drift'])
+
+    # Once iam_policy.py has applied them, there is no drift.
+    config = expansion.expand('firecloud_project.py', properties)
+    grants = [x['value'] for x in config['outputs']
+              if x['name'] == 'iamPolicies'][0]
+    records[-1]['resource']['bindings'] += drift._pin(
+        grants, {'projectId': 'my-project', 'projectNumber': '987654321'})
+    self.assertEqual(next(drift.detect_drift(records))['drift'], [])
+
+  def test_unrecorded_project(self):
+    """Projects without recorded or given parameters can't be compared."""
+    records = self.export('my-project', self.properties)
+    del records[0]['resource']['parameterRecord']
+    report = next(drift.detect_drift(records))
+    self.assertIn('errors', report)
+
+    # Given the missing properties, the comparison succeeds.
+    base = {'billingAccountId': '111-111', 'parentOrganization': '12345',
+            'projectOwnersGroup': 'proxy-group-owners@firecloud.org'}
+    records.insert(1, {'projectId': 'my-project', 'kind': 'properties',
+                       'resource': {'highSecurityNetwork': True,
+                                    'privateIpGoogleAccess': True}})
+    report = next(drift.detect_drift(records, base))
+    self.assertEqual(report['drift'], [])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,179 @@
+"""Expands Deployment Manager templates locally into a flat resource list.
+
+Deployment Manager expands composite types server-side: template-call nodes
+(resources whose type is a .py template) are replaced by the resources their
+generate_config returns, and '$(ref.NODE.OUTPUT)' references to a template
+node's outputs are replaced by the output values. This module performs the
+same expansion in-process, so that the resulting manifest can be inspected,
+validated or deployed as a plain configuration without template execution.
+
+References to concrete resources, such as '$(ref.project.projectId)', are left
+untouched; they are only resolvable by Deployment Manager at deploy time.
+"""
+import importlib.util
+import os
+import re
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+REFERENCE_PATTERN = re.compile(r'\$\(ref\.([^.)]+)\.([^)]+)\)')
+
+_template_modules = {}
+
+
+class Context(object):
+  """A stand-in for the Deployment Manager context object."""
+
+  def __init__(self, properties, env=None):
+    self.properties = properties
+    self.env = env if env is not None else {}
+
+
+def is_template(resource_type):
+  """Returns whether a resource type refers to a Python template."""
+  return resource_type.endswith('.py')
+
+
+def load_template(path):
+  """Imports a template module from its file path, caching the result."""
+  path = os.path.abspath(path)
+  if path not in _template_modules:
+    # Templates may import shared helpers relative to the repository root,
+    # mirroring the import paths declared in the .py.schema files.
+    if ROOT_DIR not in sys.path:
+      sys.path.insert(0, ROOT_DIR)
+    module_name = os.path.relpath(path, ROOT_DIR)[:-len('.py')]
+    module_name = '_dm_template_' + re.sub(r'\W', '_', module_name)
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    _template_modules[path] = module
+  return _template_modules[path]
+
+
+def resolve_template_path(resource_type, importing_path):
+  """Finds a template file, relative to its importer or the repository root."""
+  candidate = os.path.join(os.path.dirname(importing_path), resource_type)
+  if os.path.exists(candidate):
+    return candidate
+  return os.path.join(ROOT_DIR, resource_type)
+
+
+def resolve_references(value, template_outputs):
+  """Replaces references to template outputs within a value.
+
+  Arguments:
+    value: any property value (string, list, dict or scalar).
+    template_outputs: a dict mapping template node names to their outputs.
+
+  Returns:
+    A copy of the value with every resolvable reference replaced. A string
+    consisting of a single reference is replaced by the output value itself
+    (which may be a list); references embedded in a longer string are replaced
+    by the output's string value.
+  """
+  if isinstance(value, dict):
+    return {k: resolve_references(v, template_outputs)
+            for k, v in value.items()}
+  if isinstance(value, list):
+    return [resolve_references(v, template_outputs) for v in value]
+  if not isinstance(value, str) or '$(ref.' not in value:
+    return value
+
+  match = REFERENCE_PATTERN.fullmatch(value)
+  if match and match.group(2) in template_outputs.get(match.group(1), {}):
+    return template_outputs[match.group(1)][match.group(2)]
+
+  def replace(match):
+    outputs = template_outputs.get(match.group(1), {})
+    if match.group(2) in outputs and isinstance(outputs[match.group(2)], str):
+      return outputs[match.group(2)]
+    return match.group(0)
+
+  return REFERENCE_PATTERN.sub(replace, value)
+
+
+def _expand_depends_on(resource, template_leaves):
+  """Replaces template node names in dependsOn with their leaf resources."""
+  depends_on = resource.get('metadata', {}).get('dependsOn')
+  if not isinstance(depends_on, list):
+    return resource
+  expanded = []
+  for name in depends_on:
+    for leaf in template_leaves.get(name, [name]):
+      if leaf not in expanded:
+        expanded.append(leaf)
+  metadata = dict(resource['metadata'], dependsOn=expanded)
+  return dict(resource, metadata=metadata)
+
+
+def expand_template(path, properties, env=None, check=None):
+  """Recursively expands a template into concrete resources.
+
+  Arguments:
+    path: the template's file path.
+    properties: the template's properties.
+    env: the Deployment Manager environment, e.g. {'deployment': 'my-dep'}.
+    check: a function called with the path and properties of this and every
+      child template before it runs, which may raise to stop the expansion.
+
+  Returns:
+    A (resources, outputs) tuple: the flat list of concrete resources and a
+    dict of the template's resolved outputs.
+  """
+  if check:
+    check(path, properties)
+  module = load_template(path)
+  config = module.generate_config(Context(properties, env))
+
+  template_outputs = {}
+  template_leaves = {}
+  resources = []
+  for resource in config['resources']:
+    if 'type' in resource and is_template(resource['type']):
+      # Resolve what is already known before calling into the child template,
+      # so that it sees concrete values wherever possible.
+      child_properties = resolve_references(
+        resource.get('properties', {}), template_outputs)
+      child_resources, child_outputs = expand_template(
+        resolve_template_path(resource['type'], path), child_properties, env,
+        check)
+      template_outputs[resource['name']] = child_outputs
+      template_leaves[resource['name']] = [r['name'] for r in child_resources]
+      resources.extend(child_resources)
+    else:
+      resources.append(resource)
+
+  resources = [
+    _expand_depends_on(resolve_references(r, template_outputs),
+                       template_leaves)
+    for r in resources
+  ]
+  outputs = {
+    output['name']: resolve_references(output['value'], template_outputs)
+    for output in config.get('outputs', [])
+  }
+  return resources, outputs
+
+
+def expand(template, properties, env=None, check=None):
+  """Expands a template into a plain Deployment Manager configuration.
+
+  Arguments:
+    template: the template's path, relative to the repository root.
+    properties: the template's properties.
+    env: the Deployment Manager environment.
+    check: a function checking each template's properties; see
+      expand_template.
+
+  Returns:
+    A configuration dict with 'resources' and, if the template has any,
+    'outputs' (in the configuration's list-of-name/value format).
+  """
+  resources, outputs = expand_template(
+    os.path.join(ROOT_DIR, template), properties, env, check)
+  config = {'resources': resources}
+  if outputs:
+    config['outputs'] = [{'name': k, 'value': v} for k, v in outputs.items()]
+  return config
@@ -0,0 +1,48 @@
+import unittest
+
+import expansion
+
+
+class ExpansionTest(unittest.TestCase):
+
+  def test_resolve_references(self):
+    """Template outputs are substituted; other references are kept."""
+    outputs = {'fc-network': {'selfLink': '$(ref.network.selfLink)',
+                              'resourceNames': ['network', 'route']}}
+    self.assertEqual(
+        expansion.resolve_references({
+            'network': '$(ref.fc-network.selfLink)',
+            'dependsOn': '$(ref.fc-network.resourceNames)',
+            'name': 'projects/$(ref.project.projectId)/$(ref.fc-network.selfLink)',
+        }, outputs), {
+            'network': '$(ref.network.selfLink)',
+            'dependsOn': ['network', 'route'],
+            'name': 'projects/$(ref.project.projectId)/$(ref.network.selfLink)',
+        })
+
+  def test_expand_firecloud_project(self):
+    """Child templates are flattened into concrete resources."""
+    config = expansion.expand('firecloud_project.py', {
+        'billingAccountId': '111-111',
+        'parentOrganization': '12345',
+        'projectId': 'my-project',
+        'highSecurityNetwork': True,
+    })
+    resources = {r['name']: r for r in config['resources']}
+    self.assertNotIn('fc-project', resources)
+    self.assertNotIn('fc-network', resources)
+    self.assertFalse(any(expansion.is_template(r.get('type', ''))
+                         for r in config['resources']))
+
+    firewall = resources['allow-internal']
+    self.assertEqual(firewall['properties']['network'],
+                     '$(ref.network.selfLink)')
+    self.assertEqual(firewall['properties']['project'],
+                     '$(ref.project.projectId)')
+    self.assertIn('subnetwork_us-central1', firewall['metadata']['dependsOn'])
+    self.assertIn('delete-default-network',
+                  resources['network']['metadata']['dependsOn'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,58 @@
+"""A top-level template which creates several FireCloud GCP projects at once.
+
+Each entry of the 'projects' property is combined with the remaining (shared)
+properties and passed to the firecloud_project.py builder. Every project's
+resources are namespaced with a prefix derived from its project ID, so that
+the otherwise fixed resource names ('fc-project', 'fc-network', ...) and the
+references between them stay unique within the single deployment. Refilling a
+pool of projects then takes one deployment, rather than one per project.
+"""
+import firecloud_project
+
+
+class ProjectContext(object):
+  """The context passed to the project builder for a single fleet project."""
+
+  def __init__(self, properties, env):
+    self.properties = properties
+    self.env = env
+
+
+def resource_name_prefix(project_id):
+  """Returns the resource name prefix used for a project's resources."""
+  return project_id + '-'
+
+
+def generate_config(context):
+  """Entry point, called by deployment manager.
+
+  Args:
+      context: the Deployment Manager context object.
+
+  Returns:
+      A list of resources to be consumed by the Deployment Manager.
+  """
+  shared_properties = {
+    k: v for k, v in context.properties.items() if k != 'projects'
+  }
+
+  resources = []
+  outputs = []
+  for project_properties in context.properties['projects']:
+    # Generation never writes to its properties, so the shared values can be
+    # referenced by every project without copying them.
+    properties = dict(shared_properties)
+    properties.update(project_properties)
+    prefix = resource_name_prefix(properties['projectId'])
+    properties['resourceNamePrefix'] = prefix
+
+    config = firecloud_project.generate_config(
+      ProjectContext(properties, context.env))
+    resources.extend(config['resources'])
+    for output in config.get('outputs', []):
+      outputs.append(dict(output, name=prefix + output['name']))
+
+  config = {'resources': resources}
+  if outputs:
+    config['outputs'] = outputs
+  return config
@@ -0,0 +1,66 @@
+import unittest
+
+import expansion
+import firecloud_fleet
+import validation
+
+
+class FakeContext(object):
+
+  def __init__(self):
+    self.env = {}
+    self.properties = {}
+
+
+class FirecloudFleetTest(unittest.TestCase):
+
+  def setUp(self):
+    self.context = FakeContext()
+    self.context.properties.update({
+        'billingAccountId': '111-111',
+        'parentOrganization': '12345',
+        'highSecurityNetwork': True,
+        'privateIpGoogleAccess': True,
+        'pubsubTopic': 'projects/my-project/topics/deployments',
+        'labels': {'pool': 'v1'},
+        'projects': [
+            {'projectId': 'pool-project-001'},
+            {'projectId': 'pool-project-002', 'highSecurityNetwork': False},
+        ],
+    })
+
+  def test_top_level_resources_are_namespaced(self):
+    resources = firecloud_fleet.generate_config(self.context)['resources']
+    names = [x['name'] for x in resources]
+    self.assertIn('pool-project-001-fc-project', names)
+    self.assertIn('pool-project-002-fc-project', names)
+    self.assertIn('pool-project-001-fc-firewall', names)
+    self.assertNotIn('pool-project-002-fc-firewall', names)
+
+    completed = [x for x in resources
+                 if x['name'] == 'pool-project-001-pubsub-notification-COMPLETED'][0]
+    self.assertEqual(completed['metadata']['dependsOn'],
+                     '$(ref.pool-project-001-fc-network.resourceNames)')
+    self.assertEqual(
+        completed['properties']['messages'][0]['attributes']['projectId'],
+        'pool-project-001')
+
+    # Generating the projects leaves the shared properties untouched.
+    self.assertEqual(self.context.properties['labels'], {'pool': 'v1'})
+
+  def test_expanded_fleet_is_self_consistent(self):
+    """All expanded names are unique and every reference resolves."""
+    config = expansion.expand('firecloud_fleet.py', self.context.properties)
+    names = [x['name'] for x in config['resources']]
+    self.assertEqual(len(names), len(set(names)))
+
+    self.assertEqual(validation.validate_manifest(config), [])
+
+    for project_id in ('pool-project-001', 'pool-project-002'):
+      project = [x for x in config['resources']
+                 if x['name'] == project_id + '-project'][0]
+      self.assertEqual(project['properties']['projectId'], project_id)
+
+
+if __name__ == '__main__':
+  unittest.main()
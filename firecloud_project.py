@@ -20,10 +20,27 @@ Template Version History
     3:
       Removed billing permissions for billing project owners. This is to prevent users from changing the billing account
       on a Google Project through the Google console. Users will still be able to change the billing account through Terra.
+    4:
+      Moved the record of all parameter inputs out of the (lossy, truncated) param--* project labels into a single
+      compressed, canonical JSON record stored in the metadata of the firecloud-project-parameters object of the
+      storage logs bucket, under the same key. The project carries a single firecloud-project-parameters label holding the
+      record's hash instead. Projects labeled with version 2 may also have been created from version 3 templates.
 """
+import base64
+import hashlib
+import ipaddress
+import json
 import re
+import zlib
 
-FIRECLOUD_PROJECT_TEMPLATE_VERSION_ID = '2'
+from templates import firewall_policy
+from templates import google_apis
+from templates import model
+from templates import naming
+from templates import project as project_template
+from templates import shared_vpc_attachment
+
+FIRECLOUD_PROJECT_TEMPLATE_VERSION_ID = '4'
 
 GCP_REGIONS = ['asia-east1',
                'asia-east2',
@@ -52,6 +69,34 @@ def iprange(number):
 #assign IP ranges programmatically, because typing them out terrifies me
 FIRECLOUD_NETWORK_REGIONS = { region: iprange(128 + 2*i) for (i, region) in enumerate(GCP_REGIONS) }
 
+# The supernet all subnetwork primary ranges are allocated from, which the
+# allow-internal firewall rule admits.
+FIRECLOUD_NETWORK_SUPERNET = '10.128.0.0/9'
+
+# Reserved supernets for the per-region secondary ranges of VPC-native GKE
+# clusters and alias-IP VMs: a /16 of pod addresses and a /20 of service
+# addresses per region.
+FIRECLOUD_POD_SUPERNET = '10.0.0.0/11'
+FIRECLOUD_SERVICE_SUPERNET = '10.32.0.0/15'
+
+def allocate_ranges(supernet, prefix_length):
+  """Allocates one range of a supernet to each region, in GCP_REGIONS order."""
+  subnets = ipaddress.ip_network(supernet).subnets(new_prefix=prefix_length)
+  return { region: str(subnet) for (region, subnet) in zip(GCP_REGIONS, subnets) }
+
+FIRECLOUD_POD_RANGES = allocate_ranges(FIRECLOUD_POD_SUPERNET, 16)
+FIRECLOUD_SERVICE_RANGES = allocate_ranges(FIRECLOUD_SERVICE_SUPERNET, 20)
+
+# The default internal address of the Private Service Connect endpoint for
+# Google APIs, outside of all the ranges above.
+FIRECLOUD_PSC_ADDRESS = '10.127.255.254'
+
+def overlapping_ranges(ranges):
+  """Returns the pairs of overlapping ranges in a list of CIDR ranges."""
+  networks = [ipaddress.ip_network(r) for r in ranges]
+  return [(str(a), str(b)) for (i, a) in enumerate(networks)
+          for b in networks[i + 1:] if a.overlaps(b)]
+
 FIRECLOUD_REQUIRED_APIS = [
   "bigquery-json.googleapis.com",
   "compute.googleapis.com",
@@ -72,9 +117,126 @@ FIRECLOUD_REQUIRED_APIS = [
   "dns.googleapis.com"
 ]
 
+# APIs the template itself needs, whatever the workload: compute for the
+# network, storage for the buckets and the parameter record, and dns for the
+# Private Google Access zone.
+WORKLOAD_PROFILE_BASE_APIS = [
+  "cloudbilling.googleapis.com",
+  "compute.googleapis.com",
+  "dns.googleapis.com",
+  "logging.googleapis.com",
+  "monitoring.googleapis.com",
+  "storage-api.googleapis.com",
+  "storage-component.googleapis.com",
+]
+
+# The APIs enabled for each workloadProfile. Every API left out shortens API
+# activation, and the creation of its service agents, on project creation.
+WORKLOAD_PROFILES = {
+  # Cromwell workflows, run through the Genomics / Life Sciences pipelines APIs.
+  'batch-workflows': WORKLOAD_PROFILE_BASE_APIS + [
+    "bigquery-json.googleapis.com",
+    "cloudkms.googleapis.com",
+    "containerregistry.googleapis.com",
+    "genomics.googleapis.com",
+    "lifesciences.googleapis.com",
+  ],
+  # Leonardo notebook VMs, Dataproc clusters and Kubernetes apps.
+  'notebooks': WORKLOAD_PROFILE_BASE_APIS + [
+    "bigquery-json.googleapis.com",
+    "container.googleapis.com",
+    "containerregistry.googleapis.com",
+    "dataproc.googleapis.com",
+  ],
+  'bigquery-only': WORKLOAD_PROFILE_BASE_APIS + [
+    "bigquery-json.googleapis.com",
+  ],
+  'full': FIRECLOUD_REQUIRED_APIS,
+}
+
+# APIs that are only occasionally needed. They are enabled after the others,
+# and neither the rest of the project nor the COMPLETED notification waits
+# for them, except for a Shared VPC attachment: some of its network users are
+# the service agents these APIs create, and COMPLETED waits for it.
+OPTIONAL_APIS = [
+  "clouderrorreporting.googleapis.com",
+  "cloudtrace.googleapis.com",
+  "dataflow.googleapis.com",
+  "dataproc.googleapis.com",
+  "genomics.googleapis.com",
+]
+
+DEFAULT_WORKLOAD_PROFILE = 'full'
+WORKLOAD_PROFILE_LABEL = 'firecloud-workload-profile'
+
+# The version of the pubsub notification attributes. Version 1 only had the
+# projectId and status; version 2 added the schemaVersion, and the project,
+# bucket, network and template details of COMPLETED notifications.
+NOTIFICATION_SCHEMA_VERSION = '2'
+
+# Properties that control how the deployment is generated rather than what the
+# project looks like, and so aren't part of the project's parameter record.
+# Changing them must not cause an update of the project resource.
+UNRECORDED_PROPERTIES = ['resourceNamePrefix', 'teardown']
+
+# The name and metadata key of the storage logs bucket object holding the
+# parameter record, and the label key holding its hash.
+PARAMETER_RECORD_KEY = 'firecloud-project-parameters'
+
+# The service agents granted the network user role on Shared VPC subnetworks,
+# by the API that creates them, as (API, service account domain) pairs.
+SHARED_VPC_SERVICE_AGENTS = [
+  ("dataproc.googleapis.com", "dataproc-accounts.iam.gserviceaccount.com"),
+  ("container.googleapis.com", "container-engine-robot.iam.gserviceaccount.com"),
+]
+
 FIRECLOUD_VPC_NETWORK_NAME = "network"
 FIRECLOUD_VPC_SUBNETWORK_NAME = "subnetwork"
 
+# References to the outputs of the project and network template calls.
+PROJECT_ID = model.Ref('fc-project', 'projectId')
+PROJECT_NUMBER = model.Ref('fc-project', 'projectNumber')
+NETWORK_SELF_LINK = model.Ref('fc-network', 'selfLink')
+NETWORK_RESOURCE_NAMES = model.Ref('fc-network', 'resourceNames')
+
+def set_network_mtu(context, network):
+  """Passes the networkMtu property, if set, on to a network template call."""
+  if 'networkMtu' in context.properties:
+    network.properties['mtu'] = context.properties['networkMtu']
+  return network
+
+
+def bucket_location(context):
+  """Returns the project template properties placing the project's buckets.
+
+  Args:
+      context: the DM context object.
+
+  Returns:
+      A dict with whichever of bucketLocation, bucketLocationType and
+      bucketDataLocations are set.
+
+  Raises:
+      ValueError: if a region the buckets are placed in has no subnetwork.
+  """
+  properties = {}
+  for name in ['bucketLocation', 'bucketLocationType', 'bucketDataLocations']:
+    if name in context.properties:
+      properties[name] = context.properties[name]
+
+  # Co-locating buckets with compute is the point of placing them, so a
+  # region must be one the network has a subnetwork in.
+  if properties.get('bucketLocationType') == 'region':
+    regions = [properties.get('bucketLocation', '')]
+  else:
+    regions = properties.get('bucketDataLocations', [])
+  for region in regions:
+    if region.lower() not in GCP_REGIONS:
+      raise ValueError('Bucket region {!r} is not one of the network\'s '
+                       'regions.'.format(region))
+  return properties
+
+
 def create_default_network(context):
   """Creates a default VPC network resource.
 
@@ -84,21 +246,81 @@ def create_default_network(context):
   Returns:
       A resource instantiating the network.py sub-template.
   """
-  return [{
-    'type': 'templates/network.py',
-    'name': 'fc-network',
-    'properties': {
-      'resourceName': 'network',
-      'name': 'network',
-      'projectId': '$(ref.fc-project.projectId)',
-      'autoCreateSubnetworks': True,
-      # We pass the dependsOn list into the network template as a
-      # parameter. Deployment Manager doesn't support dependsOn for
-      # template-call nodes, so we can't have this resource itself depend on
-      # the project-wide resources.
-      'dependsOn': '$(ref.fc-project.resourceNames)',
-    },
-  }]
+  network = model.Resource('fc-network', 'templates/network.py', {
+    'resourceName': 'network',
+    'name': 'network',
+    'projectId': PROJECT_ID,
+    'autoCreateSubnetworks': True,
+    # We pass the dependsOn list into the network template as a
+    # parameter. Deployment Manager doesn't support dependsOn for
+    # template-call nodes, so we can't have this resource itself depend on
+    # the project-wide resources.
+    'dependsOn': model.Ref('fc-project', 'resourceNames'),
+  })
+  return [set_network_mtu(context, network)]
+
+
+def create_secondary_ranges(context, region):
+  """Creates the secondary ranges of a region's subnetwork.
+
+  Args:
+      context: the DM context object.
+      region: the subnetwork's region.
+
+  Returns:
+      The pods and services ranges if allocateSecondaryRanges is set, or an
+      empty list.
+  """
+  if not context.properties.get('allocateSecondaryRanges', False):
+    return []
+  return [
+    {'rangeName': 'pods', 'ipCidrRange': FIRECLOUD_POD_RANGES[region]},
+    {'rangeName': 'services', 'ipCidrRange': FIRECLOUD_SERVICE_RANGES[region]},
+  ]
+
+
+def internal_source_ranges(context):
+  """Returns the ranges the allow-internal firewall rule admits traffic from."""
+  source_ranges = [FIRECLOUD_NETWORK_SUPERNET]
+  if context.properties.get('allocateSecondaryRanges', False):
+    source_ranges.extend([FIRECLOUD_POD_SUPERNET, FIRECLOUD_SERVICE_SUPERNET])
+  return source_ranges
+
+
+def google_api_access(context):
+  """Returns the network and DNS template properties picking the API access path.
+
+  Args:
+      context: the DM context object.
+
+  Returns:
+      A dict with the accessPath and, for psc, the pscAddress, or an empty
+      dict for the default restricted path.
+
+  Raises:
+      ValueError: if the psc endpoint address is within the network's ranges,
+        or a path other than restricted is combined with the shared DNS zone
+        of privateGoogleAccessDnsPeeringNetwork, whose records the project
+        doesn't control.
+  """
+  access_path = context.properties.get('googleApiAccessPath',
+                                       google_apis.DEFAULT_ACCESS_PATH)
+  if access_path == google_apis.DEFAULT_ACCESS_PATH:
+    return {}
+  if 'privateGoogleAccessDnsPeeringNetwork' in context.properties:
+    raise ValueError('The {} Google API access path needs the project\'s own '
+                     'googleapis.com records, so it can\'t be combined with '
+                     'privateGoogleAccessDnsPeeringNetwork.'.format(access_path))
+
+  properties = {'accessPath': access_path}
+  if access_path == 'psc':
+    address = context.properties.get('googleApiPscAddress', FIRECLOUD_PSC_ADDRESS)
+    google_apis.validate_access_path(access_path, address)
+    if overlapping_ranges(internal_source_ranges(context) + [address + '/32']):
+      raise ValueError('The Private Service Connect address {} is within the '
+                       'network\'s ranges.'.format(address))
+    properties['pscAddress'] = address
+  return properties
 
 
 def create_high_security_network(context):
@@ -123,26 +345,31 @@ def create_high_security_network(context):
       'region': region,
       'ipCidrRange': FIRECLOUD_NETWORK_REGIONS[region],
       'enableFlowLogs': context.properties.get('enableFlowLogs', False),
-      'privateIpGoogleAccess': private_ip_google_access
+      'privateIpGoogleAccess': private_ip_google_access,
+      'secondaryIpRanges': create_secondary_ranges(context, region)
     })
 
-  return [{
-    'type': 'templates/network.py',
-    'name': 'fc-network',
-    'properties': {
-      'resourceName': 'network',
-      'name': FIRECLOUD_VPC_NETWORK_NAME,
-      'projectId': '$(ref.fc-project.projectId)',
-      'autoCreateSubnetworks': False,
-      'subnetworks': subnetworks,
-      # We pass the dependsOn list into the network template as a
-      # parameter. Deployment Manager doesn't support dependsOn for
-      # template-call nodes, so we can't have this resource itself depend on
-      # the project-wide resources.
-      'dependsOn': '$(ref.fc-project.resourceNames)',
-      'createCustomStaticRoute': private_ip_google_access
-    },
-  }]
+  network = model.Resource('fc-network', 'templates/network.py', {
+    'resourceName': 'network',
+    'name': FIRECLOUD_VPC_NETWORK_NAME,
+    'projectId': PROJECT_ID,
+    'autoCreateSubnetworks': False,
+    'subnetworks': subnetworks,
+    # We pass the dependsOn list into the network template as a
+    # parameter. Deployment Manager doesn't support dependsOn for
+    # template-call nodes, so we can't have this resource itself depend on
+    # the project-wide resources.
+    'dependsOn': model.Ref('fc-project', 'resourceNames'),
+    'createCustomStaticRoute': private_ip_google_access
+  })
+  if private_ip_google_access:
+    network.properties.update(google_api_access(context))
+
+  if 'cloudNat' in context.properties:
+    # NAT gateways in every region with a subnetwork.
+    network.properties['cloudNat'] = dict(context.properties['cloudNat'],
+                                          regions=list(FIRECLOUD_NETWORK_REGIONS))
+  return [set_network_mtu(context, network)]
 
 def create_private_google_access_dns_zone(context):
   """Creates a DNS Zone for the use of Private Google Access
@@ -157,16 +384,101 @@ def create_private_google_access_dns_zone(context):
   Returns:
     A resource instantiating the private_google_access_dns_zone.py sub-template.
   """
-  return [{
-    'type': 'templates/private_google_access_dns_zone.py',
-    'name': 'fc-private-google-access-dns-zone',
-    'properties': {
+  dns_zone = model.Resource(
+    'fc-private-google-access-dns-zone',
+    'templates/private_google_access_dns_zone.py',
+    {
       'resourceName': 'private-google-access-dns-zone',
-      'projectId': '$(ref.fc-project.projectId)',
-      'network': '$(ref.fc-network.selfLink)',
-      'dependsOn': '$(ref.fc-network.resourceNames)'
-    }
-  }]
+      'projectId': PROJECT_ID,
+      'network': NETWORK_SELF_LINK,
+      'dependsOn': NETWORK_RESOURCE_NAMES
+    })
+  dns_zone.properties.update(google_api_access(context))
+  if 'privateGoogleAccessDnsPeeringNetwork' in context.properties:
+    dns_zone.properties['peeringNetwork'] = (
+      context.properties['privateGoogleAccessDnsPeeringNetwork'])
+  return [dns_zone]
+
+
+def create_shared_vpc_attachment(context):
+  """Attaches the project to a Shared VPC host, in place of its own network.
+
+  The attachment stands in for the network template call, under the same
+  name and with the same outputs, so that resources waiting on the network
+  wait on the attachment instead.
+
+  Args:
+      context: the DM context object.
+
+  Returns:
+      A resource instantiating the shared_vpc_attachment.py sub-template.
+  """
+  shared_vpc = context.properties['sharedVpc']
+
+  # Those creating VMs in the project: the Google APIs service agent (for
+  # managed instance groups), the Dataproc and GKE service agents (for
+  # Leonardo and Cromwell clusters), the FireCloud service accounts and the
+  # project's owner and viewer proxy groups.
+  network_users = [model.Concat('serviceAccount:', PROJECT_NUMBER,
+                                '@cloudservices.gserviceaccount.com')]
+  apis = create_apis(context) + create_apis(context, optional=True)
+  for api, domain in SHARED_VPC_SERVICE_AGENTS:
+    # A service agent only exists once its API is enabled.
+    if api in apis:
+      network_users.append(model.Concat('serviceAccount:service-',
+                                        PROJECT_NUMBER, '@', domain))
+  network_users.extend(context.properties.get('fcProjectEditors', []))
+  for group in ['projectOwnersGroup', 'projectViewersGroup']:
+    if group in context.properties:
+      network_users.append('group:{}'.format(context.properties[group]))
+  network_users.extend(shared_vpc.get('networkUsers', []))
+
+  return [model.Resource('fc-network', 'templates/shared_vpc_attachment.py', {
+    'resourceName': 'shared-vpc-attachment',
+    'hostProject': shared_vpc['hostProject'],
+    'network': shared_vpc['network'],
+    'subnetworks': shared_vpc['subnetworks'],
+    'networkUsers': network_users,
+    'projectId': PROJECT_ID,
+    # As for the network, the attachment needs the compute API enabled. The
+    # optional APIs, enabled after the others, create some of the service
+    # agents granted access, so they are waited for too when there are any.
+    'dependsOn': model.Ref(
+      'fc-project', 'optionalApiResourceNames'
+      if create_apis(context, optional=True) else 'resourceNames'),
+  })]
+
+
+def check_firewall_policy(context):
+  """Checks that the hierarchical firewall policy standing in for the rules applies.
+
+  The policy is managed with the folder (see templates/firewall_policy.py),
+  so the project only reads the policy's association with its parentFolder,
+  failing the deployment if either is missing.
+
+  Args:
+      context: the DM context object.
+
+  Returns:
+      A DM action reading the policy's association.
+
+  Raises:
+      ValueError: if the project has no parentFolder for the policy to be
+        associated with.
+  """
+  if 'parentFolder' not in context.properties:
+    raise ValueError('A firewallPolicy must be associated with the project\'s '
+                     'parentFolder, which is not set.')
+  return [model.Action(
+    'check-firewall-policy',
+    'gcp-types/compute-v1:compute.firewallPolicies.getAssociation',
+    {
+      'firewallPolicy': context.properties['firewallPolicy'],
+      'name': firewall_policy.association_name(
+        'folders/{}'.format(context.properties['parentFolder'])),
+    },
+    depends_on=NETWORK_RESOURCE_NAMES,
+    runtime_policy=['CREATE', 'UPDATE_ON_CHANGE'])]
 
 
 def create_firewall(context):
@@ -176,22 +488,25 @@ def create_firewall(context):
   instantiated, so it includes a dependsOn reference to the list of resources
   generated by the network sub-template.
 
+  With a firewallPolicy, the rules come from that hierarchical firewall
+  policy instead, and only a check of the policy is created.
+
   Args:
       context: the DM context object.
 
   Returns:
       A resource instantiating the firewall.py sub-template.
   """
-  return [{
-    'type': 'templates/firewall.py',
-    'name': 'fc-firewall',
-    'properties': {
+  if 'firewallPolicy' in context.properties:
+    return check_firewall_policy(context)
+
+  firewall = model.Resource('fc-firewall', 'templates/firewall.py', {
       'projectId':
-        '$(ref.fc-project.projectId)',
+        PROJECT_ID,
       'network':
-        '$(ref.fc-network.selfLink)',
+        NETWORK_SELF_LINK,
       'dependsOn':
-        '$(ref.fc-network.resourceNames)',
+        NETWORK_RESOURCE_NAMES,
       'rules': [
         {
           'name': 'allow-internal',
@@ -206,7 +521,7 @@ def create_firewall(context):
             'ports': ['0-65535'],
           }],
           'direction': 'INGRESS',
-          'sourceRanges': ['10.128.0.0/9'],
+          'sourceRanges': internal_source_ranges(context),
           'priority': 65534,
         },
         {
@@ -221,8 +536,8 @@ def create_firewall(context):
           'targetTags': ['leonardo'],
         },
       ],
-    },
-  }]
+  })
+  return [firewall]
 
 
 def create_iam_policies(context):
@@ -328,41 +643,114 @@ def create_iam_policies(context):
   return policies
 
 
-def create_pubsub_notification(context, depends_on, status_string):
+def workload_profile(context):
+  """Returns the project's workload profile.
+
+  Raises:
+      ValueError: if the workloadProfile property names no known profile.
+  """
+  profile = context.properties.get('workloadProfile', DEFAULT_WORKLOAD_PROFILE)
+  if profile not in WORKLOAD_PROFILES:
+    raise ValueError('Unknown workloadProfile {!r}; expected one of {}.'.format(
+      profile, ', '.join(sorted(WORKLOAD_PROFILES))))
+  return profile
+
+
+def create_apis(context, optional=False):
+  """Returns the APIs to enable for the project's workload profile.
+
+  The APIs are listed in FIRECLOUD_REQUIRED_APIS order, whatever the order of
+  the profile definition, so that a profile always expands identically.
+
+  Args:
+      context: the DM context object.
+      optional: whether to return the profile's OPTIONAL_APIS, rather than
+        the APIs the project can't be used without.
+  """
+  apis = WORKLOAD_PROFILES[workload_profile(context)]
+  return [api for api in FIRECLOUD_REQUIRED_APIS
+          if api in apis and (api in OPTIONAL_APIS) == optional]
+
+
+def create_completed_attributes(context):
+  """Creates the attributes describing the created project, for COMPLETED.
+
+  They are taken from the outputs of the project and network template calls,
+  so that the receiver doesn't need to look them up. In the deferred IAM
+  policy patch mode, the project's grants are yet to be applied when the
+  message is sent, which an iamPoliciesPending attribute says.
+
+  Arguments:
+      context: the DM context object.
+
+  Returns:
+    A dict of message attributes.
+  """
+  attributes = {
+    'projectNumber': PROJECT_NUMBER,
+    'storageLogsBucketName': model.Ref('fc-project', 'storageLogsBucketName'),
+    'cromwellAuthBucketName': model.Ref('fc-project', 'cromwellAuthBucketName'),
+    'networkSelfLink': NETWORK_SELF_LINK,
+    'templateVersion': str(FIRECLOUD_PROJECT_TEMPLATE_VERSION_ID),
+  }
+  if context.properties.get('iamPolicyPatchMode', 'inline') == 'deferred':
+    attributes['iamPoliciesPending'] = 'true'
+  # Auto-mode networks create their own subnetworks, which have no outputs.
+  if 'sharedVpc' in context.properties:
+    shared_vpc = context.properties['sharedVpc']
+    for subnetwork in shared_vpc['subnetworks']:
+      attributes['subnetworkSelfLink.' + subnetwork['region']] = (
+        shared_vpc_attachment.subnetwork_self_link(shared_vpc['hostProject'],
+                                                   subnetwork))
+  elif context.properties.get('highSecurityNetwork', False):
+    for region in FIRECLOUD_NETWORK_REGIONS:
+      # Attribute values are limited to 1024 bytes, so there is one per region.
+      attributes['subnetworkSelfLink.' + region] = model.Ref(
+        'fc-network',
+        'selfLink_' + FIRECLOUD_VPC_SUBNETWORK_NAME + '_' + region)
+  return attributes
+
+
+def create_pubsub_notification(context, depends_on, status_string,
+                               attributes=None):
   """Creates a resource to publish a message upon deployment completion.
 
+  Every message has the projectId, status and notification schemaVersion
+  attributes.
+
   Arguments:
       context: the DM context object.
       depends_on: a list of resource names this notification should depend on.
       status_string: the "status" attribute value to publish, e.g. 'STARTED' or
         'COMPLETED'.
+      attributes: further attributes to publish, if any.
 
   Returns:
     A list of pubsub Deployment Manager actions.
   """
+  message_attributes = dict(attributes or {})
+  message_attributes.update({
+    'projectId': context.properties['projectId'],
+    'status': status_string,
+    'schemaVersion': NOTIFICATION_SCHEMA_VERSION,
+  })
 
-  return [{
-    'name': 'pubsub-notification-{}'.format(status_string),
-    'action': 'gcp-types/pubsub-v1:pubsub.projects.topics.publish',
-    'properties': {
+  return [model.Action(
+    'pubsub-notification-{}'.format(status_string),
+    'gcp-types/pubsub-v1:pubsub.projects.topics.publish',
+    {
       'topic':
         context.properties['pubsubTopic'],
       'messages': [{
-        'attributes': {
-          'projectId': context.properties['projectId'],
-          'status': status_string,
-        }
+        'attributes': message_attributes
       }]
     },
-    'metadata': {
-      # The notification should only run after *all* project-related
-      # resources have been deployed.
-      'dependsOn': depends_on,
-      # Only trigger the pubsub message when the deployment is created (not on
-      # update or delete).
-      'runtimePolicy': ['UPDATE_ALWAYS'],
-    },
-  }]
+    # The notification should only run after *all* project-related
+    # resources have been deployed.
+    depends_on=depends_on,
+    # Only trigger the pubsub message when the deployment is created (not on
+    # update or delete).
+    runtime_policy=['UPDATE_ALWAYS'])]
 
 
 def satisfy_label_requirements(k, v):
@@ -396,6 +784,87 @@ def satisfy_label_requirements(k, v):
   return new_k, new_v
 
 
+def create_parameter_record(context):
+  """Creates the canonical record of this template's version and parameters.
+
+  Args:
+      context: the DM context object.
+
+  Returns:
+      The record, as a JSON string with sorted keys and no whitespace, so that
+      identical parameters always give an identical record.
+  """
+  return json.dumps({
+    'templateVersion': str(FIRECLOUD_PROJECT_TEMPLATE_VERSION_ID),
+    'properties': {k: v for k, v in context.properties.items() if k not in UNRECORDED_PROPERTIES},
+  }, sort_keys=True, separators=(',', ':'))
+
+
+def parameter_record_hash(record):
+  """Returns the short hash of a parameter record used as its label value."""
+  return hashlib.sha256(record.encode('utf-8')).hexdigest()[:16]
+
+
+def compress_parameter_record(record):
+  """Compresses a parameter record into an object-metadata-safe string."""
+  return base64.b64encode(zlib.compress(record.encode('utf-8'), 9)).decode('ascii')
+
+
+def decompress_parameter_record(value):
+  """Returns the parameter record dict stored in an object metadata value."""
+  return json.loads(zlib.decompress(base64.b64decode(value)).decode('utf-8'))
+
+
+def create_labels(context):
+  """Creates the labels to apply to the new project.
+
+  Args:
+      context: the DM context object.
+
+  Returns:
+      A dict of project labels.
+  """
+  # Copy the caller's labels rather than updating them in place.
+  labels_obj = dict(context.properties.get('labels', {}))
+
+  # Save this template's version number and the hash of the parameter record (which holds all parameter inputs) to
+  # the project labels to keep track of what operations were performed on a project.
+  labels_obj.update({
+    "firecloud-project-template-version" : str(FIRECLOUD_PROJECT_TEMPLATE_VERSION_ID),
+    PARAMETER_RECORD_KEY: parameter_record_hash(create_parameter_record(context)),
+    WORKLOAD_PROFILE_LABEL: workload_profile(context)
+  })
+
+  if context.properties.get('highSecurityNetwork', False):
+    labels_obj.update({
+      "vpc-network-name" : FIRECLOUD_VPC_NETWORK_NAME,
+      "vpc-subnetwork-name" : FIRECLOUD_VPC_SUBNETWORK_NAME
+    })
+
+  return labels_obj
+
+
+class _PropertiesContext(object):
+  """A context holding only properties, for builders used outside of DM."""
+
+  def __init__(self, properties):
+    self.properties = properties
+
+
+def project_labels(properties):
+  """Returns the labels the project resource gets for the given properties.
+
+  These are the labels of create_labels, plus the billing account label that
+  templates/project.py adds, for tools writing the labels without expanding
+  the templates.
+  """
+  return project_template.create_labels(_PropertiesContext({
+    'labels': create_labels(_PropertiesContext(properties)),
+    'billingAccountFriendlyName': properties.get(
+      'billingAccountFriendlyName', properties['billingAccountId']),
+  }))
+
+
 def generate_config(context):
   """Entry point, called by deployment manager.
 
@@ -423,32 +892,16 @@ def generate_config(context):
 
   # Optional properties, with defaults.
   high_security_network = context.properties.get('highSecurityNetwork', False)
+  shared_vpc = 'sharedVpc' in context.properties
   private_ip_google_access = context.properties.get('privateIpGoogleAccess', False)
+  iam_policy_patch_mode = context.properties.get('iamPolicyPatchMode', 'inline')
+  teardown = context.properties.get('teardown', False)
   storage_bucket_lifecycle = context.properties.get('storageBucketLifecycle', 180)
   billing_account_friendly_name = context.properties.get('billingAccountFriendlyName', billing_account_id)
   # Use a project name if given, otherwise it's safe to fallback to use the
   # project ID as the name.
   project_name = context.properties.get('projectName', project_id)
-  labels_obj = context.properties.get('labels', {})
-
-  # Save this template's version number and all parameters inputs to the project metadata to keep track of what
-  # operations were performed on a project.
-  labels_obj.update({
-    "firecloud-project-template-version" : str(FIRECLOUD_PROJECT_TEMPLATE_VERSION_ID)
-  })
-
-  for k, v in context.properties.items():
-    label_k, label_v = satisfy_label_requirements('param--' + str(k), v)
-    labels_obj.update({
-      label_k: label_v
-    })
-
-
-  if high_security_network:
-    labels_obj.update({
-      "vpc-network-name" : FIRECLOUD_VPC_NETWORK_NAME,
-      "vpc-subnetwork-name" : FIRECLOUD_VPC_SUBNETWORK_NAME
-    })
+  labels_obj = create_labels(context)
 
   if 'parentFolder' in context.properties:
     parent_obj = {
@@ -462,14 +915,17 @@ def generate_config(context):
     }
 
   # Create the main project resource.
-  resources.append({
-    'type': 'templates/project.py',
-    'name': 'fc-project',
-    'properties': {
-      'activateApis': FIRECLOUD_REQUIRED_APIS,
+  project_resource = model.Resource('fc-project', 'templates/project.py', {
+      'activateApis': create_apis(context),
+      'activateOptionalApis': create_apis(context, optional=True),
       'billingAccountId': billing_account_id,
       'billingAccountFriendlyName': billing_account_friendly_name,
       'iamPolicies': create_iam_policies(context),
+      'iamPolicyPatchMode': iam_policy_patch_mode,
+      'parameterRecord': {
+        'key': PARAMETER_RECORD_KEY,
+        'value': compress_parameter_record(create_parameter_record(context)),
+      },
       'labels': labels_obj,
       'name': project_name,
       # The project parent. For FireCloud, this should refer to the
@@ -482,18 +938,45 @@ def generate_config(context):
       'removeDefaultSA': False,
       # Removes the default VPC network for projects requiring stringent
       # network security configurations.
-      'removeDefaultVPC': high_security_network,
+      'removeDefaultVPC': high_security_network or shared_vpc,
       'createUsageExportBucket': False,
       # Always set up the storage logs and cromwell auth buckets for Firecloud
       'storageLogsBucket': True,
       'storageBucketLifecycle': storage_bucket_lifecycle,
-      'cromwellAuthBucket': True
-    }
+      'cromwellAuthBucket': True,
+      'teardown': teardown,
   })
-
-  if high_security_network:
+  for name in ['storageBucketLifecycleTiers', 'storageBucketAutoclass',
+               'cromwellAuthBucketAccess']:
+    if name in context.properties:
+      project_resource.properties[name] = context.properties[name]
+  project_resource.properties.update(bucket_location(context))
+  resources.append(project_resource)
+
+  if teardown:
+    # Only the project itself is kept. Applying this config with
+    # --delete-policy=ABANDON drops every other resource from the deployment
+    # without deleting it, so that deleting the deployment afterwards only
+    # deletes the project (and everything in it) with a single call.
+    return naming.namespace_config(
+      [project_resource],
+      prefix=context.properties.get('resourceNamePrefix'))
+
+  completed_depends_on = NETWORK_RESOURCE_NAMES
+  if shared_vpc:
+    # The network, firewall rules and DNS are the host project's. The
+    # attachment's resourceNames are those of the attachment itself and of
+    # every subnetwork grant, so COMPLETED waits until VMs can use the host's
+    # subnetworks.
+    resources.extend(create_shared_vpc_attachment(context))
+  elif high_security_network:
     resources.extend(create_high_security_network(context))
-    resources.extend(create_firewall(context))
+    firewall = create_firewall(context)
+    resources.extend(firewall)
+    if 'firewallPolicy' in context.properties:
+      # The policy check is a concrete action, which itself waits for the
+      # network, so COMPLETED waits for the check instead.
+      completed_depends_on = firewall
     if private_ip_google_access:
       resources.extend(create_private_google_access_dns_zone(context))
   else:
@@ -510,7 +993,24 @@ def generate_config(context):
         # depends on the project). It doesn't seem to be possible to concatenate
         # dependsOn arrays within the reference syntax, otherwise we could make
         # this depend explicitly on all resources from the template nodes.
-        depends_on='$(ref.fc-network.resourceNames)',
-        status_string='COMPLETED'))
-
-  return {'resources': resources}
+        depends_on=completed_depends_on,
+        status_string='COMPLETED',
+        attributes=create_completed_attributes(context)))
+
+    if create_apis(context, optional=True):
+      # Sent separately, once the optional APIs are enabled as well.
+      resources.extend(
+        create_pubsub_notification(
+          context,
+          depends_on=project_resource.ref('optionalApiResourceNames'),
+          status_string='OPTIONAL_APIS_ENABLED'))
+
+  outputs = None
+  if iam_policy_patch_mode == 'deferred':
+    # The IAM grants aren't applied by this deployment; expose them so the
+    # caller can apply them with iam_policy.py once the project exists.
+    outputs = [('iamPolicies', project_resource.ref('iamPolicies'))]
+
+  return naming.namespace_config(
+    resources, outputs,
+    context.properties.get('resourceNamePrefix'))
@@ -1,6 +1,17 @@
+import copy
 import unittest
 
+import expansion
 import firecloud_project
+from templates import firewall as firewall_template
+from templates import firewall_policy as firewall_policy_template
+from templates import model
+from templates import naming
+from templates import network as network_template
+from templates import private_google_access_dns_zone as dns_zone_template
+from templates import project as project_template
+from templates import shared_vpc_attachment as shared_vpc_template
+from templates import subnetwork as subnetwork_template
 
 
 class FakeContext(object):
@@ -52,8 +63,12 @@ class FirecloudProjectTest(unittest.TestCase):
     self.assertEqual(project['type'], 'templates/project.py')
     self.assertEqual(project['properties']['billingAccountId'], '111-111')
     self.assertEqual(project['properties']['name'], 'my-project')
-    self.assertEqual(project['properties']['activateApis'],
-                     firecloud_project.FIRECLOUD_REQUIRED_APIS)
+    self.assertEqual(
+        sorted(project['properties']['activateApis'] +
+               project['properties']['activateOptionalApis']),
+        sorted(firecloud_project.FIRECLOUD_REQUIRED_APIS))
+    self.assertEqual(project['properties']['activateOptionalApis'],
+                     sorted(firecloud_project.OPTIONAL_APIS))
 
     # The 'parent' param sent to the project.py template should refer to the
     # organization ID.
@@ -117,6 +132,79 @@ class FirecloudProjectTest(unittest.TestCase):
     dns_zone = resource_with_name(resources, 'fc-private-google-access-dns-zone')
     self.assertEquals(dns_zone['properties']['resourceName'], 'private-google-access-dns-zone')
 
+  def test_private_google_access_dns(self):
+    """PGA DNS is a zone with one change of records, or a peering zone."""
+    props = dict(self.context.properties, highSecurityNetwork=True,
+                 privateIpGoogleAccess=True)
+    resources = expansion.expand('firecloud_project.py', props)['resources']
+    dns = [x for x in resources if x.get('type', x.get('action')).startswith(
+        'gcp-types/dns-v1:')]
+    self.assertEqual([x['name'] for x in dns],
+                     ['private-google-access-dns-zone', 'cname-record'])
+    self.assertEqual([(r['name'], r['type']) for r in dns[1]['properties']['additions']],
+                     [('*.googleapis.com.', 'CNAME'),
+                      ('restricted.googleapis.com.', 'A')])
+
+    central = 'https://www.googleapis.com/compute/v1/projects/central/global/networks/dns'
+    props['privateGoogleAccessDnsPeeringNetwork'] = central
+    resources = expansion.expand('firecloud_project.py', props)['resources']
+    dns = [x for x in resources if x.get('type', x.get('action')).startswith(
+        'gcp-types/dns-v1:')]
+    self.assertEqual([x['name'] for x in dns], ['private-google-access-dns-zone'])
+    self.assertEqual(
+        dns[0]['properties']['peeringConfig']['targetNetwork']['networkUrl'],
+        central)
+
+  def test_google_api_access_paths(self):
+    """Route and DNS resources follow the Google API access path."""
+    props = dict(self.context.properties, highSecurityNetwork=True,
+                 privateIpGoogleAccess=True)
+
+    def expand(access_path, **properties):
+      props['googleApiAccessPath'] = access_path
+      props.update(properties)
+      resources = expansion.expand('firecloud_project.py', props)['resources']
+      records = resource_with_name(resources, 'cname-record')
+      return resources, records['properties']['additions']
+
+    resources, records = expand('restricted')
+    route = resource_with_name(resources, 'private-google-access-route')
+    self.assertEqual(route['properties']['destRange'], '199.36.153.4/30')
+    self.assertEqual(records[0]['rrdatas'], ['restricted.googleapis.com.'])
+    self.assertEqual(records[1]['rrdatas'], ['199.36.153.4', '199.36.153.5',
+                                             '199.36.153.6', '199.36.153.7'])
+
+    resources, records = expand('private')
+    route = resource_with_name(resources, 'private-google-access-route-private')
+    self.assertEqual(route['properties']['destRange'], '199.36.153.8/30')
+    self.assertEqual(records[0]['rrdatas'], ['private.googleapis.com.'])
+    self.assertEqual(records[1]['name'], 'private.googleapis.com.')
+    self.assertEqual(records[1]['rrdatas'], ['199.36.153.8', '199.36.153.9',
+                                             '199.36.153.10', '199.36.153.11'])
+
+    resources, records = expand('psc')
+    self.assertFalse([x for x in resources if 'route' in x['name']])
+    address = resource_with_name(resources, 'psc-googleapis-address')
+    self.assertEqual(address['properties']['address'], '10.127.255.254')
+    endpoint = resource_with_name(resources, 'psc-googleapis-endpoint')
+    self.assertEqual(endpoint['properties']['target'], 'all-apis')
+    self.assertEqual(endpoint['metadata']['dependsOn'], ['psc-googleapis-address'])
+    self.assertEqual(records, [{'name': '*.googleapis.com.', 'type': 'A',
+                                'ttl': 300, 'rrdatas': ['10.127.255.254']}])
+
+    with self.assertRaises(ValueError):
+      expand('psc', googleApiPscAddress='10.128.0.5')
+
+    # With a shared zone, the records aren't the project's to change.
+    del props['googleApiPscAddress']
+    props['privateGoogleAccessDnsPeeringNetwork'] = (
+        'https://www.googleapis.com/compute/v1/projects/hub/global/networks/hub')
+    for access_path in ('private', 'psc'):
+      with self.assertRaises(ValueError):
+        expand(access_path)
+    props['googleApiAccessPath'] = 'restricted'
+    expansion.expand('firecloud_project.py', props)
+
   def test_iam_policies(self):
     """Tests that IAM grants are correctly generated for FC owners & groups."""
     props = self.context.properties
@@ -177,6 +265,102 @@ class FirecloudProjectTest(unittest.TestCase):
             ]
         })
 
+  def test_deferred_iam_policy_patch_mode(self):
+    """Deferred IAM patching is passed through and exposes the policies."""
+    result = firecloud_project.generate_config(self.context)
+    project = resource_with_name(result['resources'], 'fc-project')
+    self.assertEqual(project['properties']['iamPolicyPatchMode'], 'inline')
+    self.assertNotIn('outputs', result)
+
+    self.context.properties['iamPolicyPatchMode'] = 'deferred'
+    result = firecloud_project.generate_config(self.context)
+    project = resource_with_name(result['resources'], 'fc-project')
+    self.assertEqual(project['properties']['iamPolicyPatchMode'], 'deferred')
+    self.assertEqual(result['outputs'], [{
+        'name': 'iamPolicies',
+        'value': '$(ref.fc-project.iamPolicies)'
+    }])
+
+    # COMPLETED is sent before the grants are applied, and says so.
+    self.context.properties['pubsubTopic'] = 'projects/p/topics/deployments'
+    resources = firecloud_project.generate_config(self.context)['resources']
+    completed = resource_with_name(resources, 'pubsub-notification-COMPLETED')
+    attributes = completed['properties']['messages'][0]['attributes']
+    self.assertEqual(attributes['iamPoliciesPending'], 'true')
+
+  def test_iam_action_names_are_deterministic(self):
+    """IAM action names only change when the grants or project change."""
+
+    def iam_action_names(properties):
+      context = FakeContext()
+      context.properties.update(properties)
+      return [x.name for x in project_template.create_iam_policies(context)]
+
+    properties = {
+        'projectId': 'my-project',
+        'iamPolicies': [{'role': 'roles/viewer', 'members': ['group:a@b.org']}],
+    }
+    names = iam_action_names(properties)
+    suffix = project_template.iam_policy_hash('my-project', properties['iamPolicies'])
+    self.assertEqual(names, ['get-iam-policy-' + suffix,
+                             'patch-iam-policy-' + suffix])
+    self.assertEqual(iam_action_names(properties), names)
+
+    properties['iamPolicies'][0]['members'].append('group:c@b.org')
+    self.assertNotEqual(iam_action_names(properties), names)
+    properties['projectId'] = 'other-project'
+    self.assertNotEqual(iam_action_names(properties), names)
+
+  def test_generation_leaves_properties_untouched(self):
+    """Generation never writes to its properties or to shared constants."""
+    props = self.context.properties
+    props['highSecurityNetwork'] = True
+    props['privateIpGoogleAccess'] = True
+    props['parentFolder'] = 99999
+    props['labels'] = {'project': 'all-of-us'}
+    props['fcProjectEditors'] = ['serviceAccount:rawls@firecloud.org']
+    snapshot = copy.deepcopy(props)
+    required_apis = list(firecloud_project.FIRECLOUD_REQUIRED_APIS)
+
+    first = firecloud_project.generate_config(self.context)
+    second = firecloud_project.generate_config(self.context)
+    self.assertEqual(first, second)
+    self.assertEqual(props, snapshot)
+
+    # Expanding the child templates doesn't write to their inputs either.
+    first = expansion.expand('firecloud_project.py', props)
+    second = expansion.expand('firecloud_project.py', props)
+    self.assertEqual(first, second)
+    self.assertEqual(props, snapshot)
+    self.assertEqual(firecloud_project.FIRECLOUD_REQUIRED_APIS, required_apis)
+
+  def test_teardown(self):
+    """Teardown keeps the project resource exactly as created, and nothing else."""
+    props = self.context.properties
+    props['highSecurityNetwork'] = True
+    props['pubsubTopic'] = 'projects/my-project/topics/deployments'
+    created = expansion.expand('firecloud_project.py', props)
+
+    props['teardown'] = True
+    resources = firecloud_project.generate_config(self.context)['resources']
+    self.assertEqual([x['name'] for x in resources], ['fc-project'])
+
+    # The storage logs bucket is deleted along with the project, without
+    # confirmation.
+    teardown = expansion.expand('firecloud_project.py', props)
+    self.assertEqual(teardown['resources'],
+                     [resource_with_name(created['resources'], 'project')])
+
+    # A usage export bucket keeps its reports, so its deletion is confirmed.
+    project_props = dict(resource_with_name(resources, 'fc-project')['properties'],
+                         createUsageExportBucket=True)
+    with self.assertRaises(ValueError):
+      expansion.expand('templates/project.py', project_props)
+    project_props['teardownConfirmBucketDeletion'] = True
+    self.assertEqual(
+        len(expansion.expand('templates/project.py', project_props)['resources']),
+        1)
+
   def test_pubsub_notifications(self):
     """Tests the creation of Pubsub notification resources."""
     self.context.properties[
@@ -199,6 +383,608 @@ class FirecloudProjectTest(unittest.TestCase):
     self.assertEqual(completed['metadata']['dependsOn'],
                      '$(ref.fc-network.resourceNames)')
 
+    # COMPLETED carries the details of the created project, taken from the
+    # template outputs; STARTED only the schema version.
+    self.assertEqual(started_attrs['schemaVersion'], '2')
+    self.assertEqual(completed_attrs, {
+        'projectId': 'my-project',
+        'status': 'COMPLETED',
+        'schemaVersion': '2',
+        'projectNumber': '$(ref.fc-project.projectNumber)',
+        'storageLogsBucketName': '$(ref.fc-project.storageLogsBucketName)',
+        'cromwellAuthBucketName': '$(ref.fc-project.cromwellAuthBucketName)',
+        'networkSelfLink': '$(ref.fc-network.selfLink)',
+        'templateVersion': firecloud_project.FIRECLOUD_PROJECT_TEMPLATE_VERSION_ID,
+    })
+
+  def test_namespace_config_walks_model_objects(self):
+    """Only the template's own references and dependencies are prefixed."""
+    network = model.Resource('network', 'gcp-types/compute-v1:networks', {
+        'description': 'Not a reference: $(ref.network',
+        'project': '$(ref.network.projectId)',
+    })
+    route = model.Action('route', 'compute.routes.insert', {
+        'network': network.ref('selfLink'),
+        'name': model.Concat(network.ref('name'), '-route'),
+    }, depends_on=[network, 'caller-resource'])
+    subnetwork = model.Resource('subnetwork', 'subnetwork.py', {
+        'dependsOn': [model.Dependency(network)],
+    }, depends_on='$(ref.fc-project.resourceNames)')
+    config = naming.namespace_config(
+        [network, route, subnetwork],
+        [('name', network.name), ('selfLink', network.ref('selfLink'))], 'p-')
+
+    network, route, subnetwork = config['resources']
+    # Strings come from the caller, and name the caller's resources.
+    self.assertEqual(network['properties'], {
+        'description': 'Not a reference: $(ref.network',
+        'project': '$(ref.network.projectId)',
+    })
+    self.assertEqual(route['properties'], {
+        'network': '$(ref.p-network.selfLink)',
+        'name': '$(ref.p-network.name)-route',
+    })
+    self.assertEqual(route['metadata']['dependsOn'],
+                     ['p-network', 'caller-resource'])
+    self.assertEqual(subnetwork['properties'], {
+        'dependsOn': ['p-network'], 'resourceNamePrefix': 'p-'})
+    self.assertEqual(subnetwork['metadata']['dependsOn'],
+                     '$(ref.fc-project.resourceNames)')
+    self.assertEqual(config['outputs'], [
+        {'name': 'name', 'value': 'p-network'},
+        {'name': 'selfLink', 'value': '$(ref.p-network.selfLink)'}])
+
+  def test_completed_notification_subnetworks(self):
+    """COMPLETED refers to a network output per high-security subnetwork."""
+    props = dict(self.context.properties, highSecurityNetwork=True,
+                 pubsubTopic='projects/my-project/topics/deployments',
+                 resourceNamePrefix='p-')
+    config = firecloud_project.generate_config(expansion.Context(props))
+    completed = resource_with_name(config['resources'],
+                                   'p-pubsub-notification-COMPLETED')
+    attributes = completed['properties']['messages'][0]['attributes']
+    self.assertEqual(attributes['subnetworkSelfLink.us-central1'],
+                     '$(ref.p-fc-network.selfLink_subnetwork_us-central1)')
+    self.assertEqual(
+        len([a for a in attributes if a.startswith('subnetworkSelfLink.')]),
+        len(firecloud_project.FIRECLOUD_NETWORK_REGIONS))
+
+    network = resource_with_name(config['resources'], 'p-fc-network')
+    outputs = expansion.expand('templates/network.py',
+                               network['properties'])['outputs']
+    self.assertIn({'name': 'selfLink_subnetwork_us-central1',
+                   'value': '$(ref.p-subnetwork_us-central1.selfLink)'},
+                  outputs)
+
+  def test_parameter_record(self):
+    """All parameters are recorded losslessly, with only their hash as a label."""
+    props = self.context.properties
+    props['fcProjectEditors'] = [
+        'serviceAccount:cromwell-sa-with-a-very-long-name@firecloud.org',
+        'serviceAccount:rawls-sa-with-a-very-long-name@firecloud.org'
+    ]
+    props['labels'] = {'project': 'all-of-us'}
+    props['resourceNamePrefix'] = 'my-project-'
+    resources = firecloud_project.generate_config(self.context)['resources']
+    project = resource_with_name(resources, 'my-project-fc-project')
+
+    record = project['properties']['parameterRecord']
+    self.assertEqual(record['key'], 'firecloud-project-parameters')
+    recorded = firecloud_project.decompress_parameter_record(record['value'])
+    self.assertEqual(recorded['templateVersion'],
+                     firecloud_project.FIRECLOUD_PROJECT_TEMPLATE_VERSION_ID)
+    expected = dict(props)
+    del expected['resourceNamePrefix']
+    self.assertEqual(recorded['properties'], expected)
+
+    labels = project['properties']['labels']
+    self.assertEqual(sorted(labels.keys()), [
+        'firecloud-project-parameters', 'firecloud-project-template-version',
+        'firecloud-workload-profile', 'project'
+    ])
+    self.assertEqual(len(labels['firecloud-project-parameters']), 16)
+
+    # The hash only changes when the parameters do.
+    props['resourceNamePrefix'] = 'other-'
+    resources = firecloud_project.generate_config(self.context)['resources']
+    self.assertEqual(
+        resource_with_name(resources, 'other-fc-project')['properties']['labels'],
+        labels)
+    props['projectName'] = 'Renamed'
+    resources = firecloud_project.generate_config(self.context)['resources']
+    self.assertNotEqual(
+        resource_with_name(resources, 'other-fc-project')['properties']['labels'],
+        labels)
+
+  def test_project_labels(self):
+    """project_labels predicts the labels of the expanded project."""
+    props = dict(self.context.properties, highSecurityNetwork=True,
+                 billingAccountFriendlyName='Broad Billing',
+                 labels={'project': 'all-of-us'})
+    resources = expansion.expand('firecloud_project.py', props)['resources']
+    self.assertEqual(firecloud_project.project_labels(props),
+                     resource_with_name(resources, 'project')['properties']['labels'])
+
+  def test_parameter_record_object(self):
+    """The record is a private storage logs bucket object, kept up to date."""
+
+    def write_record(**properties):
+      props = dict(self.context.properties, **properties)
+      resources = expansion.expand('firecloud_project.py', props)['resources']
+      return resource_with_name(resources, 'write-parameter-record')
+
+    action = write_record()
+    self.assertEqual(action['properties']['bucket'],
+                     'storage-logs-$(ref.project.projectId)')
+    self.assertEqual(action['properties']['name'],
+                     firecloud_project.PARAMETER_RECORD_KEY)
+    self.assertEqual(action['properties']['predefinedAcl'], 'private')
+    self.assertEqual(list(action['properties']['metadata']),
+                     [firecloud_project.PARAMETER_RECORD_KEY])
+    self.assertEqual(action['metadata']['runtimePolicy'],
+                     ['CREATE', 'UPDATE_ON_CHANGE'])
+    self.assertIn('create-storage-logs-bucket',
+                  action['metadata']['dependsOn'])
+    self.assertNotEqual(write_record(projectName='Renamed'), action)
+
+    resources = firecloud_project.generate_config(self.context)['resources']
+    props = dict(resource_with_name(resources, 'fc-project')['properties'],
+                 storageLogsBucket=False)
+    with self.assertRaises(ValueError):
+      expansion.expand('templates/project.py', props)
+
+  def test_secondary_ranges(self):
+    """Secondary ranges are allocated per region, without any overlap."""
+    self.context.properties['highSecurityNetwork'] = True
+    resources = firecloud_project.generate_config(self.context)['resources']
+    network = resource_with_name(resources, 'fc-network')
+    for subnetwork in network['properties']['subnetworks']:
+      self.assertEqual(subnetwork['secondaryIpRanges'], [])
+
+    self.context.properties['allocateSecondaryRanges'] = True
+    resources = firecloud_project.generate_config(self.context)['resources']
+    network = resource_with_name(resources, 'fc-network')
+    ranges = []
+    for subnetwork in network['properties']['subnetworks']:
+      self.assertEqual([r['rangeName'] for r in subnetwork['secondaryIpRanges']],
+                       ['pods', 'services'])
+      ranges.append(subnetwork['ipCidrRange'])
+      ranges.extend(r['ipCidrRange'] for r in subnetwork['secondaryIpRanges'])
+    self.assertEqual(len(ranges), 3 * len(firecloud_project.GCP_REGIONS))
+    self.assertEqual(firecloud_project.overlapping_ranges(ranges), [])
+    self.assertEqual(firecloud_project.FIRECLOUD_POD_RANGES['us-central1'],
+                     '10.15.0.0/16')
+
+    # Traffic from pods and services is internal traffic.
+    firewall = resource_with_name(resources, 'fc-firewall')
+    allow_internal = firewall['properties']['rules'][0]
+    self.assertEqual(allow_internal['sourceRanges'],
+                     ['10.128.0.0/9', '10.0.0.0/11', '10.32.0.0/15'])
+
+  def test_hierarchical_firewall_policy(self):
+    """A firewall policy replaces the project's rules with a check of it."""
+    props = dict(self.context.properties, highSecurityNetwork=True,
+                 privateIpGoogleAccess=True, parentFolder='99999',
+                 firewallPolicy='123456789',
+                 pubsubTopic='projects/p/topics/deployments')
+    resources = expansion.expand('firecloud_project.py', props)['resources']
+    completed = resource_with_name(resources, 'pubsub-notification-COMPLETED')
+    self.assertEqual(completed['metadata']['dependsOn'],
+                     ['check-firewall-policy'])
+    self.assertFalse([x for x in resources
+                      if x.get('type') == 'gcp-types/compute-v1:firewalls'])
+    check = resource_with_name(resources, 'check-firewall-policy')
+    self.assertEqual(
+        check['action'],
+        'gcp-types/compute-v1:compute.firewallPolicies.getAssociation')
+    self.assertEqual(check['properties'], {'firewallPolicy': '123456789',
+                                           'name': 'folders-99999'})
+
+    # The policy can only be associated with the project's folder.
+    del props['parentFolder']
+    with self.assertRaises(ValueError):
+      expansion.expand('firecloud_project.py', props)
+
+    # The folder's policy is created and associated with the folder.
+    resources = expansion.expand('templates/firewall_policy.py', {
+        'resourceName': 'firecloud-policy',
+        'parentId': 'folders/99999',
+        'shortName': 'firecloud',
+        'rules': [{'priority': 1000, 'direction': 'INGRESS', 'action': 'allow',
+                   'match': {'srcIpRanges': ['10.128.0.0/9'],
+                             'layer4Configs': [{'ipProtocol': 'icmp'}]}}],
+    })['resources']
+    policy = resource_with_name(resources, 'firecloud-policy')
+    self.assertEqual(policy['properties']['parentId'], 'folders/99999')
+    associate = resource_with_name(resources, 'associate-firecloud-policy')
+    self.assertEqual(associate['properties'], {
+        'firewallPolicy': '$(ref.firecloud-policy.name)',
+        'attachmentTarget': 'folders/99999',
+        'name': 'folders-99999'})
+
+  def test_cloud_nat(self):
+    """Cloud NAT gateways are created per region, with the given ports."""
+    props = dict(self.context.properties, highSecurityNetwork=True)
+    resources = expansion.expand('firecloud_project.py', props)['resources']
+    self.assertFalse([x for x in resources if x['name'].startswith('nat-router-')])
+
+    props['cloudNat'] = {
+        'minPortsPerVm': 1024,
+        'maxPortsPerVm': 8192,
+        'enableDynamicPortAllocation': True,
+    }
+    resources = expansion.expand('firecloud_project.py', props)['resources']
+    routers = [x for x in resources if x['name'].startswith('nat-router-')]
+    self.assertEqual(len(routers), len(firecloud_project.GCP_REGIONS))
+    router = resource_with_name(resources, 'nat-router-us-central1')
+    self.assertEqual(router['type'], 'gcp-types/compute-v1:routers')
+    self.assertEqual(router['metadata']['dependsOn'], ['network'])
+    self.assertEqual(router['properties']['region'], 'us-central1')
+    self.assertEqual(router['properties']['nats'], [{
+        'name': 'nat-us-central1',
+        'natIpAllocateOption': 'AUTO_ONLY',
+        'sourceSubnetworkIpRangesToNat': 'ALL_SUBNETWORKS_ALL_IP_RANGES',
+        'minPortsPerVm': 1024,
+        'maxPortsPerVm': 8192,
+        'enableDynamicPortAllocation': True,
+        'enableEndpointIndependentMapping': False,
+    }])
+
+    props['cloudNat'] = dict(props['cloudNat'],
+                             enableEndpointIndependentMapping=True)
+    with self.assertRaises(ValueError):
+      expansion.expand('firecloud_project.py', props)
+    props['cloudNat'] = {'minPortsPerVm': 1000,
+                         'enableDynamicPortAllocation': True}
+    with self.assertRaises(ValueError):
+      expansion.expand('firecloud_project.py', props)
+    props['cloudNat'] = {'minPortsPerVm': 16,
+                         'enableDynamicPortAllocation': True}
+    with self.assertRaises(ValueError):
+      expansion.expand('firecloud_project.py', props)
+    props['cloudNat'] = {'minPortsPerVm': 32, 'maxPortsPerVm': 32,
+                         'enableDynamicPortAllocation': True}
+    with self.assertRaises(ValueError):
+      expansion.expand('firecloud_project.py', props)
+    # Without dynamic allocation, any count of at least 2 is accepted.
+    props['cloudNat'] = {'minPortsPerVm': 16}
+    expansion.expand('firecloud_project.py', props)
+
+  def test_network_mtu(self):
+    """The network MTU is only set when given, and must be supported."""
+
+    def network(**properties):
+      props = dict(self.context.properties, **properties)
+      resources = expansion.expand('firecloud_project.py', props)['resources']
+      return resource_with_name(resources, 'network')['properties']
+
+    self.assertNotIn('mtu', network())
+    self.assertEqual(network(networkMtu=8896)['mtu'], 8896)
+    self.assertEqual(network(networkMtu=1500, highSecurityNetwork=True)['mtu'],
+                     1500)
+    with self.assertRaises(ValueError):
+      network(networkMtu=9000)
+
+  def test_bucket_location(self):
+    """Buckets are placed in the given location, or the US by default."""
+
+    def buckets(**properties):
+      props = dict(self.context.properties, **properties)
+      resources = expansion.expand('firecloud_project.py', props)['resources']
+      return [resource_with_name(resources, name)['properties']
+              for name in ['create-storage-logs-bucket',
+                           'create-cromwell-auth-bucket']]
+
+    for bucket in buckets():
+      self.assertNotIn('location', bucket)
+    for bucket in buckets(bucketLocation='us-central1',
+                          bucketLocationType='region'):
+      self.assertEqual(bucket['location'], 'us-central1')
+      self.assertNotIn('customPlacementConfig', bucket)
+    for bucket in buckets(bucketLocation='US', bucketLocationType='dual-region',
+                          bucketDataLocations=['us-central1', 'us-east4']):
+      self.assertEqual(bucket['location'], 'US')
+      self.assertEqual(bucket['customPlacementConfig'],
+                       {'dataLocations': ['us-central1', 'us-east4']})
+
+    for properties in [
+        # A region outside of the network.
+        {'bucketLocation': 'me-central1', 'bucketLocationType': 'region'},
+        # A location of another type.
+        {'bucketLocation': 'US', 'bucketLocationType': 'region'},
+        {'bucketLocation': 'us-central1'},
+        {'bucketLocationType': 'dual-region'},
+        {'bucketLocation': 'US', 'bucketDataLocations': ['us-central1', 'us-east4']},
+    ]:
+      with self.assertRaises(ValueError):
+        buckets(**properties)
+
+  def test_storage_logs_lifecycle(self):
+    """Storage logs move through colder classes, or Autoclass, until deleted."""
+
+    def bucket(**properties):
+      props = dict(self.context.properties, **properties)
+      resources = expansion.expand('firecloud_project.py', props)['resources']
+      return resource_with_name(resources,
+                                'create-storage-logs-bucket')['properties']
+
+    delete = {'action': {'type': 'Delete'}, 'condition': {'age': 180}}
+    self.assertEqual(bucket()['lifecycle'], {'rule': [delete]})
+    self.assertNotIn('autoclass', bucket())
+
+    properties = bucket(storageBucketLifecycleTiers=[
+        {'storageClass': 'NEARLINE', 'age': 7},
+        {'storageClass': 'COLDLINE', 'age': 30}])
+    self.assertEqual(properties['lifecycle']['rule'], [
+        {'action': {'type': 'SetStorageClass', 'storageClass': 'NEARLINE'},
+         'condition': {'age': 7, 'matchesStorageClass': ['STANDARD']}},
+        {'action': {'type': 'SetStorageClass', 'storageClass': 'COLDLINE'},
+         'condition': {'age': 30,
+                       'matchesStorageClass': ['STANDARD', 'NEARLINE']}},
+        delete])
+
+    properties = bucket(storageBucketAutoclass=True, storageBucketLifecycle=90)
+    self.assertEqual(properties['autoclass'], {'enabled': True})
+    self.assertEqual(properties['lifecycle']['rule'],
+                     [{'action': {'type': 'Delete'}, 'condition': {'age': 90}}])
+
+    for tiers, autoclass in [
+        # Warmer, or past the delete age.
+        ([{'storageClass': 'COLDLINE', 'age': 7},
+          {'storageClass': 'NEARLINE', 'age': 30}], False),
+        ([{'storageClass': 'NEARLINE', 'age': 30},
+          {'storageClass': 'COLDLINE', 'age': 7}], False),
+        ([{'storageClass': 'ARCHIVE', 'age': 365}], False),
+        ([{'storageClass': 'NEARLINE', 'age': 7}], True),
+    ]:
+      with self.assertRaises(ValueError):
+        bucket(storageBucketLifecycleTiers=tiers,
+               storageBucketAutoclass=autoclass)
+
+  def test_uniform_cromwell_auth_bucket(self):
+    """Uniform access grants the ACLs' access with bucket IAM bindings."""
+    props = dict(self.context.properties, cromwellAuthBucketAccess='uniform')
+    resources = expansion.expand('firecloud_project.py', props)['resources']
+
+    bucket = resource_with_name(resources, 'create-cromwell-auth-bucket')
+    self.assertNotIn('acl[]', bucket['properties'])
+    self.assertNotIn('defaultObjectAcl[]', bucket['properties'])
+    self.assertEqual(bucket['properties']['iamConfiguration'],
+                     {'uniformBucketLevelAccess': {'enabled': True}})
+
+    set_policy = resource_with_name(resources,
+                                    'set-cromwell-auth-bucket-iam-policy')
+    self.assertEqual(set_policy['properties']['bucket'],
+                     'cromwell-auth-$(ref.project.projectId)')
+    self.assertEqual(set_policy['metadata']['dependsOn'],
+                     ['create-cromwell-auth-bucket'])
+    owners = ['projectEditor:$(ref.project.projectId)',
+              'projectOwner:$(ref.project.projectId)']
+    self.assertEqual(set_policy['properties']['bindings'], [
+        {'role': 'roles/storage.legacyBucketOwner', 'members': owners},
+        {'role': 'roles/storage.legacyObjectOwner', 'members': owners},
+    ])
+
+    # Reader groups are granted read access to the bucket and its objects.
+    context = FakeContext()
+    context.properties.update({
+        'projectOwnersGroup': 'owners@firecloud.org',
+        'cromwellAuthBucketAccess': 'uniform',
+    })
+    bindings = project_template.create_cromwell_auth_bucket(
+        context, [])[1].to_dict()['properties']['bindings']
+    readers = ['group:owners@firecloud.org']
+    self.assertEqual(bindings[2:], [
+        {'role': 'roles/storage.legacyBucketReader', 'members': readers},
+        {'role': 'roles/storage.legacyObjectReader', 'members': readers},
+    ])
+
+    props['cromwellAuthBucketAccess'] = 'fine-grained'
+    resources = expansion.expand('firecloud_project.py', props)['resources']
+    bucket = resource_with_name(resources, 'create-cromwell-auth-bucket')
+    self.assertEqual(len(bucket['properties']['acl[]']), 2)
+    self.assertFalse([x for x in resources
+                      if x['name'] == 'set-cromwell-auth-bucket-iam-policy'])
+
+  def test_shared_vpc(self):
+    """A Shared VPC service project gets an attachment instead of a network."""
+    props = dict(self.context.properties, highSecurityNetwork=True,
+                 privateIpGoogleAccess=True,
+                 projectViewersGroup='viewers@firecloud.org',
+                 pubsubTopic='projects/my-project/topics/deployments',
+                 sharedVpc={
+                     'hostProject': 'host',
+                     'network': 'terra',
+                     'subnetworks': [{'region': 'us-central1', 'name': 'a'},
+                                     {'region': 'us-east1', 'name': 'b'}],
+                     'networkUsers': ['group:batch@firecloud.org'],
+                 })
+    config = expansion.expand('firecloud_project.py', props)
+    resources = config['resources']
+    # No network, subnetworks, firewall rules, routes or DNS.
+    self.assertFalse([x['name'] for x in resources if x.get('type') in (
+        'gcp-types/compute-v1:networks', 'gcp-types/compute-beta:subnetworks',
+        'gcp-types/compute-v1:firewalls', 'gcp-types/compute-v1:routes',
+        'gcp-types/dns-v1:managedZones')])
+    self.assertEqual(
+        sorted(x['name'] for x in resources if 'subnetwork' in x['name']),
+        ['get-subnetwork-iam-policy-us-central1-a',
+         'get-subnetwork-iam-policy-us-east1-b',
+         'patch-subnetwork-iam-policy-us-central1-a',
+         'patch-subnetwork-iam-policy-us-east1-b'])
+
+    attach = resource_with_name(resources, 'shared-vpc-attachment')
+    self.assertEqual(attach['action'],
+                     'gcp-types/compute-v1:compute.projects.enableXpnResource')
+    self.assertEqual(attach['properties'], {
+        'project': 'host',
+        'xpnResource': {'id': '$(ref.project.projectId)', 'type': 'PROJECT'}})
+
+    patch = resource_with_name(resources,
+                               'patch-subnetwork-iam-policy-us-east1-b')
+    self.assertEqual(patch['properties']['region'], 'us-east1')
+    self.assertEqual(patch['properties']['resource'], 'b')
+    self.assertEqual(patch['properties']['gcpIamPolicyPatch']['add'], [{
+        'role': 'roles/compute.networkUser',
+        'members': [
+            'serviceAccount:$(ref.project.projectNumber)@cloudservices.gserviceaccount.com',
+            'serviceAccount:service-$(ref.project.projectNumber)@dataproc-accounts.iam.gserviceaccount.com',
+            'serviceAccount:service-$(ref.project.projectNumber)@container-engine-robot.iam.gserviceaccount.com',
+            'group:viewers@firecloud.org',
+            'group:batch@firecloud.org',
+        ]}])
+    # Dataproc is an optional API, so its service agent only exists once the
+    # optional APIs are enabled.
+    self.assertEqual(attach['metadata']['dependsOn'], ['api-optional-0'])
+
+    # Service agents of APIs the workload profile doesn't enable don't exist.
+    config = expansion.expand('firecloud_project.py', dict(
+        props, workloadProfile='bigquery-only'))
+    patch = resource_with_name(config['resources'],
+                               'patch-subnetwork-iam-policy-us-east1-b')
+    members = patch['properties']['gcpIamPolicyPatch']['add'][0]['members']
+    self.assertFalse([m for m in members if m.startswith('serviceAccount:service-')])
+    attach = resource_with_name(config['resources'], 'shared-vpc-attachment')
+    self.assertNotIn('api-optional-0', attach['metadata']['dependsOn'])
+
+    # Notifications wait for the attachment, and describe the host network.
+    completed = resource_with_name(resources, 'pubsub-notification-COMPLETED')
+    self.assertEqual(completed['metadata']['dependsOn'], [
+        'shared-vpc-attachment',
+        'get-subnetwork-iam-policy-us-central1-a',
+        'patch-subnetwork-iam-policy-us-central1-a',
+        'get-subnetwork-iam-policy-us-east1-b',
+        'patch-subnetwork-iam-policy-us-east1-b',
+    ])
+    attributes = completed['properties']['messages'][0]['attributes']
+    self.assertEqual(attributes['networkSelfLink'],
+                     'https://www.googleapis.com/compute/v1/projects/host/global/networks/terra')
+    self.assertEqual(attributes['subnetworkSelfLink.us-east1'],
+                     'https://www.googleapis.com/compute/v1/projects/host/regions/us-east1/subnetworks/b')
+    self.assertTrue(resource_with_name(resources, 'delete-default-network'))
+
+    props['sharedVpc'] = dict(props['sharedVpc'], subnetworks=[
+        {'region': 'us-east1', 'name': 'a'}, {'region': 'us-east1', 'name': 'b'}])
+    with self.assertRaises(ValueError):
+      expansion.expand('firecloud_project.py', props)
+
+  def test_optional_apis_are_off_the_critical_path(self):
+    """Nothing but their own notification waits for the optional APIs."""
+    props = dict(self.context.properties, highSecurityNetwork=True,
+                 pubsubTopic='projects/my-project/topics/deployments')
+    resources = expansion.expand('firecloud_project.py', props)['resources']
+
+    optional = resource_with_name(resources, 'api-optional-0')
+    self.assertEqual(optional['properties']['serviceIds'],
+                     sorted(firecloud_project.OPTIONAL_APIS))
+    self.assertEqual(optional['metadata']['dependsOn'], ['api-0'])
+
+    notified = resource_with_name(
+        resources, 'pubsub-notification-OPTIONAL_APIS_ENABLED')
+    self.assertEqual(notified['metadata']['dependsOn'], ['api-optional-0'])
+    for resource in resources:
+      if resource is not notified:
+        self.assertNotIn('api-optional-0',
+                         resource.get('metadata', {}).get('dependsOn', []))
+
+  def test_workload_profiles(self):
+    """Workload profiles pick the APIs to enable, and are labeled."""
+
+    def project_properties():
+      resources = firecloud_project.generate_config(self.context)['resources']
+      return resource_with_name(resources, 'fc-project')['properties']
+
+    properties = project_properties()
+    self.assertEqual(
+        len(properties['activateApis'] + properties['activateOptionalApis']),
+        len(firecloud_project.FIRECLOUD_REQUIRED_APIS))
+    self.assertEqual(properties['labels']['firecloud-workload-profile'], 'full')
+
+    self.context.properties['workloadProfile'] = 'bigquery-only'
+    properties = project_properties()
+    self.assertIn('bigquery-json.googleapis.com', properties['activateApis'])
+    self.assertIn('compute.googleapis.com', properties['activateApis'])
+    self.assertNotIn('dataproc.googleapis.com', properties['activateApis'])
+    self.assertEqual(properties['activateOptionalApis'], [])
+    self.assertEqual(properties['labels']['firecloud-workload-profile'],
+                     'bigquery-only')
+
+    # Every profile enables a subset of the full list, in the same order.
+    for profile in firecloud_project.WORKLOAD_PROFILES:
+      self.context.properties['workloadProfile'] = profile
+      properties = project_properties()
+      for apis in (properties['activateApis'], properties['activateOptionalApis']):
+        self.assertEqual(apis, [api for api in firecloud_project.FIRECLOUD_REQUIRED_APIS
+                                if api in apis])
+
+    self.context.properties['workloadProfile'] = 'everything'
+    with self.assertRaises(ValueError):
+      firecloud_project.generate_config(self.context)
+
+  def test_child_templates_pass_string_depends_on(self):
+    """Child templates pass an unresolved dependsOn reference on as is.
+
+    Deployment Manager hands a reference to a list of names to the child
+    template as a string, which expansion.py resolves beforehand.
+    """
+    depends_on = '$(ref.fc-project.resourceNames)'
+
+    def resource(template, resource_name, properties):
+      context = FakeContext()
+      context.properties.update(properties, dependsOn=depends_on)
+      config = template.generate_config(context)
+      return resource_with_name(config['resources'], resource_name)
+
+    network = 'https://www.googleapis.com/compute/v1/projects/p/global/networks/n'
+    for template, name, properties in [
+        (network_template, 'network', {'resourceName': 'network', 'name': 'n',
+                                       'projectId': 'p'}),
+        (subnetwork_template, 'subnetwork_us-east1', {
+            'resourceName': 'subnetwork_us-east1', 'name': 'subnetwork',
+            'network': network, 'ipCidrRange': '10.128.0.0/20',
+            'region': 'us-east1', 'projectId': 'p'}),
+        (firewall_template, 'leonardo-ssl', {
+            'network': network, 'projectId': 'p',
+            'rules': [{'name': 'leonardo-ssl'}]}),
+        (dns_zone_template, 'private-google-access-dns-zone', {
+            'resourceName': 'private-google-access-dns-zone',
+            'network': network, 'projectId': 'p'}),
+        (shared_vpc_template, 'shared-vpc-attachment', {
+            'resourceName': 'shared-vpc-attachment', 'hostProject': 'host',
+            'network': 'n', 'networkUsers': [], 'projectId': 'p',
+            'subnetworks': [{'region': 'us-east1', 'name': 'a'}]}),
+        (firewall_policy_template, 'firecloud-policy', {
+            'resourceName': 'firecloud-policy', 'parentId': 'folders/1',
+            'shortName': 'firecloud'}),
+    ]:
+      self.assertEqual(
+          resource(template, name, properties)['metadata']['dependsOn'],
+          depends_on)
+
+  def test_project_resource_references(self):
+    """Project resources only refer to resources defined alongside them."""
+    context = FakeContext()
+    context.properties.update({
+        'projectId': 'my-project',
+        'activateApis': ['compute.googleapis.com'],
+        'iamPolicies': [{'role': 'roles/viewer', 'members': ['group:a@b.org']}],
+        'parameterRecord': {'key': 'k', 'value': 'v'},
+    })
+    apis = project_template.create_apis(context)
+    api_names = [x.name for x in apis]
+    resources = (apis + project_template.create_iam_policies(context) +
+                 project_template.create_cromwell_auth_bucket(context, api_names) +
+                 project_template.create_parameter_record_object(context, api_names) +
+                 project_template.delete_default_network(api_names))
+    self.assertEqual(model.dangling_names(resources), ['project', 'billing'])
+    self.assertEqual(model.dangling_names(resources, ['project', 'billing']), [])
+
+    bucket = resource_with_name([x.to_dict() for x in resources],
+                                'create-cromwell-auth-bucket')
+    self.assertEqual(bucket['properties']['name'],
+                     'cromwell-auth-$(ref.project.projectId)')
+    self.assertEqual(bucket['metadata'], {'dependsOn': api_names})
+
   def test_satisfy_label_requirements(self):
     """Tests the logic in converting params into labels"""
 
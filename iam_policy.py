@@ -0,0 +1,180 @@
+"""Applies FireCloud IAM grants to a project policy with etag-based retries.
+
+Deployment Manager's getIamPolicy / setIamPolicy action pair (see
+templates/project.py) fails the whole deployment when another writer (e.g. Sam
+or Rawls) changes the project policy between the two calls. When the project
+template is run with iamPolicyPatchMode: deferred, the IAM grants are instead
+exposed as the 'iamPolicies' template output and can be applied with this
+module, which carries the policy etag through the read-modify-write cycle and
+re-reads and re-merges the policy whenever Cloud Resource Manager reports a
+conflicting concurrent write.
+
+Example:
+  python iam_policy.py --project my-project --policies policies.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+
+CLOUD_RESOURCE_MANAGER_ENDPOINT = 'https://cloudresourcemanager.googleapis.com'
+
+# The policy version read and written. Policies with conditional role bindings
+# are only returned whole at version 3; reading them at an earlier version
+# (the default) and writing them back would drop the conditions.
+IAM_POLICY_VERSION = 3
+
+# Cloud Resource Manager answers a setIamPolicy call carrying a stale etag with
+# 409 (ABORTED). 412 is included for parity with other IAM-enabled APIs.
+CONFLICT_STATUS_CODES = (409, 412)
+
+
+class ConcurrentPolicyModificationError(Exception):
+  """Raised when a policy patch keeps conflicting with concurrent writers."""
+
+
+class CloudResourceManagerClient(object):
+  """A minimal client for the Cloud Resource Manager v1 IAM methods.
+
+  The endpoint is configurable so that the retry logic can be exercised against
+  a local fake server.
+  """
+
+  def __init__(self, endpoint=CLOUD_RESOURCE_MANAGER_ENDPOINT,
+               access_token=None, timeout=30):
+    self.endpoint = endpoint.rstrip('/')
+    self.access_token = access_token
+    self.timeout = timeout
+
+  def get_iam_policy(self, project_id):
+    return self._post('/v1/projects/{}:getIamPolicy'.format(project_id), {
+      'options': {'requestedPolicyVersion': IAM_POLICY_VERSION},
+    })
+
+  def set_iam_policy(self, project_id, policy):
+    return self._post('/v1/projects/{}:setIamPolicy'.format(project_id),
+                      {'policy': policy})
+
+  def _post(self, path, body):
+    headers = {'Content-Type': 'application/json'}
+    if self.access_token:
+      headers['Authorization'] = 'Bearer {}'.format(self.access_token)
+    request = urllib.request.Request(
+      self.endpoint + path,
+      data=json.dumps(body).encode('utf-8'),
+      headers=headers,
+      method='POST')
+    with urllib.request.urlopen(request, timeout=self.timeout) as response:
+      return json.loads(response.read().decode('utf-8'))
+
+
+def merge_bindings(policy, additions):
+  """Merges role grants into an IAM policy.
+
+  The input policy is left untouched. Its etag (and any other fields) are
+  carried over to the result, so that writing the result back fails if the
+  policy has changed since it was read. Conditional bindings are kept as they
+  are, and a policy holding any is written at IAM_POLICY_VERSION, as
+  setIamPolicy requires.
+
+  Arguments:
+    policy: an IAM policy, as returned by getIamPolicy.
+    additions: a list of {'role': ..., 'members': [...]} grants, in the format
+      of the project template's iamPolicies property.
+
+  Returns:
+    A new IAM policy containing the union of the existing and added bindings.
+  """
+  merged = dict(policy)
+  bindings = [dict(binding, members=list(binding.get('members', [])))
+              for binding in policy.get('bindings', [])]
+  # Conditional bindings are never merged into; grants are added to the
+  # unconditional binding for the role.
+  by_role = {b['role']: b for b in bindings if 'condition' not in b}
+
+  for addition in additions:
+    binding = by_role.get(addition['role'])
+    if binding is None:
+      binding = {'role': addition['role'], 'members': []}
+      by_role[addition['role']] = binding
+      bindings.append(binding)
+    for member in addition['members']:
+      if member not in binding['members']:
+        binding['members'].append(member)
+
+  merged['bindings'] = bindings
+  if any('condition' in binding for binding in bindings):
+    merged['version'] = IAM_POLICY_VERSION
+  return merged
+
+
+def patch_iam_policy(client, project_id, additions, max_attempts=5,
+                     backoff_seconds=1.0, sleep=time.sleep):
+  """Adds role grants to a project policy, retrying on concurrent writes.
+
+  Each attempt re-reads the policy, merges the grants into it and writes it
+  back with the etag that was read. A conflict response means another writer
+  got in between, so the cycle starts over with exponential backoff.
+
+  Arguments:
+    client: a CloudResourceManagerClient.
+    project_id: the project whose policy should be patched.
+    additions: a list of {'role': ..., 'members': [...]} grants.
+    max_attempts: the number of read-merge-write cycles to try.
+    backoff_seconds: the delay before the first retry; doubled for each
+      further retry.
+    sleep: the function used to wait between attempts.
+
+  Returns:
+    The resulting IAM policy.
+
+  Raises:
+    ConcurrentPolicyModificationError: if every attempt conflicted.
+  """
+  for attempt in range(max_attempts):
+    policy = client.get_iam_policy(project_id)
+    merged = merge_bindings(policy, additions)
+    if merged['bindings'] == policy.get('bindings', []):
+      # Every grant is already present; there is nothing to write.
+      return policy
+    try:
+      return client.set_iam_policy(project_id, merged)
+    except urllib.error.HTTPError as e:
+      if e.code not in CONFLICT_STATUS_CODES:
+        raise
+    if attempt + 1 < max_attempts:
+      sleep(backoff_seconds * (2 ** attempt))
+
+  raise ConcurrentPolicyModificationError(
+    'IAM policy for project {} changed concurrently on each of {} '
+    'attempts'.format(project_id, max_attempts))
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--project', required=True,
+                      help='The ID of the project to patch.')
+  parser.add_argument('--policies', required=True,
+                      help='A JSON file holding the iamPolicies list.')
+  parser.add_argument('--endpoint', default=CLOUD_RESOURCE_MANAGER_ENDPOINT,
+                      help='The Cloud Resource Manager endpoint to call.')
+  parser.add_argument('--max-attempts', type=int, default=5)
+  args = parser.parse_args(argv)
+
+  with open(args.policies) as f:
+    additions = json.load(f)
+
+  client = CloudResourceManagerClient(
+    endpoint=args.endpoint,
+    access_token=os.environ.get('GOOGLE_OAUTH_ACCESS_TOKEN'))
+  policy = patch_iam_policy(client, args.project, additions,
+                            max_attempts=args.max_attempts)
+  json.dump(policy, sys.stdout, indent=2, sort_keys=True)
+  sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,162 @@
+import http.server
+import json
+import threading
+import unittest
+
+import iam_policy
+
+
+class FakeCloudResourceManager(http.server.BaseHTTPRequestHandler):
+  """Serves getIamPolicy / setIamPolicy for a single in-memory policy.
+
+  The policy etag changes on every write, and writes carrying a stale etag are
+  rejected with 409, as in Cloud Resource Manager.
+  """
+
+  def do_POST(self):
+    server = self.server
+    body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+    if self.path.endswith(':getIamPolicy'):
+      server.get_calls += 1
+      server.requested_versions.append(
+        body.get('options', {}).get('requestedPolicyVersion'))
+      response = server.policy
+      if server.concurrent_writes:
+        # Simulate another writer changing the policy right after our read.
+        server.concurrent_writes.pop(0)(server)
+    elif self.path.endswith(':setIamPolicy'):
+      server.set_calls += 1
+      if body['policy'].get('etag') != server.policy['etag']:
+        self.send_error(409, 'ABORTED')
+        return
+      server.write(body['policy'])
+      response = server.policy
+    else:
+      self.send_error(404)
+      return
+    data = json.dumps(response).encode('utf-8')
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+  def log_message(self, *args):
+    pass
+
+
+class FakeServer(http.server.HTTPServer):
+
+  def __init__(self):
+    http.server.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                    FakeCloudResourceManager)
+    self.version = 0
+    self.policy = {'etag': 'BwV0', 'bindings': []}
+    self.concurrent_writes = []
+    self.get_calls = 0
+    self.set_calls = 0
+    self.requested_versions = []
+
+  def write(self, policy):
+    self.version += 1
+    self.policy = dict(policy, etag='BwV{}'.format(self.version))
+
+
+def add_sam_binding(server):
+  server.write(dict(server.policy, bindings=server.policy['bindings'] + [
+    {'role': 'roles/viewer', 'members': ['group:sam-managed@firecloud.org']},
+  ]))
+
+
+class IamPolicyTest(unittest.TestCase):
+
+  def setUp(self):
+    self.server = FakeServer()
+    self.thread = threading.Thread(target=self.server.serve_forever)
+    self.thread.daemon = True
+    self.thread.start()
+    self.client = iam_policy.CloudResourceManagerClient(
+      endpoint='http://127.0.0.1:{}'.format(self.server.server_port))
+    self.additions = [
+      {'role': 'roles/viewer', 'members': ['group:owners@firecloud.org']},
+      {'role': 'roles/editor', 'members': ['serviceAccount:rawls@firecloud.org']},
+    ]
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+  def test_merge_bindings(self):
+    """Grants are unioned into existing bindings without mutating the input."""
+    policy = {
+      'etag': 'abc',
+      'bindings': [{'role': 'roles/viewer', 'members': ['user:a@example.com']}],
+    }
+    merged = iam_policy.merge_bindings(policy, self.additions)
+    self.assertEqual(merged, {
+      'etag': 'abc',
+      'bindings': [
+        {'role': 'roles/viewer',
+         'members': ['user:a@example.com', 'group:owners@firecloud.org']},
+        {'role': 'roles/editor',
+         'members': ['serviceAccount:rawls@firecloud.org']},
+      ],
+    })
+    self.assertEqual(policy['bindings'][0]['members'], ['user:a@example.com'])
+
+  def test_patch_without_conflict(self):
+    policy = iam_policy.patch_iam_policy(self.client, 'my-project',
+                                         self.additions, sleep=lambda s: None)
+    self.assertEqual(self.server.set_calls, 1)
+    self.assertEqual(policy['etag'], 'BwV1')
+    self.assertEqual([b['role'] for b in policy['bindings']],
+                     ['roles/viewer', 'roles/editor'])
+
+  def test_patch_retries_and_remerges_on_conflict(self):
+    """A concurrent write is kept, and our grants are merged on top of it."""
+    self.server.concurrent_writes.append(add_sam_binding)
+    delays = []
+    policy = iam_policy.patch_iam_policy(self.client, 'my-project',
+                                         self.additions, sleep=delays.append)
+    self.assertEqual(self.server.get_calls, 2)
+    self.assertEqual(self.server.set_calls, 2)
+    self.assertEqual(delays, [1.0])
+    viewer = [b for b in policy['bindings'] if b['role'] == 'roles/viewer'][0]
+    self.assertEqual(viewer['members'], ['group:sam-managed@firecloud.org',
+                                         'group:owners@firecloud.org'])
+
+  def test_patch_keeps_conditional_bindings(self):
+    """Policies are read at version 3, and their conditions written back."""
+    expiring = {
+      'role': 'roles/viewer',
+      'members': ['user:contractor@example.com'],
+      'condition': {'title': 'expires',
+                    'expression': 'request.time < timestamp("2027-01-01T00:00:00Z")'},
+    }
+    self.server.policy = {'etag': 'BwV0', 'version': 3, 'bindings': [expiring]}
+    policy = iam_policy.patch_iam_policy(self.client, 'my-project',
+                                         self.additions, sleep=lambda s: None)
+    self.assertEqual(self.server.requested_versions, [3])
+    self.assertEqual(policy['version'], 3)
+    self.assertEqual(policy['bindings'][0], expiring)
+    # The grant goes to a new, unconditional binding for the role.
+    self.assertEqual(policy['bindings'][1], {
+      'role': 'roles/viewer', 'members': ['group:owners@firecloud.org']})
+
+  def test_patch_is_noop_when_grants_present(self):
+    iam_policy.patch_iam_policy(self.client, 'my-project', self.additions,
+                                sleep=lambda s: None)
+    iam_policy.patch_iam_policy(self.client, 'my-project', self.additions,
+                                sleep=lambda s: None)
+    self.assertEqual(self.server.set_calls, 1)
+
+  def test_patch_gives_up_after_max_attempts(self):
+    self.server.concurrent_writes.extend([add_sam_binding] * 3)
+    with self.assertRaises(iam_policy.ConcurrentPolicyModificationError):
+      iam_policy.patch_iam_policy(self.client, 'my-project', self.additions,
+                                  max_attempts=3, sleep=lambda s: None)
+    self.assertEqual(self.server.set_calls, 3)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,228 @@
+"""Generates configs migrating existing projects to the current template version.
+
+Re-deploying the full template onto thousands of legacy projects isn't
+feasible. Instead, generate_migration reads the template version a project
+was created with (its firecloud-project-template-version label) and its
+parameters, and emits only the resources that bring the project up to
+FIRECLOUD_PROJECT_TEMPLATE_VERSION_ID. The result is a plain config, to be
+deployed as a separate, short-lived deployment:
+
+  2: adds the Private Google Access route, subnetwork settings and DNS zone, if
+     the project should have a high-security network with
+     privateIpGoogleAccess.
+  3: removes the billing.projectManager grant from the project owners group.
+  4: stores the parameter record in the storage logs bucket.
+
+Finally, the project labels are replaced with those the current template
+would set, which records the new version.
+"""
+import json
+
+import expansion
+import firecloud_project
+from templates import network as network_template
+from templates import project as project_template
+
+VERSION_LABEL = 'firecloud-project-template-version'
+DNS_ZONE_TEMPLATE = 'templates/private_google_access_dns_zone.py'
+COMPUTE_URL = 'https://www.googleapis.com/compute/v1/'
+
+# Boolean parameters that survive the lossy param--* labels of versions 2 and 3.
+LEGACY_LABELED_SWITCHES = ['highSecurityNetwork', 'privateIpGoogleAccess', 'enableFlowLogs']
+
+
+def recorded_version(labels):
+  """Returns the template version a project was created with.
+
+  Projects created before version 2 carry no version label.
+  """
+  return labels.get(VERSION_LABEL, '1')
+
+
+def recorded_properties(labels, parameter_record=None):
+  """Returns the parameters a project was created with, as far as recorded.
+
+  Arguments:
+    labels: the project's labels.
+    parameter_record: the firecloud-project-parameters metadata value of the
+      project's parameter record object, if it has one.
+
+  Returns:
+    A dict of properties. For projects without a parameter record, only the
+    boolean switches can be recovered from the param--* labels.
+  """
+  if parameter_record:
+    return firecloud_project.decompress_parameter_record(parameter_record)['properties']
+
+  properties = {}
+  for name in LEGACY_LABELED_SWITCHES:
+    value = labels.get('param--' + name.lower())
+    if value is not None:
+      properties[name] = value == 'true'
+  return properties
+
+
+def _network_self_link(project_id):
+  return '{}projects/{}/global/networks/{}'.format(
+    COMPUTE_URL, project_id, firecloud_project.FIRECLOUD_VPC_NETWORK_NAME)
+
+
+def migrate_to_v2(properties):
+  """Adds Private Google Access to an existing high-security network."""
+  if not (properties.get('highSecurityNetwork', False) and
+          properties.get('privateIpGoogleAccess', False)):
+    return []
+
+  project_id = properties['projectId']
+  network = _network_self_link(project_id)
+  resources = [
+    network_template.create_private_google_access_route(
+      project_id, network, []).to_dict()
+  ]
+  for region in firecloud_project.FIRECLOUD_NETWORK_REGIONS:
+    resources.append({
+      'name': 'set-private-ip-google-access-' + region,
+      'action': ('gcp-types/compute-v1:' +
+                 'compute.subnetworks.setPrivateIpGoogleAccess'),
+      'metadata': {
+        'runtimePolicy': ['CREATE'],
+      },
+      'properties': {
+        'project': project_id,
+        'region': region,
+        'subnetwork': firecloud_project.FIRECLOUD_VPC_SUBNETWORK_NAME,
+        'privateIpGoogleAccess': True,
+      },
+    })
+
+  dns_resources, _ = expansion.expand_template(
+    expansion.resolve_template_path(DNS_ZONE_TEMPLATE, expansion.ROOT_DIR),
+    {
+      'resourceName': 'private-google-access-dns-zone',
+      'projectId': project_id,
+      'network': network,
+    })
+  resources.extend(dns_resources)
+  return resources
+
+
+def migrate_to_v3(properties):
+  """Removes the billing permissions of the project owners group."""
+  if 'projectOwnersGroup' not in properties:
+    return []
+
+  project_id = properties['projectId']
+  return [
+    {
+      'name': 'get-iam-policy',
+      'action': ('gcp-types/cloudresourcemanager-v1:' +
+                 'cloudresourcemanager.projects.getIamPolicy'),
+      'properties': {
+        'resource': project_id,
+      },
+      'metadata': {
+        'runtimePolicy': ['CREATE'],
+      },
+    },
+    {
+      'name': 'remove-billing-permissions',
+      'action': ('gcp-types/cloudresourcemanager-v1:' +
+                 'cloudresourcemanager.projects.setIamPolicy'),
+      'properties': {
+        'resource': project_id,
+        'policy': '$(ref.get-iam-policy)',
+        'gcpIamPolicyPatch': {
+          'remove': [{
+            'role': 'roles/billing.projectManager',
+            'members': ['group:{}'.format(properties['projectOwnersGroup'])],
+          }],
+        },
+      },
+      'metadata': {
+        'dependsOn': ['get-iam-policy'],
+        'runtimePolicy': ['CREATE'],
+      },
+    },
+  ]
+
+
+def migrate_to_v4(properties):
+  """Stores the parameter record in the storage logs bucket."""
+  context = expansion.Context(properties)
+  record_context = expansion.Context({
+    'parameterRecord': {
+      'key': firecloud_project.PARAMETER_RECORD_KEY,
+      'value': firecloud_project.compress_parameter_record(
+        firecloud_project.create_parameter_record(context)),
+    },
+  })
+  # The storage logs bucket already exists.
+  return [resource.to_dict() for resource in
+          project_template.create_parameter_record_object(record_context, [])]
+
+
+# Each migration brings a project from the previous version to the given one.
+MIGRATIONS = [
+  ('2', migrate_to_v2),
+  ('3', migrate_to_v3),
+  ('4', migrate_to_v4),
+]
+
+
+def update_labels(properties):
+  """Replaces the project labels with those of the current template."""
+  return {
+    'name': 'update-project-labels',
+    'action': ('gcp-types/cloudresourcemanager-v1:' +
+               'cloudresourcemanager.projects.update'),
+    'properties': {
+      'projectId': properties['projectId'],
+      'name': properties.get('projectName', properties['projectId']),
+      'labels': firecloud_project.project_labels(properties),
+    },
+    'metadata': {
+      'runtimePolicy': ['CREATE'],
+    },
+  }
+
+
+def _pin_project_references(value, project_id):
+  """Replaces references to the 'project' resource by the literal project ID.
+
+  The project isn't part of the migration deployment, so it can't be
+  referenced.
+  """
+  return json.loads(json.dumps(value).replace('$(ref.project.projectId)', project_id))
+
+
+def generate_migration(labels, properties, parameter_record=None):
+  """Generates the config migrating a project to the current template version.
+
+  Arguments:
+    labels: the project's current labels.
+    properties: the project's template properties. These take precedence over
+      the recorded ones, and must be given for projects without a parameter
+      record.
+    parameter_record: the firecloud-project-parameters metadata value of the
+      project's parameter record object, if any.
+
+  Returns:
+    A config dict, whose resources are empty if the project is up to date.
+  """
+  version = recorded_version(labels)
+  properties = dict(recorded_properties(labels, parameter_record), **properties)
+
+  resources = []
+  for target_version, migrate in MIGRATIONS:
+    if int(target_version) > int(version):
+      resources.extend(migrate(properties))
+
+  current = firecloud_project.FIRECLOUD_PROJECT_TEMPLATE_VERSION_ID
+  if int(version) < int(current):
+    # Run last, so the new version is only recorded once everything else
+    # succeeded.
+    label_update = update_labels(properties)
+    label_update['metadata']['dependsOn'] = [r['name'] for r in resources]
+    resources.append(label_update)
+
+  return {'resources': _pin_project_references(resources, properties['projectId'])}
@@ -0,0 +1,90 @@
+import unittest
+
+import expansion
+import firecloud_project
+import migration
+
+
+class MigrationTest(unittest.TestCase):
+
+  def setUp(self):
+    self.properties = {
+        'billingAccountId': '111-111',
+        'parentOrganization': '12345',
+        'projectId': 'my-project',
+        'projectOwnersGroup': 'proxy-group-owners@firecloud.org',
+        'highSecurityNetwork': True,
+        'privateIpGoogleAccess': True,
+    }
+
+  def resource_names(self, config):
+    return [x['name'] for x in config['resources']]
+
+  def test_migrate_from_v1(self):
+    """Version 1 projects get every step, and no project references."""
+    config = migration.generate_migration({}, self.properties)
+    names = self.resource_names(config)
+    for name in ('private-google-access-route', 'private-google-access-dns-zone',
+                 'set-private-ip-google-access-us-central1',
+                 'remove-billing-permissions', 'write-parameter-record'):
+      self.assertIn(name, names)
+    self.assertEqual(names[-1], 'update-project-labels')
+    self.assertEqual(config['resources'][-1]['metadata']['dependsOn'],
+                     names[:-1])
+    self.assertNotIn('$(ref.project.', str(config))
+
+    labels = config['resources'][-1]['properties']['labels']
+    self.assertEqual(labels['firecloud-project-template-version'],
+                     firecloud_project.FIRECLOUD_PROJECT_TEMPLATE_VERSION_ID)
+
+  def test_migrate_from_v2_labels(self):
+    """Version 2 projects only lose billing permissions and gain a record."""
+    labels = {
+        'firecloud-project-template-version': '2',
+        'param--highsecuritynetwork': 'true',
+        'param--privateipgoogleaccess': 'false',
+    }
+    self.assertEqual(migration.recorded_properties(labels), {
+        'highSecurityNetwork': True,
+        'privateIpGoogleAccess': False,
+    })
+    del self.properties['privateIpGoogleAccess']
+    config = migration.generate_migration(labels, self.properties)
+    self.assertEqual(self.resource_names(config), [
+        'get-iam-policy', 'remove-billing-permissions', 'write-parameter-record',
+        'update-project-labels'
+    ])
+
+  def test_migrate_to_v4_writes_record_object(self):
+    """The parameter record is written to the existing storage logs bucket."""
+    labels = {'firecloud-project-template-version': '3'}
+    config = migration.generate_migration(labels, self.properties)
+    record = [x for x in config['resources']
+              if x['name'] == 'write-parameter-record'][0]
+    self.assertEqual(record['properties']['bucket'], 'storage-logs-my-project')
+    self.assertEqual(record['metadata']['dependsOn'], [])
+    value = record['properties']['metadata'][
+        firecloud_project.PARAMETER_RECORD_KEY]
+    self.assertEqual(
+        firecloud_project.decompress_parameter_record(value)['properties'],
+        self.properties)
+
+  def test_current_project_is_unchanged(self):
+    """Projects created by the current template need no migration."""
+    config = expansion.expand('firecloud_project.py', self.properties)
+    project = [x for x in config['resources'] if x['name'] == 'project'][0]
+    record = [x for x in config['resources']
+              if x['name'] == 'write-parameter-record'][0]
+    parameter_record = record['properties']['metadata'][
+        firecloud_project.PARAMETER_RECORD_KEY]
+
+    self.assertEqual(
+        migration.recorded_properties(project['properties']['labels'],
+                                      parameter_record), self.properties)
+    config = migration.generate_migration(project['properties']['labels'], {},
+                                          parameter_record)
+    self.assertEqual(config, {'resources': []})
+
+
+if __name__ == '__main__':
+  unittest.main()
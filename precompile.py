@@ -0,0 +1,290 @@
+"""Precompiles FireCloud project manifests for every feature-flag combination.
+
+The top-level template only branches on a handful of switches. This module
+expands firecloud_project.py once per combination of those switches, with
+placeholders standing in for the per-project properties, and stores each
+result as a static manifest. Creating a project then only requires picking
+the manifest for its switches and substituting its properties, and the
+rendered configuration deploys without any template execution by Deployment
+Manager:
+
+  python precompile.py build --base base.json --out manifests/
+  python precompile.py render --manifests manifests/ --properties p.json > c.json
+  gcloud deployment-manager deployments create my-project --config c.json
+
+Properties that are the same for every project (fcBillingGroup,
+fcProjectEditors, requesterPaysRole, ...) are fixed at build time from the
+--base file. Labels and the IAM action name suffix are derived from several
+properties at once, so they and the compressed parameter record are the only
+values computed at render time.
+
+Any other property a project sets must match its --base value: a manifest
+can't represent it otherwise, and rendering fails rather than ignore it.
+"""
+import argparse
+import itertools
+import json
+import os
+import re
+import sys
+
+import expansion
+import firecloud_project
+from templates import project as project_template
+
+TEMPLATE = 'firecloud_project.py'
+
+# Boolean switches of the top-level template.
+FEATURE_FLAGS = ['highSecurityNetwork', 'privateIpGoogleAccess', 'enableFlowLogs',
+                 'allocateSecondaryRanges']
+
+# Optional properties whose presence, rather than value, changes the manifest.
+OPTIONAL_PRESENCE_FLAGS = ['parentFolder', 'pubsubTopic', 'projectOwnersGroup',
+                           'projectViewersGroup']
+
+# Switches that only have an effect on high-security networks.
+HIGH_SECURITY_NETWORK_FLAGS = ['privateIpGoogleAccess', 'enableFlowLogs',
+                               'allocateSecondaryRanges']
+
+# Workload profiles other than the default each get their own manifests, as
+# they change the APIs enabled.
+WORKLOAD_PROFILES = sorted(p for p in firecloud_project.WORKLOAD_PROFILES
+                           if p != firecloud_project.DEFAULT_WORKLOAD_PROFILE)
+
+# Per-project string properties, substituted at render time.
+PER_PROJECT_PROPERTIES = [
+  'billingAccountId',
+  'billingAccountFriendlyName',
+  'parentOrganization',
+  'parentFolder',
+  'projectId',
+  'projectName',
+  'projectOwnersGroup',
+  'projectViewersGroup',
+  'pubsubTopic',
+]
+
+# Base properties needing another, optional, property on high-security
+# networks. Manifests without it aren't built, and projects without it are
+# rejected, as the template would reject them.
+HIGH_SECURITY_NETWORK_REQUIREMENTS = {'firewallPolicy': 'parentFolder'}
+
+# Every property a project may set independently of the base properties.
+PRECOMPILED_PROPERTIES = frozenset(FEATURE_FLAGS + OPTIONAL_PRESENCE_FLAGS +
+                                   PER_PROJECT_PROPERTIES + ['workloadProfile'])
+
+PLACEHOLDER_PATTERN = re.compile(r'\{\{(\w+)\}\}')
+LABELS_PLACEHOLDER = '{{labels}}'
+IAM_POLICY_HASH_PLACEHOLDER = '{{iamPolicyHash}}'
+PARAMETER_RECORD_PLACEHOLDER = '{{parameterRecord}}'
+
+
+def placeholder(name):
+  return '{{' + name + '}}'
+
+
+def missing_requirements(base_properties, properties):
+  """Returns the properties the base properties need but a project lacks."""
+  if not properties.get('highSecurityNetwork', False):
+    return []
+  return sorted(required for name, required in
+                HIGH_SECURITY_NETWORK_REQUIREMENTS.items()
+                if name in base_properties and required not in properties)
+
+
+def check_properties(base_properties, properties):
+  """Raises a ValueError if a project sets properties no manifest represents.
+
+  Properties other than the switches and per-project strings are fixed at
+  build time, so a project may only repeat their base values. Projects
+  lacking a property the base properties require have no manifest either.
+  """
+  missing = missing_requirements(base_properties,
+                                 dict(base_properties, **properties))
+  if missing:
+    raise ValueError('The base properties require {} on high-security '
+                     'networks.'.format(', '.join(missing)))
+  unsupported = sorted(
+    name for name in properties if name not in PRECOMPILED_PROPERTIES and
+    (name not in base_properties or
+     properties[name] != base_properties[name]))
+  if unsupported:
+    raise ValueError(
+      'Precompiled manifests can\'t represent {}; set them in the base '
+      'properties for every project, or expand the template instead.'.format(
+        ', '.join(unsupported)))
+
+
+def combination_key(properties):
+  """Returns the name of the manifest matching a set of properties.
+
+  Switches that have no effect in the given combination are ignored, so that
+  equivalent combinations share a manifest.
+  """
+  enabled = [flag for flag in FEATURE_FLAGS if properties.get(flag, False)]
+  if 'highSecurityNetwork' not in enabled:
+    enabled = [f for f in enabled if f not in HIGH_SECURITY_NETWORK_FLAGS]
+  enabled.extend(f for f in OPTIONAL_PRESENCE_FLAGS if f in properties)
+  profile = properties.get('workloadProfile',
+                           firecloud_project.DEFAULT_WORKLOAD_PROFILE)
+  if profile != firecloud_project.DEFAULT_WORKLOAD_PROFILE:
+    enabled.append(profile)
+  return '-'.join(enabled) or 'default'
+
+
+def combinations(base_properties=None):
+  """Yields the switch properties of every distinct manifest.
+
+  Combinations lacking a property the base properties require are skipped.
+  """
+  seen = set()
+  flags = FEATURE_FLAGS + OPTIONAL_PRESENCE_FLAGS
+  profiles = [None] + WORKLOAD_PROFILES
+  for profile, values in itertools.product(
+      profiles, itertools.product([False, True], repeat=len(flags))):
+    properties = {}
+    for flag, value in zip(flags, values):
+      if not value:
+        continue
+      properties[flag] = True if flag in FEATURE_FLAGS else placeholder(flag)
+    if profile:
+      properties['workloadProfile'] = profile
+    if missing_requirements(base_properties or {}, properties):
+      continue
+    key = combination_key(properties)
+    if key not in seen:
+      seen.add(key)
+      yield key, properties
+
+
+def _iam_policy_hash(properties):
+  context = expansion.Context(properties)
+  return project_template.iam_policy_hash(
+    properties['projectId'], firecloud_project.create_iam_policies(context))
+
+
+def _parameter_record(properties):
+  context = expansion.Context(properties)
+  return firecloud_project.compress_parameter_record(
+    firecloud_project.create_parameter_record(context))
+
+
+def build_manifest(base_properties, switch_properties):
+  """Expands the template for one combination of switches.
+
+  Arguments:
+    base_properties: the properties shared by every project.
+    switch_properties: the switches of this combination, as produced by
+      combinations().
+
+  Returns:
+    The manifest text: a JSON configuration with placeholders.
+  """
+  properties = dict(base_properties)
+  for name in PER_PROJECT_PROPERTIES:
+    if name not in OPTIONAL_PRESENCE_FLAGS:
+      properties[name] = placeholder(name)
+  properties.update(switch_properties)
+
+  config = expansion.expand(TEMPLATE, properties)
+  for resource in config['resources']:
+    if resource.get('type') == 'cloudresourcemanager.v1.project':
+      resource['properties']['labels'] = LABELS_PLACEHOLDER
+
+  text = json.dumps(config, indent=2, sort_keys=True)
+  text = text.replace(_parameter_record(properties),
+                      PARAMETER_RECORD_PLACEHOLDER)
+  return text.replace(_iam_policy_hash(properties), IAM_POLICY_HASH_PLACEHOLDER)
+
+
+def build(base_properties, out_dir):
+  """Writes one manifest per distinct switch combination to out_dir.
+
+  Returns:
+    The list of manifest names written.
+  """
+  if not os.path.isdir(out_dir):
+    os.makedirs(out_dir)
+  names = []
+  for key, switch_properties in combinations(base_properties):
+    with open(os.path.join(out_dir, key + '.json'), 'w') as f:
+      f.write(build_manifest(base_properties, switch_properties))
+    names.append(key)
+  return names
+
+
+def render(manifest_text, base_properties, properties):
+  """Substitutes a project's properties into a precompiled manifest.
+
+  Arguments:
+    manifest_text: the manifest, as produced by build_manifest.
+    base_properties: the properties the manifest was built with.
+    properties: the per-project properties.
+
+  Returns:
+    A Deployment Manager configuration, as JSON text.
+
+  Raises:
+    ValueError: if the project sets properties the manifest can't represent,
+      or lacks a value for one of its placeholders.
+  """
+  check_properties(base_properties, properties)
+  properties = dict(base_properties, **properties)
+  values = {name: properties[name] for name in PER_PROJECT_PROPERTIES
+            if name in properties}
+  values.setdefault('projectName', properties['projectId'])
+  values.setdefault('billingAccountFriendlyName',
+                    properties['billingAccountId'])
+
+  labels = firecloud_project.project_labels(properties)
+  text = manifest_text.replace(json.dumps(LABELS_PLACEHOLDER),
+                               json.dumps(labels, sort_keys=True))
+  if IAM_POLICY_HASH_PLACEHOLDER in text:
+    values['iamPolicyHash'] = _iam_policy_hash(properties)
+  if PARAMETER_RECORD_PLACEHOLDER in text:
+    values['parameterRecord'] = _parameter_record(properties)
+
+  def substitute(match):
+    if match.group(1) not in values:
+      raise ValueError('No value for manifest placeholder {}'.format(
+        match.group(0)))
+    # Values are always substituted into JSON strings.
+    return json.dumps(str(values[match.group(1)]))[1:-1]
+
+  return PLACEHOLDER_PATTERN.sub(substitute, text)
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  subparsers = parser.add_subparsers(dest='command')
+  build_parser = subparsers.add_parser('build', help='Precompile manifests.')
+  build_parser.add_argument('--base', help='JSON file of shared properties.')
+  build_parser.add_argument('--out', required=True)
+  render_parser = subparsers.add_parser('render', help='Render a manifest.')
+  render_parser.add_argument('--base', help='JSON file of shared properties.')
+  render_parser.add_argument('--manifests', required=True)
+  render_parser.add_argument('--properties', required=True,
+                             help='JSON file of per-project properties.')
+  args = parser.parse_args(argv)
+
+  base_properties = {}
+  if args.base:
+    with open(args.base) as f:
+      base_properties = json.load(f)
+
+  if args.command == 'build':
+    for name in build(base_properties, args.out):
+      print(name)
+  elif args.command == 'render':
+    with open(args.properties) as f:
+      properties = json.load(f)
+    check_properties(base_properties, properties)
+    key = combination_key(dict(base_properties, **properties))
+    with open(os.path.join(args.manifests, key + '.json')) as f:
+      sys.stdout.write(render(f.read(), base_properties, properties))
+  else:
+    parser.print_help()
+
+
+if __name__ == '__main__':
+  main()
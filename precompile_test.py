@@ -0,0 +1,158 @@
+import json
+import unittest
+
+import expansion
+import precompile
+
+
+class PrecompileTest(unittest.TestCase):
+
+  def setUp(self):
+    self.base = {
+        'fcBillingGroup': 'terra-billing@firecloud.org',
+        'fcProjectEditors': ['serviceAccount:rawls@firecloud.org'],
+        'requesterPaysRole': 'roles/1234/RequesterPays',
+    }
+    self.project = {
+        'billingAccountId': 'billingAccounts/111-111',
+        'parentOrganization': '12345',
+        'projectId': 'my-project',
+        'projectOwnersGroup': 'proxy-group-owners@firecloud.org',
+        'projectViewersGroup': 'proxy-group-viewers@firecloud.org',
+    }
+
+  def assertRenderMatchesExpansion(self, switches, base=None):
+    base = dict(self.base, **(base or {}))
+    properties = dict(self.project, **switches)
+    key = precompile.combination_key(properties)
+    manifest = dict(precompile.combinations())[key]
+    text = precompile.build_manifest(base, manifest)
+    rendered = json.loads(precompile.render(text, base, properties))
+    expected = expansion.expand(precompile.TEMPLATE, dict(base, **properties))
+    self.assertEqual(rendered, json.loads(json.dumps(expected)))
+
+  def assertBaseOnly(self, properties, switches=None):
+    """Checks properties are precompiled from the base, not per project."""
+    self.assertRenderMatchesExpansion(switches or {}, base=properties)
+    text = self.manifest()
+    with self.assertRaises(ValueError):
+      precompile.render(text, self.base, dict(self.project, **properties))
+
+  def test_combinations(self):
+    """Equivalent switch combinations share a manifest."""
+    keys = [key for key, _ in precompile.combinations()]
+    self.assertEqual(len(keys), len(set(keys)))
+    # 36 network combinations, for each of the 4 workload profiles and each
+    # presence of the 2 proxy groups.
+    self.assertEqual(len(keys), 576)
+    self.assertEqual(precompile.combination_key({}), 'default')
+    self.assertEqual(precompile.combination_key({'enableFlowLogs': True}),
+                     'default')
+    self.assertEqual(
+        precompile.combination_key({
+            'highSecurityNetwork': True,
+            'enableFlowLogs': True,
+            'pubsubTopic': 'projects/p/topics/t',
+        }), 'highSecurityNetwork-enableFlowLogs-pubsubTopic')
+    self.assertEqual(
+        precompile.combination_key({'workloadProfile': 'notebooks'}),
+        'notebooks')
+
+  def test_render_default_network(self):
+    self.assertRenderMatchesExpansion({})
+
+  def test_render_high_security_network(self):
+    self.assertRenderMatchesExpansion({
+        'highSecurityNetwork': True,
+        'privateIpGoogleAccess': True,
+        'enableFlowLogs': True,
+        'parentFolder': '99999',
+        'pubsubTopic': 'projects/my-project/topics/deployments',
+        'projectName': 'My "quoted" project',
+    })
+
+  def test_render_workload_profile(self):
+    self.assertRenderMatchesExpansion({
+        'highSecurityNetwork': True,
+        'workloadProfile': 'batch-workflows',
+    })
+
+  def test_render_network_mtu(self):
+    self.assertBaseOnly({'networkMtu': 8896})
+
+  def test_render_cloud_nat(self):
+    self.assertBaseOnly({'cloudNat': {'minPortsPerVm': 1024}},
+                        {'highSecurityNetwork': True})
+
+  def test_render_dns_peering_network(self):
+    self.assertBaseOnly({
+        'privateGoogleAccessDnsPeeringNetwork':
+            'https://www.googleapis.com/compute/v1/projects/hub/global/'
+            'networks/hub',
+    }, {'highSecurityNetwork': True, 'privateIpGoogleAccess': True})
+
+  def test_render_google_api_access_path(self):
+    self.assertBaseOnly({'googleApiAccessPath': 'psc'},
+                        {'highSecurityNetwork': True,
+                         'privateIpGoogleAccess': True})
+
+  def test_render_bucket_location(self):
+    self.assertBaseOnly({'bucketLocation': 'us-central1',
+                         'bucketLocationType': 'region'})
+
+  def test_render_shared_vpc(self):
+    self.assertBaseOnly({
+        'sharedVpc': {
+            'hostProject': 'network-host',
+            'network': 'shared',
+            'subnetworks': [{'region': 'us-central1', 'name': 'workers'}],
+        },
+    })
+
+  def test_render_firewall_policy(self):
+    switches = {'highSecurityNetwork': True, 'parentFolder': '99999'}
+    self.assertBaseOnly({'firewallPolicy': '123456789'}, switches)
+
+    # The policy is associated with a folder, so projects need one.
+    base = dict(self.base, firewallPolicy='123456789')
+    keys = [key for key, _ in precompile.combinations(base)]
+    self.assertIn('highSecurityNetwork-parentFolder', keys)
+    self.assertIn('default', keys)
+    self.assertNotIn('highSecurityNetwork', keys)
+    text = self.manifest()
+    with self.assertRaises(ValueError):
+      precompile.render(text, base,
+                        dict(self.project, highSecurityNetwork=True))
+
+  def test_render_without_proxy_groups(self):
+    del self.project['projectOwnersGroup']
+    del self.project['projectViewersGroup']
+    self.assertRenderMatchesExpansion({})
+
+  def manifest(self):
+    key = precompile.combination_key(self.project)
+    return precompile.build_manifest(
+        self.base, dict(precompile.combinations())[key])
+
+  def test_render_requires_placeholder_values(self):
+    text = self.manifest()
+    del self.project['parentOrganization']
+    with self.assertRaises(ValueError):
+      precompile.render(text, self.base, self.project)
+
+  def test_render_rejects_unrepresented_properties(self):
+    """Properties fixed at build time can't be changed per project."""
+    text = self.manifest()
+    self.project['requesterPaysRole'] = 'roles/5678/RequesterPays'
+    with self.assertRaises(ValueError):
+      precompile.render(text, self.base, self.project)
+
+    self.project['requesterPaysRole'] = self.base['requesterPaysRole']
+    precompile.render(text, self.base, self.project)
+    self.project['storageBucketLifecycle'] = 30
+    with self.assertRaises(ValueError):
+      precompile.render(text, self.base, self.project)
+
+
+if __name__ == '__main__':
+  unittest.main()
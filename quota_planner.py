@@ -0,0 +1,210 @@
+"""Schedules batches of project deployments within API write quotas.
+
+Every resource in an expanded FireCloud manifest (see expansion.py) costs one
+or more API writes against some Google service: compute for networks,
+subnetworks, firewalls and routes, serviceusage for batchEnable, Cloud
+Resource Manager for the project and its IAM policy, and so on.
+count_writes tallies those writes per service, and plan schedules a batch of
+deployments so that no per-minute quota is exceeded, instead of discovering
+the quotas through 429 errors and retries.
+
+Quotas have one of three scopes:
+  shared:  charged to a project shared by the whole batch, e.g. the
+           Deployment Manager host project or the organization. Deployments
+           compete for these, so they are spread across minutes.
+  project: charged to each newly created project. These can't be relieved by
+           scheduling, so the planner only checks they are never exceeded.
+  host:    charged to a Shared VPC host project, for attaching service
+           projects to it and granting access to its subnetworks.
+           Deployments attaching to the same host compete for these, so they
+           are spread across minutes as well, per host.
+"""
+import collections
+import math
+
+SHARED = 'shared'
+PROJECT = 'project'
+HOST = 'host'
+
+# (service, scope) -> requests per minute. These mirror the usual default
+# limits; pass the values from the Cloud console quota page to plan() to
+# override them.
+DEFAULT_QUOTAS = {
+  ('cloudresourcemanager', SHARED): 30,
+  ('cloudresourcemanager-iam', SHARED): 600,
+  ('cloudbilling', SHARED): 300,
+  ('serviceusage', SHARED): 120,
+  ('compute', PROJECT): 1200,
+  ('compute', HOST): 1200,
+  ('storage', PROJECT): 1000,
+  ('dns', PROJECT): 600,
+  ('pubsub', SHARED): 6000,
+  ('iam', SHARED): 600,
+}
+
+# Resource types and actions, by the API service they write to. Read-only
+# actions (such as getIamPolicy) aren't writes and are absent.
+_SERVICE_PATTERNS = [
+  ('cloudresourcemanager.projects.setIamPolicy', 'cloudresourcemanager-iam'),
+  ('cloudresourcemanager.v1.project', 'cloudresourcemanager'),
+  ('projectBillingInfo', 'cloudbilling'),
+  ('serviceusage.services.batchEnable', 'serviceusage'),
+  ('compute', 'compute'),
+  ('storage', 'storage'),
+  ('dns', 'dns'),
+  ('pubsub.projects.topics.publish', 'pubsub'),
+  ('iam.projects.serviceAccounts', 'iam'),
+]
+
+# Action methods starting with these verbs only read, e.g. getIamPolicy or
+# firewallPolicies.getAssociation.
+_READ_ONLY_VERBS = ('get', 'list', 'aggregatedList')
+
+# Actions writing to a Shared VPC host project, named by their 'project'.
+_HOST_PROJECT_ACTIONS = (
+  'compute.projects.enableXpnResource',
+  'compute.subnetworks.setIamPolicy',
+)
+
+
+class PlanningError(Exception):
+  """Raised when deployments can't be scheduled within the quotas."""
+
+
+def write_service(resource):
+  """Returns the service a resource writes to, or None for reads."""
+  action = resource.get('action')
+  if action and action.rsplit('.', 1)[-1].startswith(_READ_ONLY_VERBS):
+    return None
+  kind = action or resource.get('type', '')
+  for pattern, service in _SERVICE_PATTERNS:
+    if pattern in kind:
+      return service
+  return 'other'
+
+
+def host_project(resource):
+  """Returns the Shared VPC host project a resource writes to, if any."""
+  if resource.get('action', '').endswith(_HOST_PROJECT_ACTIONS):
+    return resource['properties']['project']
+  return None
+
+
+def count_writes(config):
+  """Counts the API writes an expanded configuration makes, per service.
+
+  Writes to Shared VPC host projects are left out; see count_host_writes.
+
+  Arguments:
+    config: an expanded configuration, as returned by expansion.expand.
+
+  Returns:
+    A collections.Counter mapping service names to write counts.
+  """
+  writes = collections.Counter()
+  for resource in config['resources']:
+    service = write_service(resource)
+    if service and not host_project(resource):
+      writes[service] += 1
+  return writes
+
+
+def count_host_writes(config):
+  """Counts the API writes an expanded configuration makes to host projects.
+
+  Arguments:
+    config: an expanded configuration, as returned by expansion.expand.
+
+  Returns:
+    A collections.Counter mapping (service, host project) tuples to write
+    counts.
+  """
+  writes = collections.Counter()
+  for resource in config['resources']:
+    host = host_project(resource)
+    if host:
+      writes[(write_service(resource), host)] += 1
+  return writes
+
+
+def _per_minute(count, minutes):
+  return int(math.ceil(float(count) / minutes))
+
+
+def plan(deployments, quotas=None, deployment_minutes=1):
+  """Schedules deployments so that no per-minute write quota is exceeded.
+
+  Deployments are started in the given order, each in the earliest minute
+  that leaves room for its writes.
+
+  Arguments:
+    deployments: a list of (name, config) tuples, where config is an expanded
+      configuration.
+    quotas: a dict mapping (service, scope) tuples to per-minute limits.
+      Defaults to DEFAULT_QUOTAS.
+    deployment_minutes: the number of minutes a deployment's writes are
+      assumed to be spread over; at least 1.
+
+  Returns:
+    A list of {'name', 'startMinute', 'writes'} dicts, in input order, with
+    'hostWrites' mapping host projects to their writes for deployments
+    writing to a Shared VPC host.
+
+  Raises:
+    PlanningError: if a single deployment exceeds a quota on its own.
+    ValueError: if deployment_minutes is less than 1.
+  """
+  if deployment_minutes < 1:
+    raise ValueError('deployment_minutes must be at least 1, got {}.'.format(
+      deployment_minutes))
+  quotas = DEFAULT_QUOTAS if quotas is None else quotas
+  shared_limits = {s: l for (s, scope), l in quotas.items() if scope == SHARED}
+  project_limits = {s: l for (s, scope), l in quotas.items() if scope == PROJECT}
+  host_limits = {s: l for (s, scope), l in quotas.items() if scope == HOST}
+
+  usage = collections.defaultdict(collections.Counter)
+  schedule = []
+  for name, config in deployments:
+    writes = count_writes(config)
+    host_writes = count_host_writes(config)
+    rates = {s: _per_minute(c, deployment_minutes) for s, c in writes.items()}
+    # Host writes are tracked per host, by (service, host project).
+    host_rates = {k: _per_minute(c, deployment_minutes)
+                  for k, c in host_writes.items()}
+
+    for service, rate in rates.items():
+      limit = project_limits.get(service, shared_limits.get(service))
+      if limit is not None and rate > limit:
+        raise PlanningError(
+          '{} makes {} {} writes per minute, over the quota of {}'.format(
+            name, rate, service, limit))
+    for (service, host), rate in host_rates.items():
+      limit = host_limits.get(service)
+      if limit is not None and rate > limit:
+        raise PlanningError(
+          '{} makes {} {} writes per minute to host project {}, over the '
+          'quota of {}'.format(name, rate, service, host, limit))
+
+    start = 0
+    while (any(usage[start + m][s] + rates[s] > shared_limits[s]
+               for m in range(deployment_minutes)
+               for s in rates if s in shared_limits) or
+           any(usage[start + m][k] + host_rates[k] > host_limits[k[0]]
+               for m in range(deployment_minutes)
+               for k in host_rates if k[0] in host_limits)):
+      start += 1
+
+    for m in range(deployment_minutes):
+      usage[start + m].update(rates)
+      usage[start + m].update(host_rates)
+    entry = {
+      'name': name,
+      'startMinute': start,
+      'writes': dict(writes),
+    }
+    if host_writes:
+      entry['hostWrites'] = {}
+      for (service, host), count in host_writes.items():
+        entry['hostWrites'].setdefault(host, {})[service] = count
+    schedule.append(entry)
+  return schedule
@@ -0,0 +1,104 @@
+import unittest
+
+import expansion
+import quota_planner
+
+
+def expand(project_id, **properties):
+  properties.update({
+      'billingAccountId': '111-111',
+      'parentOrganization': '12345',
+      'projectId': project_id,
+      'pubsubTopic': 'projects/my-project/topics/deployments',
+  })
+  return expansion.expand('firecloud_project.py', properties)
+
+
+class QuotaPlannerTest(unittest.TestCase):
+
+  def test_count_writes(self):
+    writes = quota_planner.count_writes(
+        expand('my-project', highSecurityNetwork=True,
+               privateIpGoogleAccess=True))
+    # One network, 20 subnetworks, a route, two firewall rules, and the
+    # removal of the default network and its four firewall rules.
+    self.assertEqual(writes['compute'], 29)
+    # The required and the optional API batches.
+    self.assertEqual(writes['serviceusage'], 2)
+    self.assertEqual(writes['cloudresourcemanager'], 1)
+    # The getIamPolicy read isn't counted.
+    self.assertEqual(writes['cloudresourcemanager-iam'], 1)
+    # Two buckets, their IAM policy, and the parameter record object.
+    self.assertEqual(writes['storage'], 4)
+    # The zone, and a single change writing its records.
+    self.assertEqual(writes['dns'], 2)
+    self.assertEqual(writes['pubsub'], 3)
+    self.assertNotIn('other', writes)
+
+  def test_count_writes_with_firewall_policy(self):
+    writes = quota_planner.count_writes(
+        expand('my-project', highSecurityNetwork=True,
+               privateIpGoogleAccess=True, firewallPolicy='123456',
+               parentFolder='789'))
+    # No firewall rules, and the getAssociation check only reads.
+    self.assertEqual(writes['compute'], 27)
+    self.assertNotIn('other', writes)
+
+  def test_plan_spreads_shared_quota(self):
+    deployments = [('project-{}'.format(i), expand('project-{}'.format(i)))
+                   for i in range(5)]
+    quotas = dict(quota_planner.DEFAULT_QUOTAS)
+    quotas[('cloudresourcemanager', quota_planner.SHARED)] = 2
+    schedule = quota_planner.plan(deployments, quotas)
+    self.assertEqual([x['startMinute'] for x in schedule], [0, 0, 1, 1, 2])
+
+    schedule = quota_planner.plan(deployments, quotas, deployment_minutes=2)
+    self.assertEqual([x['startMinute'] for x in schedule], [0, 0, 2, 2, 4])
+
+  def test_plan_spreads_host_project_quota(self):
+    def shared_vpc(project_id, host):
+      return (project_id, expand(project_id, sharedVpc={
+          'hostProject': host,
+          'network': 'terra',
+          'subnetworks': [{'region': 'us-central1', 'name': 'a'},
+                          {'region': 'us-east1', 'name': 'b'}],
+      }))
+
+    deployment = shared_vpc('project-0', 'host-a')[1]
+    # The attachment and both subnetwork policies are the host's writes.
+    self.assertEqual(quota_planner.count_host_writes(deployment),
+                     {('compute', 'host-a'): 3})
+    self.assertEqual(quota_planner.count_writes(deployment)['compute'], 5)
+
+    deployments = [shared_vpc('project-0', 'host-a'),
+                   shared_vpc('project-1', 'host-a'),
+                   shared_vpc('project-2', 'host-b')]
+    quotas = dict(quota_planner.DEFAULT_QUOTAS)
+    quotas[('compute', quota_planner.HOST)] = 5
+    schedule = quota_planner.plan(deployments, quotas)
+    # Only projects attaching to the same host compete.
+    self.assertEqual([x['startMinute'] for x in schedule], [0, 1, 0])
+    self.assertEqual(schedule[2]['hostWrites'], {'host-b': {'compute': 3}})
+
+    quotas[('compute', quota_planner.HOST)] = 2
+    with self.assertRaises(quota_planner.PlanningError):
+      quota_planner.plan(deployments, quotas)
+
+  def test_plan_rejects_deployment_over_project_quota(self):
+    quotas = {('compute', quota_planner.PROJECT): 10}
+    deployment = ('my-project', expand('my-project', highSecurityNetwork=True))
+    with self.assertRaises(quota_planner.PlanningError):
+      quota_planner.plan([deployment], quotas)
+    # Spreading the writes over enough minutes brings them under the quota.
+    schedule = quota_planner.plan([deployment], quotas, deployment_minutes=3)
+    self.assertEqual(schedule[0]['startMinute'], 0)
+
+  def test_plan_requires_a_deployment_minute(self):
+    deployment = ('my-project', expand('my-project'))
+    for minutes in (0, -1):
+      with self.assertRaises(ValueError):
+        quota_planner.plan([deployment], deployment_minutes=minutes)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -13,32 +13,33 @@
 # limitations under the License.
 """ This template creates firewall rules for a network. """
 
+from templates import model
+from templates import naming
+
 
 def generate_config(context):
   """ Entry point for the deployment resources. """
   resources = []
 
   for rule in context.properties.get('rules', []):
-    # Network and project must be specified in the top-level properties.
+    # Network and project must be specified in the top-level properties. The
+    # rule is copied, so the caller's rule definitions are left untouched.
+    rule = dict(rule)
     rule['network'] = context.properties['network']
     rule['project'] = context.properties['projectId']
     rule['priority'] = context.properties.get('priority', 65534)
 
-    resource = {
-        'name': rule['name'],
-        'type': 'gcp-types/compute-v1:firewalls',
-        'properties': rule,
-    }
-    resources.append(resource)
-
     # If a dependsOn property was passed in, the firewall should depends on
     # that.
-    if 'dependsOn' in context.properties:
-      resource['metadata'] = {'dependsOn': context.properties['dependsOn']}
+    resources.append(
+        model.Resource(
+            rule['name'],
+            'gcp-types/compute-v1:firewalls',
+            rule,
+            depends_on=context.properties.get('dependsOn')))
 
-  outputs = [{
-      'name': 'resourceNames',
-      'value': [resource['name'] for resource in resources]
-  }]
+  outputs = [('resourceNames', [resource.name for resource in resources])]
 
-  return {'resources': resources, 'outputs': outputs}
+  return naming.namespace_config(
+      resources, outputs,
+      context.properties.get('resourceNamePrefix'))
@@ -0,0 +1,58 @@
+""" This template creates a hierarchical firewall policy for a folder.
+
+The policy's rules apply to every network in the projects under the folder
+(or organization) it's associated with. FireCloud projects deployed with the
+policy's name as their firewallPolicy then create no firewall rules of their
+own, and only check that the policy is associated with their folder.
+"""
+
+from templates import model
+from templates import naming
+
+
+def association_name(parent_id):
+  """ Returns the name of the policy's association with a folder or org.
+
+  The name is derived from the folder, so that projects under it can check
+  that the policy is associated with it, by name.
+  """
+  return parent_id.replace('/', '-')
+
+
+def generate_config(context):
+  """ Entry point for the deployment resources. """
+  parent = context.properties['parentId']
+
+  policy = model.Resource(
+    context.properties['resourceName'],
+    # https://cloud.google.com/compute/docs/reference/rest/v1/firewallPolicies
+    'gcp-types/compute-v1:firewallPolicies',
+    {
+      'parentId': parent,
+      'shortName': context.properties['shortName'],
+      'description': context.properties.get('description', ''),
+      'rules': context.properties.get('rules', []),
+    },
+    depends_on=context.properties.get('dependsOn'))
+
+  associate = model.Action(
+    'associate-' + context.properties['resourceName'],
+    'gcp-types/compute-v1:compute.firewallPolicies.addAssociation',
+    {
+      'firewallPolicy': policy.ref('name'),
+      'attachmentTarget': parent,
+      'name': association_name(parent),
+    },
+    depends_on=[policy],
+    runtime_policy=['CREATE'])
+
+  outputs = [
+    # The generated (numeric) name, which projects refer to the policy by.
+    ('name', policy.ref('name')),
+    ('selfLink', policy.ref('selfLink')),
+    ('resourceNames', [policy.name, associate.name]),
+  ]
+
+  return naming.namespace_config(
+    [policy, associate], outputs,
+    context.properties.get('resourceNamePrefix'))
@@ -0,0 +1,72 @@
+""" The paths through which private VMs can reach Google APIs.
+
+Private Google Access sends googleapis.com traffic to a VIP range, through a
+custom route to the default internet gateway, with DNS mapping the API names
+to that range:
+  restricted: restricted.googleapis.com, which only serves APIs supported by
+    VPC Service Controls.
+  private: private.googleapis.com, which serves most Google APIs.
+Alternatively, a Private Service Connect endpoint gives the APIs an internal
+address of the network's own, with no route needed:
+  psc: an endpoint for all APIs, at the given internal address.
+"""
+import ipaddress
+
+DEFAULT_ACCESS_PATH = 'restricted'
+
+# The VIP domain and range of each Private Google Access path.
+VIPS = {
+  'restricted': ('restricted.googleapis.com.', '199.36.153.4/30'),
+  'private': ('private.googleapis.com.', '199.36.153.8/30'),
+}
+
+ACCESS_PATHS = sorted(VIPS) + ['psc']
+
+# The name of the Private Service Connect endpoint; at most 20 characters.
+PSC_ENDPOINT_NAME = 'googleapis'
+
+
+def validate_access_path(access_path, psc_address=None):
+  """ Raises a ValueError for an unknown path, or a PSC path without address. """
+  if access_path not in ACCESS_PATHS:
+    raise ValueError('Unknown Google API access path {!r}; expected one of {}.'
+                     .format(access_path, ', '.join(ACCESS_PATHS)))
+  if access_path == 'psc':
+    if not psc_address:
+      raise ValueError('The psc Google API access path needs an endpoint address.')
+    ipaddress.ip_address(psc_address)
+
+
+def destination_range(access_path, psc_address=None):
+  """ Returns the address range API traffic is sent to. """
+  if access_path == 'psc':
+    return psc_address + '/32'
+  return VIPS[access_path][1]
+
+
+def vip_addresses(access_path):
+  """ Returns the addresses of a VIP range. """
+  return [str(a) for a in ipaddress.ip_network(VIPS[access_path][1])]
+
+
+def dns_records(access_path, psc_address=None):
+  """ Returns the googleapis.com record sets sending API traffic down a path. """
+  if access_path == 'psc':
+    return [{
+      'name': '*.googleapis.com.',
+      'type': 'A',
+      'ttl': 300,
+      'rrdatas': [psc_address]
+    }]
+  domain = VIPS[access_path][0]
+  return [{
+    'name': '*.googleapis.com.',
+    'type': 'CNAME',
+    'ttl': 300,
+    'rrdatas': [domain]
+  }, {
+    'name': domain,
+    'type': 'A',
+    'ttl': 300,
+    'rrdatas': vip_addresses(access_path)
+  }]
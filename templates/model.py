@@ -0,0 +1,199 @@
+""" A small model of Deployment Manager resources, for use by the templates.
+
+Templates build Resource and Action objects, whose properties may hold Ref
+objects where they refer to other resources, and serialize them with
+to_config. Unlike '$(ref.NAME.FIELD)' strings, references and dependencies
+held this way can be walked and checked without parsing.
+"""
+
+
+class Ref(object):
+  """ A reference to a field of another resource: $(ref.NAME.FIELD).
+
+  Without a field, the reference is to the whole resource: $(ref.NAME).
+  """
+  __slots__ = ('name', 'field')
+
+  def __init__(self, name, field=None):
+    self.name = name
+    self.field = field
+
+  def __str__(self):
+    if self.field is None:
+      return '$(ref.{})'.format(self.name)
+    return '$(ref.{}.{})'.format(self.name, self.field)
+
+  def __repr__(self):
+    return 'Ref({!r}, {!r})'.format(self.name, self.field)
+
+  def __eq__(self, other):
+    return (isinstance(other, Ref) and self.name == other.name and
+            self.field == other.field)
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __hash__(self):
+    return hash((self.name, self.field))
+
+
+class Concat(object):
+  """ A string made of literal parts and references, e.g. a bucket name. """
+  __slots__ = ('parts',)
+
+  def __init__(self, *parts):
+    self.parts = parts
+
+  def __str__(self):
+    return ''.join(str(part) for part in self.parts)
+
+  def __repr__(self):
+    return 'Concat{!r}'.format(self.parts)
+
+
+class Dependency(object):
+  """ An explicit dependency on another resource, by name. """
+  __slots__ = ('name',)
+
+  def __init__(self, target):
+    # Accept the resource itself, as well as its name.
+    self.name = target.name if isinstance(target, Resource) else target
+
+  def __repr__(self):
+    return 'Dependency({!r})'.format(self.name)
+
+
+class Resource(object):
+  """ A resource of a Deployment Manager type, or a template call. """
+  __slots__ = ('name', 'type', 'properties', 'depends_on')
+
+  # The key the type is serialized under.
+  TYPE_KEY = 'type'
+
+  def __init__(self, name, type, properties=None, depends_on=None):  # pylint: disable=redefined-builtin
+    self.name = name
+    self.type = type
+    self.properties = properties
+    if depends_on is None or isinstance(depends_on, (Ref, str)):
+      # A Ref stands for a list of names output by another resource. Child
+      # templates receive such a reference as an unresolved string, which
+      # is passed on as is.
+      self.depends_on = depends_on
+    else:
+      self.depends_on = [Dependency(d) for d in depends_on]
+
+  def ref(self, field=None):
+    """ Returns a reference to a field of this resource, or to all of it. """
+    return Ref(self.name, field)
+
+  def references(self):
+    """ Returns the references held by this resource's properties. """
+    return list(references(self.properties))
+
+  def _metadata(self):
+    metadata = {}
+    if isinstance(self.depends_on, (Ref, str)):
+      metadata['dependsOn'] = str(self.depends_on)
+    elif self.depends_on is not None:
+      metadata['dependsOn'] = [d.name for d in self.depends_on]
+    return metadata
+
+  def to_dict(self):
+    resource = {'name': self.name, self.TYPE_KEY: self.type}
+    if self.properties is not None:
+      resource['properties'] = serialize(self.properties)
+    metadata = self._metadata()
+    if metadata:
+      resource['metadata'] = metadata
+    return resource
+
+  def __repr__(self):
+    return '{}({!r}, {!r})'.format(type(self).__name__, self.name, self.type)
+
+
+class Action(Resource):
+  """ A call of an API method, as an 'action' resource. """
+  __slots__ = ('runtime_policy',)
+
+  TYPE_KEY = 'action'
+
+  def __init__(self, name, action, properties=None, depends_on=None,
+               runtime_policy=None):
+    super(Action, self).__init__(name, action, properties, depends_on)
+    self.runtime_policy = runtime_policy
+
+  def _metadata(self):
+    metadata = super(Action, self)._metadata()
+    if self.runtime_policy is not None:
+      metadata['runtimePolicy'] = list(self.runtime_policy)
+    return metadata
+
+
+def serialize(value):
+  """ Converts model objects in a value to their plain representation. """
+  if isinstance(value, Resource):
+    return value.to_dict()
+  if isinstance(value, (Ref, Concat)):
+    return str(value)
+  if isinstance(value, Dependency):
+    return value.name
+  if isinstance(value, dict):
+    return {k: serialize(v) for k, v in value.items()}
+  if isinstance(value, (list, tuple)):
+    return [serialize(v) for v in value]
+  return value
+
+
+def references(value):
+  """ Yields the Refs held by a value, in order. """
+  if isinstance(value, Ref):
+    yield value
+  elif isinstance(value, Concat):
+    for part in value.parts:
+      for ref in references(part):
+        yield ref
+  elif isinstance(value, Resource):
+    for ref in references(value.properties):
+      yield ref
+  elif isinstance(value, dict):
+    for v in value.values():
+      for ref in references(v):
+        yield ref
+  elif isinstance(value, (list, tuple)):
+    for v in value:
+      for ref in references(v):
+        yield ref
+
+
+def dangling_names(resources, known_names=()):
+  """ Returns the names referenced or depended on but not defined.
+
+  Args:
+    resources: a list of Resources.
+    known_names: names defined elsewhere, e.g. by the calling template.
+  """
+  defined = set(known_names)
+  defined.update(resource.name for resource in resources)
+  dangling = []
+  for resource in resources:
+    names = [ref.name for ref in resource.references()]
+    if isinstance(resource.depends_on, Ref):
+      names.append(resource.depends_on.name)
+    elif isinstance(resource.depends_on, str):
+      # A reference resolved by the caller, which defines it.
+      pass
+    else:
+      names.extend(d.name for d in resource.depends_on or [])
+    for name in names:
+      if name not in defined and name not in dangling:
+        dangling.append(name)
+  return dangling
+
+
+def to_config(resources, outputs=None):
+  """ Serializes resources, and outputs given as (name, value) pairs. """
+  config = {'resources': [resource.to_dict() for resource in resources]}
+  if outputs is not None:
+    config['outputs'] = [{'name': name, 'value': serialize(value)}
+                         for name, value in outputs]
+  return config
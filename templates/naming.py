@@ -0,0 +1,82 @@
+""" Namespaces the resources of a generated config with a name prefix.
+
+Resource names must be unique within a deployment, but the FireCloud templates
+use fixed names ('fc-project', 'project', 'network', ...). To hold several
+projects in one deployment, every template serializes its resources through
+namespace_config with its resourceNamePrefix property. This prefixes the names
+of the resources the template creates, along with every reference to and
+dependency on them, and hands the prefix down to the templates it calls.
+
+References and dependencies are found by walking the model objects (see
+model.py), rather than by parsing serialized strings. '$(ref.NAME.FIELD)'
+strings are left as they are: templates only receive them from their caller,
+whose resources they name, already prefixed.
+"""
+import copy
+
+from templates import model
+
+
+def _prefix_names(value, names, prefix):
+  """Prefixes the references to, and dependencies on, the given names."""
+  if isinstance(value, model.Ref):
+    if value.name in names:
+      return model.Ref(prefix + value.name, value.field)
+    return value
+  if isinstance(value, model.Dependency):
+    if value.name in names:
+      return model.Dependency(prefix + value.name)
+    return value
+  if isinstance(value, model.Concat):
+    return model.Concat(*_prefix_names(value.parts, names, prefix))
+  if isinstance(value, model.Resource):
+    return _prefix_resource(value, names, prefix)
+  if isinstance(value, dict):
+    return {k: _prefix_names(v, names, prefix) for k, v in value.items()}
+  if isinstance(value, (list, tuple)):
+    return [_prefix_names(v, names, prefix) for v in value]
+  return value
+
+
+def _prefix_resource(resource, names, prefix):
+  """Returns a prefixed copy of a resource, passing the prefix to templates."""
+  renamed = copy.copy(resource)
+  renamed.name = prefix + resource.name
+  renamed.properties = _prefix_names(resource.properties, names, prefix)
+  renamed.depends_on = _prefix_names(resource.depends_on, names, prefix)
+  if resource.type.endswith('.py'):
+    renamed.properties = dict(renamed.properties or {},
+                              resourceNamePrefix=prefix)
+  return renamed
+
+
+def _prefix_output(value, names, prefix):
+  if isinstance(value, list):
+    return [_prefix_output(v, names, prefix) for v in value]
+  # Outputs list resource names as plain strings, e.g. resourceNames.
+  if isinstance(value, str) and value in names:
+    return prefix + value
+  return _prefix_names(value, names, prefix)
+
+
+def namespace_config(resources, outputs=None, prefix=None):
+  """Serializes a template's resources, prefixing their names.
+
+  Args:
+    resources: the Resources the template creates.
+    outputs: the template's outputs, as (name, value) pairs, if any.
+    prefix: the resource name prefix. If empty, nothing is renamed.
+
+  Returns:
+    The config, as returned by model.to_config, whose resources, references
+    and dependencies are prefixed, and whose template-call resources pass the
+    prefix on.
+  """
+  if prefix:
+    names = set(resource.name for resource in resources)
+    resources = [_prefix_resource(resource, names, prefix)
+                 for resource in resources]
+    if outputs is not None:
+      outputs = [(name, _prefix_output(value, names, prefix))
+                 for name, value in outputs]
+  return model.to_config(resources, outputs)
@@ -13,19 +13,169 @@
 # limitations under the License.
 """ This template creates a network, optionally with subnetworks. """
 
+from templates import google_apis
+from templates import model
+from templates import naming
+
+# The Cloud NAT default number of ports per VM.
+DEFAULT_NAT_MIN_PORTS_PER_VM = 64
+
+# The fewest ports per VM Cloud NAT accepts with dynamic port allocation,
+# for minPortsPerVm and maxPortsPerVm respectively.
+# https://cloud.google.com/nat/docs/ports-and-addresses#dynamic-port
+DYNAMIC_NAT_MIN_PORTS_PER_VM = 32
+DYNAMIC_NAT_MIN_MAX_PORTS_PER_VM = 64
+
+# The network MTUs GCP supports, in bytes.
+# https://cloud.google.com/vpc/docs/mtu
+MIN_MTU = 1300
+MAX_MTU = 8896
+
+
+def validate_mtu(mtu):
+  """ Raises a ValueError for MTUs GCP doesn't support. """
+  if isinstance(mtu, bool) or not isinstance(mtu, int) or not (
+      MIN_MTU <= mtu <= MAX_MTU):
+    raise ValueError('Network MTU must be an integer from {} to {}, got {!r}.'
+                     .format(MIN_MTU, MAX_MTU, mtu))
+
+
+def create_private_google_access_route(project_id, network_self_link, depends_on,
+                                       access_path='restricted'):
+  """ Creates the route sending Google API traffic to a VIP.
+
+  The route for the restricted VIP keeps its original name; routes for other
+  paths are named after the path. Routes can't be updated, so the action
+  only runs on create: switching paths leaves the previous path's route in
+  the network, to be deleted by hand.
+  """
+  name = 'private-google-access-route'
+  if access_path != 'restricted':
+    name += '-' + access_path
+  return model.Action(
+    name,
+    # https://cloud.google.com/compute/docs/reference/rest/v1/routes
+    'gcp-types/compute-v1:compute.routes.insert',
+    {
+      'name': name,
+      'network': network_self_link,
+      'project': project_id,
+      'destRange': google_apis.destination_range(access_path),
+      'nextHopGateway':
+        model.Concat('projects/', project_id,
+                     '/global/gateways/default-internet-gateway'),
+    },
+    depends_on=depends_on,
+    runtime_policy=['CREATE'])
+
+
+def create_psc_endpoint(project_id, network_self_link, psc_address, depends_on):
+  """ Creates a Private Service Connect endpoint for all Google APIs. """
+  address = model.Resource(
+    'psc-googleapis-address',
+    # https://cloud.google.com/compute/docs/reference/rest/v1/globalAddresses
+    'gcp-types/compute-v1:globalAddresses',
+    {
+      'name': 'psc-googleapis-address',
+      'project': project_id,
+      'purpose': 'PRIVATE_SERVICE_CONNECT',
+      'addressType': 'INTERNAL',
+      'address': psc_address,
+      'network': network_self_link,
+    },
+    depends_on=depends_on)
+
+  endpoint = model.Resource(
+    'psc-googleapis-endpoint',
+    # https://cloud.google.com/compute/docs/reference/rest/v1/globalForwardingRules
+    'gcp-types/compute-v1:globalForwardingRules',
+    {
+      'name': google_apis.PSC_ENDPOINT_NAME,
+      'project': project_id,
+      'target': 'all-apis',
+      'network': network_self_link,
+      'IPAddress': address.ref('selfLink'),
+      'loadBalancingScheme': '',
+    },
+    depends_on=[address])
+
+  return [address, endpoint]
+
+
+def validate_cloud_nat(nat):
+  """ Raises a ValueError for Cloud NAT settings GCP would reject. """
+  dynamic = nat.get('enableDynamicPortAllocation', False)
+  if dynamic and nat.get('enableEndpointIndependentMapping', False):
+    raise ValueError('Cloud NAT dynamic port allocation and endpoint-independent '
+                     'mapping are mutually exclusive.')
+
+  min_ports = nat.get('minPortsPerVm', DEFAULT_NAT_MIN_PORTS_PER_VM)
+  max_ports = nat.get('maxPortsPerVm')
+  for ports in (min_ports, max_ports):
+    if ports is None:
+      continue
+    if not 2 <= ports <= 65536:
+      raise ValueError('Cloud NAT ports per VM must be from 2 to 65536, got {}.'
+                       .format(ports))
+    # With dynamic port allocation, port counts must be powers of two.
+    if dynamic and ports & (ports - 1):
+      raise ValueError('Cloud NAT ports per VM must be a power of two with '
+                       'dynamic port allocation, got {}.'.format(ports))
+  if dynamic and min_ports < DYNAMIC_NAT_MIN_PORTS_PER_VM:
+    raise ValueError('Cloud NAT minPortsPerVm must be at least {} with dynamic '
+                     'port allocation, got {}.'.format(
+                       DYNAMIC_NAT_MIN_PORTS_PER_VM, min_ports))
+  if dynamic and max_ports is not None and (
+      max_ports < DYNAMIC_NAT_MIN_MAX_PORTS_PER_VM):
+    raise ValueError('Cloud NAT maxPortsPerVm must be at least {}, got {}.'
+                     .format(DYNAMIC_NAT_MIN_MAX_PORTS_PER_VM, max_ports))
+  if max_ports is not None:
+    if not dynamic:
+      raise ValueError('maxPortsPerVm requires enableDynamicPortAllocation.')
+    if max_ports < min_ports:
+      raise ValueError('Cloud NAT maxPortsPerVm {} is below minPortsPerVm {}.'
+                       .format(max_ports, min_ports))
+
+
+def create_cloud_nat(project_id, network_self_link, region, nat, depends_on):
+  """ Creates a Cloud Router with a NAT gateway for a region's subnetworks. """
+  nat_properties = {
+    'name': 'nat-' + region,
+    'natIpAllocateOption': 'AUTO_ONLY',
+    'sourceSubnetworkIpRangesToNat': 'ALL_SUBNETWORKS_ALL_IP_RANGES',
+    'minPortsPerVm': nat.get('minPortsPerVm', DEFAULT_NAT_MIN_PORTS_PER_VM),
+    'enableDynamicPortAllocation':
+      nat.get('enableDynamicPortAllocation', False),
+    'enableEndpointIndependentMapping':
+      nat.get('enableEndpointIndependentMapping', False),
+  }
+  if 'maxPortsPerVm' in nat:
+    nat_properties['maxPortsPerVm'] = nat['maxPortsPerVm']
+
+  return model.Resource(
+    'nat-router-' + region,
+    # https://cloud.google.com/compute/docs/reference/rest/v1/routers
+    'gcp-types/compute-v1:routers',
+    {
+      'name': 'nat-router-' + region,
+      'network': network_self_link,
+      'region': region,
+      'project': project_id,
+      'nats': [nat_properties],
+    },
+    depends_on=depends_on)
+
 
 def generate_config(context):
   """ Entry point for the deployment resources. """
 
-  resource_name = context.properties['resourceName']
-  network_self_link = '$(ref.{}.selfLink)'.format(resource_name)
-
   resources = []
 
-  network_resource = {
-    'name': resource_name,
-    'type': 'gcp-types/compute-v1:networks',
-    'properties': {
+  # If a dependsOn property was passed in, the network should depend on that.
+  network_resource = model.Resource(
+    context.properties['resourceName'],
+    'gcp-types/compute-v1:networks',
+    {
       'name':
         context.properties['name'],
       'project':
@@ -33,71 +183,65 @@ def generate_config(context):
       'autoCreateSubnetworks':
         context.properties.get('autoCreateSubnetworks', False),
     },
-  }
+    depends_on=context.properties.get('dependsOn'))
   resources.append(network_resource)
 
-  # If a dependsOn property was passed in, the network should depend on that.
-  if 'dependsOn' in context.properties:
-    network_resource['metadata'] = {
-      'dependsOn': context.properties['dependsOn']
-    }
-
-  # Create the network within a specified project if the property is
-  # non-empty.
-  if 'projectId' in context.properties:
-    network_resource['properties']['project'] = (
-      context.properties['projectId'])
+  # Networks are created with the GCP default MTU unless one is given.
+  if 'mtu' in context.properties:
+    validate_mtu(context.properties['mtu'])
+    network_resource.properties['mtu'] = context.properties['mtu']
+  network_self_link = network_resource.ref('selfLink')
 
+  subnetwork_resources = []
   for subnetwork in context.properties.get('subnetworks', []):
+    # Copy the subnetwork, so the caller's definition is left untouched.
+    subnetwork = dict(subnetwork)
     subnetwork['network'] = network_self_link
 
     # All subnetworks  depend on the parent network resource.
-    subnetwork['dependsOn'] = [resource_name]
+    subnetwork['dependsOn'] = [model.Dependency(network_resource)]
 
     # Create the subnetwork within the specified project if the property is
     # non-empty.
     if 'projectId' in context.properties:
       subnetwork['projectId'] = context.properties['projectId']
 
-    resources.append({
-      'name': subnetwork['resourceName'],
-      'type': 'subnetwork.py',
-      'properties': subnetwork
-    })
+    subnetwork_resources.append(
+      model.Resource(subnetwork['resourceName'], 'subnetwork.py', subnetwork))
+  resources.extend(subnetwork_resources)
 
   if context.properties.get('createCustomStaticRoute', False):
-    resources.append({
-      'name': 'private-google-access-route',
-      # https://cloud.google.com/compute/docs/reference/rest/v1/routes
-      'action': 'gcp-types/compute-v1:compute.routes.insert',
-      'metadata': {
-        'dependsOn': [resource_name],
-        'runtimePolicy': [
-          'CREATE',
-        ],
-      },
-      'properties': {
-        'name': 'private-google-access-route',
-        'network': network_self_link,
-        'project': context.properties['projectId'],
-        'destRange': '199.36.153.4/30',
-        'nextHopGateway':
-          'projects/{}/global/gateways/default-internet-gateway'.format(context.properties['projectId'])
-      }
-    })
-
-  return {
-    'resources':
-      resources,
-    'outputs': [{
-      'name': 'name',
-      'value': resource_name
-    }, {
-      'name': 'selfLink',
-      'value': network_self_link
-    },
-      {
-        'name': 'resourceNames',
-        'value': [resource['name'] for resource in resources]
-      }]
-  }
+    access_path = context.properties.get('accessPath',
+                                         google_apis.DEFAULT_ACCESS_PATH)
+    psc_address = context.properties.get('pscAddress')
+    google_apis.validate_access_path(access_path, psc_address)
+    if access_path == 'psc':
+      # The endpoint's address is within the network; no route is needed.
+      resources.extend(create_psc_endpoint(
+        context.properties['projectId'], network_self_link, psc_address,
+        [network_resource]))
+    else:
+      resources.append(create_private_google_access_route(
+        context.properties['projectId'], network_self_link, [network_resource],
+        access_path))
+
+  nat = context.properties.get('cloudNat')
+  if nat:
+    validate_cloud_nat(nat)
+    for region in nat.get('regions', []):
+      resources.append(create_cloud_nat(
+        context.properties['projectId'], network_self_link, region, nat,
+        [network_resource]))
+
+  outputs = [
+    ('name', network_resource.name),
+    ('selfLink', network_self_link),
+    ('resourceNames', [resource.name for resource in resources]),
+  ]
+  # One output per subnetwork, as outputs can only be referenced whole.
+  for subnetwork in subnetwork_resources:
+    outputs.append(('selfLink_' + subnetwork.name, subnetwork.ref('selfLink')))
+
+  return naming.namespace_config(
+    resources, outputs,
+    context.properties.get('resourceNamePrefix'))
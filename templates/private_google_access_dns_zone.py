@@ -1,17 +1,50 @@
-""" This template creates a Cloud DNS zone for Private Google Access"""
+""" This template creates a Cloud DNS zone for Private Google Access
+
+By default, the zone holds the googleapis.com records itself. With a
+peeringNetwork, it is a peering zone instead, which forwards googleapis.com
+lookups to a single zone shared by all projects and visible to that (central)
+network, so that no records are written per project.
+"""
+
+from templates import google_apis
+from templates import model
+from templates import naming
+
+def create_records(project, zone_resource, access_path, psc_address=None):
+  """ Creates the googleapis.com records of a zone, in a single change. """
+  # This follows the structure described here: https://cloud.google.com/vpc-service-controls/docs/set-up-private-connectivity#configuring-dns
+  # The action keeps the name it had when the CNAME and A records were
+  # written by separate changes, so that existing deployments don't run it
+  # again (and fail on the existing records) on update.
+  return model.Action(
+    'cname-record',
+    # https://cloud.google.com/dns/docs/reference/v1/changes/create
+    'gcp-types/dns-v1:dns.changes.create',
+    {
+      'project': project,
+      'managedZone': zone_resource.ref('name'),
+      'additions': google_apis.dns_records(access_path, psc_address)
+    },
+    runtime_policy=['CREATE'])
+
 
 def generate_config(context):
   """ Entry point for the deployment resources. """
   project = context.properties['projectId']
-  zone_resource_name = context.properties['resourceName']
 
   resources = []
 
-  zone_resource = {
-    'name': zone_resource_name,
+  peering_network = context.properties.get('peeringNetwork')
+  access_path = context.properties.get('accessPath',
+                                       google_apis.DEFAULT_ACCESS_PATH)
+  psc_address = context.properties.get('pscAddress')
+  google_apis.validate_access_path(access_path, psc_address)
+
+  zone_resource = model.Resource(
+    context.properties['resourceName'],
     # https://cloud.google.com/dns/docs/reference/v1/managedZones
-    'type': 'gcp-types/dns-v1:managedZones',
-    'properties': {
+    'gcp-types/dns-v1:managedZones',
+    {
       'description': 'Routes googleapis.com to restricted.googleapis.com VIP',
       'dnsName': 'googleapis.com.',
       'project': project,
@@ -23,63 +56,30 @@ def generate_config(context):
           'networkUrl': context.properties['network']
         }]
       }
-    }
-  }
-
-  # If a dependsOn property was passed in, the network should depend on that.
-  if 'dependsOn' in context.properties:
-    zone_resource['metadata'] = {
-      'dependsOn': context.properties['dependsOn']
-    }
-  resources.append(zone_resource)
-
-  # Configure the DNS Zone. The two additions below will create Change records which will create ResourceRecordSets.
-  # This follows the structure described here: https://cloud.google.com/vpc-service-controls/docs/set-up-private-connectivity#configuring-dns
-  resources.append({
-    'name': 'cname-record',
-    # https://cloud.google.com/dns/docs/reference/v1/changes/create
-    'action': 'gcp-types/dns-v1:dns.changes.create',
-    'metadata': {
-      'runtimePolicy': [
-        'CREATE',
-      ],
     },
-    'properties': {
-      'project': project,
-      'managedZone': '$(ref.{}.name)'.format(zone_resource_name),
-      'additions': [{
-        'name': '*.googleapis.com.',
-        'type': 'CNAME',
-        'ttl': 300,
-        'rrdatas': [ 'restricted.googleapis.com.' ]
-      }]
-    }
-  })
+    # If a dependsOn property was passed in, the network should depend on that.
+    depends_on=context.properties.get('dependsOn'))
+  resources.append(zone_resource)
 
-  resources.append({
-    'name': 'a-record',
-    # https://cloud.google.com/dns/docs/reference/v1/changes/create
-    'action': 'gcp-types/dns-v1:dns.changes.create',
-    'metadata': {
-      'runtimePolicy': [
-        'CREATE',
-      ],
-    },
-    'properties': {
-      'project': project,
-      'managedZone': '$(ref.{}.name)'.format(zone_resource_name),
-      'additions': [{
-        'name': 'restricted.googleapis.com.',
-        'type': 'A',
-        'ttl': 300,
-        'rrdatas': [
-          '199.36.153.4',
-          '199.36.153.5',
-          '199.36.153.6',
-          '199.36.153.7'
-        ]
-      }]
+  if peering_network:
+    # The shared zone answers instead; this requires the project's DNS
+    # service agent to hold roles/dns.peer on the central network's project.
+    zone_resource.properties['description'] = (
+      'Resolves googleapis.com through the shared Private Google Access zone')
+    zone_resource.properties['peeringConfig'] = {
+      'kind': 'dns#managedZonePeeringConfig',
+      'targetNetwork': {
+        'kind': 'dns#managedZonePeeringConfigTargetNetwork',
+        'networkUrl': peering_network
+      }
     }
-  })
+  else:
+    if access_path != 'restricted':
+      zone_resource.properties['description'] = (
+        'Routes googleapis.com to the {} Google API access path'.format(
+          access_path))
+    resources.append(
+      create_records(project, zone_resource, access_path, psc_address))
 
-  return {'resources': resources}
+  return naming.namespace_config(
+    resources, prefix=context.properties.get('resourceNamePrefix'))
@@ -3,10 +3,16 @@
 This is a somewhat generic template for FireCloud project creation. It is a
 child template meant to be called by firecloud-project.py.
 """
-import copy
+import hashlib
+import json
 import re
-import random
-import string
+
+from templates import model
+from templates import naming
+
+# References to the project created by this template.
+PROJECT_ID = model.Ref('project', 'projectId')
+PROJECT_NUMBER = model.Ref('project', 'projectNumber')
 
 def bucketed_list(l, bucket_size):
   """Breaks an input list into multiple lists with a certain bucket size.
@@ -32,7 +38,9 @@ def create_apis(context):
   Returns:
     A list of DM resources to active the configured APIs.
   """
-  apis = context.properties.get('activateApis', [])
+  # Copy the list, since it may be shared with the caller (e.g. the
+  # FIRECLOUD_REQUIRED_APIS constant) and is extended below.
+  apis = list(context.properties.get('activateApis', []))
 
   # Enable the storage-component API if the usage export, storage logs, or cromwell auth buckets are enabled.
   if ((context.properties.get('usageExportBucket') or
@@ -41,6 +49,40 @@ def create_apis(context):
       'storage-component.googleapis.com' not in apis):
     apis.append('storage-component.googleapis.com')
 
+  # The only thing needed to activate APIs is billing to be enabled.
+  return create_api_batches('api-{}', apis, ['billing'])
+
+
+def create_optional_apis(context, api_names_list):
+  """Creates resources for the activation of optional APIs.
+
+  Nothing else in the project waits for these APIs, so they are left out of
+  the resourceNames output and enabled after the others, off the critical
+  path of project creation.
+
+  Args:
+      context: the DM context object.
+      api_names_list: the names of all resources that enable the other APIs.
+
+  Returns:
+    A list of DM resources to activate the optional APIs.
+  """
+  apis = [api for api in context.properties.get('activateOptionalApis', [])
+          if api not in context.properties.get('activateApis', [])]
+  return create_api_batches('api-optional-{}', apis, api_names_list)
+
+
+def create_api_batches(name_format, apis, depends_on):
+  """Creates batchEnable actions for a list of APIs.
+
+  Args:
+      name_format: the format of the action names, given the batch index.
+      apis: the APIs to enable.
+      depends_on: the names of the resources the actions depend on.
+
+  Returns:
+    A list of DM actions.
+  """
   resources = []
 
   # Activate APIs in batches of 20 at a time using the "batchEnable" service
@@ -52,63 +94,137 @@ def create_apis(context):
   for i in range(0, len(api_buckets)):
     api_names = api_buckets[i]
 
-    resources.append({
-        'name': 'api-{}'.format(i),
-        'action': ('gcp-types/serviceusage-v1beta1:' +
-                   'serviceusage.services.batchEnable'),
-        'properties': {
-            'parent': 'projects/$(ref.project.projectNumber)',
+    resources.append(model.Action(
+        name_format.format(i),
+        ('gcp-types/serviceusage-v1beta1:' +
+         'serviceusage.services.batchEnable'),
+        {
+            'parent': model.Concat('projects/', PROJECT_NUMBER),
             'serviceIds': api_names,
         },
-        'metadata': {
-            # The only thing needed to activate APIs is billing to be enabled.
-            'dependsOn': ['billing'],
-        }
-    })
+        depends_on=depends_on))
 
   return resources
 
 
+def iam_policy_hash(project_id, policies):
+  """Returns a short, stable hash of a project's IAM grants.
+
+  Arguments:
+    project_id: the ID of the project the grants apply to.
+    policies: a list of {'role': ..., 'members': [...]} grants.
+
+  Returns:
+    A 10-character hex digest, identical for identical inputs.
+  """
+  canonical = json.dumps([project_id, policies], sort_keys=True,
+                         separators=(',', ':'))
+  return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:10]
+
+
 def create_iam_policies(context):
-  """ Grant the shared project IAM permissions. """
+  """ Grant the shared project IAM permissions.
+
+  In the default 'inline' patch mode, the policy is read and written back by a
+  pair of DM actions. The patch action writes the policy returned by the get
+  action, etag included, so a concurrent change made by another writer between
+  the two calls is rejected rather than silently overwritten.
+
+  In 'deferred' mode no actions are created; the grants are exposed through
+  the 'iamPolicies' output instead, to be applied by iam_policy.py, which
+  retries with a fresh read whenever the etag is stale.
+  """
   if 'iamPolicies' not in context.properties:
     return []
 
-  get_iam_policy_name = 'get-iam-policy-' + ''.join(random.choice(string.ascii_lowercase) for i in list(range(10)))
+  if context.properties.get('iamPolicyPatchMode', 'inline') == 'deferred':
+    return []
 
-  return [
+  # The action names are derived from the policy contents, so regenerating an
+  # unchanged config yields identical actions that DM skips on update, while
+  # any change to the grants produces new actions that run on that update.
+  suffix = iam_policy_hash(context.properties.get('projectId'),
+                           context.properties['iamPolicies'])
+  get_iam_policy_name = 'get-iam-policy-' + suffix
+
+  # Get the IAM policy first, so as not to remove
+  # any existing bindings.
+  get_iam_policy = model.Action(
+      'get-iam-policy-' + suffix,
+      ('gcp-types/cloudresourcemanager-v1:' +
+       'cloudresourcemanager.projects.getIamPolicy'),
       {
-          # Get the IAM policy first, so as not to remove
-          # any existing bindings.
-          'name': get_iam_policy_name,
-          'action': ('gcp-types/cloudresourcemanager-v1:' +
-                     'cloudresourcemanager.projects.getIamPolicy'),
-          'properties': {
-              'resource': '$(ref.project.projectId)'
-          },
-          'metadata': {
-              'dependsOn': ['project'],
-              'runtimePolicy': ['UPDATE_ALWAYS']
-          }
+          'resource': PROJECT_ID
       },
+      depends_on=['project'],
+      runtime_policy=['CREATE', 'UPDATE_ON_CHANGE'])
+
+  # Set the IAM policy patching the existing policy
+  # with whatever is currently in the config.
+  patch_iam_policy = model.Action(
+      'patch-iam-policy-' + suffix,
+      ('gcp-types/cloudresourcemanager-v1:' +
+       'cloudresourcemanager.projects.setIamPolicy'),
       {
-          # Set the IAM policy patching the existing policy
-          # with whatever is currently in the config.
-          'name': 'patch-iam-policy-' + ''.join(random.choice(string.ascii_lowercase) for i in list(range(10))),
-          'action': ('gcp-types/cloudresourcemanager-v1:' +
-                     'cloudresourcemanager.projects.setIamPolicy'),
-          'properties': {
-              'resource': '$(ref.project.projectId)',
-              'policy': '$(ref.' + get_iam_policy_name + ')',
-              'gcpIamPolicyPatch': {
-                  'add': context.properties['iamPolicies']
-              }
-          },
-          'metadata': {
-              'dependsOn': [get_iam_policy_name]
+          'resource': PROJECT_ID,
+          'policy': get_iam_policy.ref(),
+          'gcpIamPolicyPatch': {
+              'add': context.properties['iamPolicies']
           }
-      }
-  ]
+      },
+      depends_on=[get_iam_policy],
+      runtime_policy=['CREATE', 'UPDATE_ON_CHANGE'])
+
+  return [get_iam_policy, patch_iam_policy]
+
+
+# The kinds of bucket location; the default is the US multi-region.
+BUCKET_LOCATION_TYPES = ['multi-region', 'dual-region', 'region']
+
+
+def bucket_location(context):
+  """Returns the location properties shared by the project's buckets.
+
+  A region (e.g. us-central1) or multi-region (e.g. US) is given as the
+  bucketLocation. A dual-region is given either by its predefined name (e.g.
+  NAM4), or as the multi-region holding the two regions listed in
+  bucketDataLocations.
+
+  Args:
+      context: the DM context object.
+
+  Returns:
+      A dict of bucket properties; empty when no bucketLocation is given.
+
+  Raises:
+      ValueError: if the location does not match its location type.
+  """
+  location = context.properties.get('bucketLocation')
+  location_type = context.properties.get('bucketLocationType', 'multi-region')
+  data_locations = context.properties.get('bucketDataLocations')
+
+  if location_type not in BUCKET_LOCATION_TYPES:
+    raise ValueError('Unknown bucketLocationType {!r}; expected one of {}.'.format(
+        location_type, ', '.join(BUCKET_LOCATION_TYPES)))
+  if data_locations and location_type != 'dual-region':
+    raise ValueError('bucketDataLocations is only valid for a dual-region.')
+  if not location:
+    if location_type != 'multi-region':
+      raise ValueError('A {} bucketLocationType needs a bucketLocation.'.format(
+          location_type))
+    return {}
+
+  # Regions are the only locations named with a hyphen.
+  if (location_type == 'region') != ('-' in location):
+    raise ValueError('Bucket location {!r} is not a {}.'.format(
+        location, location_type))
+
+  properties = {'location': location}
+  if data_locations:
+    if len(data_locations) != 2 or not all('-' in l for l in data_locations):
+      raise ValueError('bucketDataLocations must name two regions.')
+    properties['customPlacementConfig'] = {'dataLocations': list(data_locations)}
+  return properties
 
 
 def create_usage_export_bucket(context, api_names_list):
@@ -127,39 +243,106 @@ def create_usage_export_bucket(context, api_names_list):
   Returns:
     A list of DM resources, to create and set the usage export bucket.
   """
-  resources = []
-  bucket_name = '$(ref.project.projectId)-usage-export'
+  bucket_name = model.Concat(PROJECT_ID, '-usage-export')
 
   # Create the bucket.
-  resources.append({
-      'name': 'create-usage-export-bucket',
-      'type': 'gcp-types/storage-v1:buckets',
-      'properties': {
-          'project': '$(ref.project.projectId)',
+  bucket = model.Resource(
+      'create-usage-export-bucket',
+      'gcp-types/storage-v1:buckets',
+      {
+          'project': PROJECT_ID,
           'name': bucket_name
       },
-      'metadata': {
-          # Only create the bucket once all APIs have been
-          # activated.
-          'dependsOn': api_names_list
-      }
-  })
+      # Only create the bucket once all APIs have been
+      # activated.
+      depends_on=api_names_list)
+  bucket.properties.update(bucket_location(context))
 
   # Set the project's usage export bucket.
-  resources.append({
-      'name': 'set-usage-export-bucket',
-      'action': (
-          'gcp-types/compute-v1:' + 'compute.projects.setUsageExportBucket'),
-      'properties': {
-          'project': '$(ref.project.projectId)',
-          'bucketName': 'gs://' + bucket_name
+  set_bucket = model.Action(
+      'set-usage-export-bucket',
+      'gcp-types/compute-v1:' + 'compute.projects.setUsageExportBucket',
+      {
+          'project': PROJECT_ID,
+          'bucketName': model.Concat('gs://', bucket_name)
       },
-      'metadata': {
-          'dependsOn': ['create-usage-export-bucket']
+      depends_on=[bucket])
+
+  return [bucket, set_bucket]
+
+
+# The storage classes lifecycle tiers can move objects to, warmest first.
+LIFECYCLE_STORAGE_CLASSES = ['NEARLINE', 'COLDLINE', 'ARCHIVE']
+
+
+def storage_logs_lifecycle(context):
+  """Returns the lifecycle, or Autoclass, properties of the storage logs bucket.
+
+  Objects are deleted storageBucketLifecycle days after creation. Before
+  that, they are either moved to colder storage classes at the ages given by
+  storageBucketLifecycleTiers, or, with storageBucketAutoclass, moved (and
+  brought back) by GCS according to how they are accessed.
+
+  Args:
+      context: the DM context object.
+
+  Returns:
+      A dict of bucket properties.
+
+  Raises:
+      ValueError: if the tiers are out of order, or combined with Autoclass.
+  """
+  delete_age = context.properties.get('storageBucketLifecycle', 180)
+  tiers = context.properties.get('storageBucketLifecycleTiers', [])
+  autoclass = context.properties.get('storageBucketAutoclass', False)
+
+  if tiers and autoclass:
+    raise ValueError('storageBucketLifecycleTiers cannot be combined with '
+                     'storageBucketAutoclass.')
+
+  rules = []
+  warmer_classes = ['STANDARD']
+  last_age = 0
+  for tier in tiers:
+    storage_class = tier['storageClass']
+    if storage_class not in LIFECYCLE_STORAGE_CLASSES:
+      raise ValueError('Unknown lifecycle storage class {!r}; expected one of '
+                       '{}.'.format(storage_class,
+                                    ', '.join(LIFECYCLE_STORAGE_CLASSES)))
+    if (len(warmer_classes) > 1 and
+        LIFECYCLE_STORAGE_CLASSES.index(storage_class) <=
+        LIFECYCLE_STORAGE_CLASSES.index(warmer_classes[-1])):
+      raise ValueError('Lifecycle tiers must move to ever colder classes.')
+    if not last_age < tier['age'] < delete_age:
+      raise ValueError('Lifecycle tier ages must increase, and come before '
+                       'the storageBucketLifecycle age of {} days.'.format(
+                           delete_age))
+    rules.append({
+        'action': {
+            'type': 'SetStorageClass',
+            'storageClass': storage_class
+        },
+        'condition': {
+            'age': tier['age'],
+            'matchesStorageClass': list(warmer_classes)
+        }
+    })
+    warmer_classes.append(storage_class)
+    last_age = tier['age']
+
+  rules.append({
+      'action': {
+          'type': 'Delete'
+      },
+      'condition': {
+          'age': delete_age
       }
   })
 
-  return resources
+  properties = {'lifecycle': {'rule': rules}}
+  if autoclass:
+    properties['autoclass'] = {'enabled': True}
+  return properties
 
 
 def create_storage_logs_bucket(context, api_names_list):
@@ -178,55 +361,103 @@ def create_storage_logs_bucket(context, api_names_list):
     Returns:
       A list of DM resources, to create and set the storage logs bucket.
     """
-    resources = []
-    bucket_name = 'storage-logs-$(ref.project.projectId)'
+    bucket_name = model.Concat('storage-logs-', PROJECT_ID)
 
     # Create the bucket.
-    resources.append({
-        'name': 'create-storage-logs-bucket',
-        'type': 'gcp-types/storage-v1:buckets',
-        'properties': {
-            'project': '$(ref.project.projectId)',
-            'name': bucket_name,
-            'lifecycle': {
-                'rule': [
-                    {
-                        'action': {
-                            'type': 'Delete'
-                        },
-                        'condition': {
-                            'age': context.properties.get('storageBucketLifecycle', 180)
-                        }
-
-                    }
-                ]
-            }
+    bucket = model.Resource(
+        'create-storage-logs-bucket',
+        'gcp-types/storage-v1:buckets',
+        {
+            'project': PROJECT_ID,
+            'name': bucket_name
         },
-        'metadata': {
-            # Only create the bucket once all APIs have been
-            # activated.
-            'dependsOn': api_names_list
-        }
-    })
+        # Only create the bucket once all APIs have been
+        # activated.
+        depends_on=api_names_list)
+    bucket.properties.update(storage_logs_lifecycle(context))
+    bucket.properties.update(bucket_location(context))
 
     # # Add cloud-storage-analytics@google.com as a writer so it can write logs
     # # Do it as a separate call so bucket gets default permissions plus this one
-    resources.append({
-        'name': 'add-cloud-storage-writer',
-        'type': 'gcp-types/storage-v1:bucketAccessControls',
-        'properties': {
+    writer = model.Resource(
+        'add-cloud-storage-writer',
+        'gcp-types/storage-v1:bucketAccessControls',
+        {
             'bucket': bucket_name,
             'entity': 'group-cloud-storage-analytics@google.com',
             'role': 'WRITER'
         },
-        'metadata': {
-            # Only create the bucket once all APIs have been
-            # activated.
-            'dependsOn': ['create-storage-logs-bucket']
-        }
-    })
+        depends_on=[bucket])
+
+    return [bucket, writer]
 
-    return resources
+
+# How access to the cromwell auth bucket is controlled: by bucket and default
+# object ACLs, or by bucket IAM bindings with uniform bucket-level access.
+CROMWELL_AUTH_BUCKET_ACCESS_MODES = ['fine-grained', 'uniform']
+
+
+def create_uniform_cromwell_auth_bucket(context, api_names_list, bucket_name,
+                                        bucket_readers):
+    """Creates the cromwell auth bucket with uniform bucket-level access.
+
+    The bucket IAM policy grants the access the fine-grained ACLs would: the
+    project's editors and owners own the bucket and its objects, and the
+    reader groups can list and read them. Object writes then carry no ACLs.
+
+    Args:
+        context: the DM context object.
+        api_names_list: the names of all resources that enable GCP APIs.
+        bucket_name: the name of the bucket.
+        bucket_readers: the emails of the groups that can read the bucket.
+
+    Returns:
+      A list of DM resources, to create the bucket and set its IAM policy.
+    """
+    owners = [model.Concat('projectEditor:', PROJECT_ID),
+              model.Concat('projectOwner:', PROJECT_ID)]
+    readers = ['group:{}'.format(email) for email in bucket_readers]
+
+    bindings = [
+        {'role': 'roles/storage.legacyBucketOwner', 'members': owners},
+        {'role': 'roles/storage.legacyObjectOwner', 'members': owners},
+    ]
+    if readers:
+        bindings.extend([
+            {'role': 'roles/storage.legacyBucketReader', 'members': readers},
+            {'role': 'roles/storage.legacyObjectReader', 'members': readers},
+        ])
+
+    bucket = model.Resource(
+        'create-cromwell-auth-bucket',
+        'gcp-types/storage-v1:buckets',
+        {
+            'project': PROJECT_ID,
+            'name': bucket_name,
+            'iamConfiguration': {
+                'uniformBucketLevelAccess': {
+                    'enabled': True
+                }
+            }
+        },
+        # Only create the bucket once all APIs have been
+        # activated.
+        depends_on=api_names_list)
+    bucket.properties.update(bucket_location(context))
+
+    # The whole policy is set, replacing the project viewer grants a new
+    # bucket starts with, as the fine-grained ACLs do.
+    set_iam_policy = model.Action(
+        'set-cromwell-auth-bucket-iam-policy',
+        'gcp-types/storage-v1:storage.buckets.setIamPolicy',
+        {
+            'bucket': bucket_name,
+            'bindings': bindings
+        },
+        depends_on=[bucket],
+        runtime_policy=['CREATE', 'UPDATE_ON_CHANGE'])
+
+    return [bucket, set_iam_policy]
 
 
 def create_cromwell_auth_bucket(context, api_names_list):
@@ -245,8 +476,7 @@ def create_cromwell_auth_bucket(context, api_names_list):
     Returns:
       A list of DM resources, to create and set the cromwell auth bucket.
     """
-    resources = []
-    bucket_name = 'cromwell-auth-$(ref.project.projectId)'
+    bucket_name = model.Concat('cromwell-auth-', PROJECT_ID)
 
     bucket_readers = [] # this should maybe be adjusted to be more extendable?
     if 'projectOwnersGroup' in context.properties:
@@ -255,18 +485,27 @@ def create_cromwell_auth_bucket(context, api_names_list):
     if 'projectViewersGroup' in context.properties:
         bucket_readers.append(context.properties.get('projectViewersGroup'))
 
+    access = context.properties.get('cromwellAuthBucketAccess', 'fine-grained')
+    if access not in CROMWELL_AUTH_BUCKET_ACCESS_MODES:
+        raise ValueError(
+            'Unknown cromwellAuthBucketAccess {!r}; expected one of {}.'.format(
+                access, ', '.join(CROMWELL_AUTH_BUCKET_ACCESS_MODES)))
+    if access == 'uniform':
+        return create_uniform_cromwell_auth_bucket(
+            context, api_names_list, bucket_name, bucket_readers)
+
     bucket_acl = [
         {
             'type': 'gcp-types/storage-v1:bucketAccessControls',
             'properties': {
-                'entity': 'project-editors-$(ref.project.projectNumber)',
+                'entity': model.Concat('project-editors-', PROJECT_NUMBER),
                 'role': 'OWNER'
             }
         },
         {
             'type': 'gcp-types/storage-v1:bucketAccessControls',
             'properties': {
-                'entity': 'project-owners-$(ref.project.projectNumber)',
+                'entity': model.Concat('project-owners-', PROJECT_NUMBER),
                 'role': 'OWNER'
             }
         }
@@ -276,14 +515,14 @@ def create_cromwell_auth_bucket(context, api_names_list):
         {
             'type': 'gcp-types/storage-v1:objectAccessControls',
             'properties': {
-                'entity': 'project-editors-$(ref.project.projectNumber)',
+                'entity': model.Concat('project-editors-', PROJECT_NUMBER),
                 'role': 'OWNER'
             }
         },
         {
             'type': 'gcp-types/storage-v1:objectAccessControls',
             'properties': {
-                'entity': 'project-owners-$(ref.project.projectNumber)',
+                'entity': model.Concat('project-owners-', PROJECT_NUMBER),
                 'role': 'OWNER'
             }
         }
@@ -307,23 +546,61 @@ def create_cromwell_auth_bucket(context, api_names_list):
         })
 
     # Create the bucket.
-    resources.append({
-        'name': 'create-cromwell-auth-bucket',
-        'type': 'gcp-types/storage-v1:buckets',
-        'properties': {
-            'project': '$(ref.project.projectId)',
+    bucket = model.Resource(
+        'create-cromwell-auth-bucket',
+        'gcp-types/storage-v1:buckets',
+        {
+            'project': PROJECT_ID,
             'name': bucket_name,
-             'acl[]': bucket_acl,
-             'defaultObjectAcl[]': default_object_acl
+            'acl[]': bucket_acl,
+            'defaultObjectAcl[]': default_object_acl
         },
-        'metadata': {
-            # Only create the bucket once all APIs have been
-            # activated.
-            'dependsOn': api_names_list
-        }
-    })
+        # Only create the bucket once all APIs have been
+        # activated.
+        depends_on=api_names_list)
+    bucket.properties.update(bucket_location(context))
+
+    return [bucket]
 
-    return resources
+
+def create_parameter_record_object(context, depends_on):
+  """Stores the caller's parameter record in the storage logs bucket.
+
+  The record is kept in the custom metadata of an empty object, created by a
+  metadata-only insert, rather than in the project-wide compute metadata,
+  which every VM in the project can read from the metadata server. The
+  object is private to its owner, so that only principals with project-level
+  storage object access can read it. It is rewritten whenever the record, and
+  so the hash label derived from it, changes.
+
+  Args:
+      context: the DM context object.
+      depends_on: the storage logs bucket resources.
+
+  Returns:
+      A list holding the DM action writing the record.
+  """
+  record = context.properties['parameterRecord']
+  return [model.Action(
+      'write-parameter-record',
+      'gcp-types/storage-v1:storage.objects.insert',
+      {
+          'bucket': model.Concat('storage-logs-', PROJECT_ID),
+          'name': record['key'],
+          'predefinedAcl': 'private',
+          'metadata': {
+              record['key']: record['value']
+          }
+      },
+      depends_on=depends_on,
+      runtime_policy=['CREATE', 'UPDATE_ON_CHANGE'])]
+
+
+# The default VPC network GCP creates with a project, and its statically-named
+# firewall rules.
+DEFAULT_NETWORK = 'default'
+DEFAULT_NETWORK_FIREWALLS = ['default-allow-icmp', 'default-allow-internal',
+                             'default-allow-rdp', 'default-allow-ssh']
 
 
 def delete_default_network(api_names_list):
@@ -338,73 +615,28 @@ def delete_default_network(api_names_list):
   """
   # These are GCP's statically-named firewall rules that we need to delete from
   # the project before we delete the entire network.
-  icmp_name = 'delete-default-allow-icmp'
-  internal_name = 'delete-default-allow-internal'
-  rdp_name = 'delete-default-allow-rdp'
-  ssh_name = 'delete-default-allow-ssh'
-
-  resource = [
-      {
-          'name': icmp_name,
-          'action': 'gcp-types/compute-beta:compute.firewalls.delete',
-          'metadata': {
-              'dependsOn': api_names_list
-          },
-          'properties': {
-              'firewall': 'default-allow-icmp',
-              'project': '$(ref.project.projectId)',
-          }
-      },
-      {
-          'name': internal_name,
-          'action': 'gcp-types/compute-beta:compute.firewalls.delete',
-          'metadata': {
-              'dependsOn': api_names_list
-          },
-          'properties': {
-              'firewall': 'default-allow-internal',
-              'project': '$(ref.project.projectId)',
-          }
-      },
-      {
-          'name': rdp_name,
-          'action': 'gcp-types/compute-beta:compute.firewalls.delete',
-          'metadata': {
-              'dependsOn': api_names_list
-          },
-          'properties': {
-              'firewall': 'default-allow-rdp',
-              'project': '$(ref.project.projectId)',
-          }
-      },
-      {
-          'name': ssh_name,
-          'action': 'gcp-types/compute-beta:compute.firewalls.delete',
-          'metadata': {
-              'dependsOn': api_names_list
-          },
-          'properties': {
-              'firewall': 'default-allow-ssh',
-              'project': '$(ref.project.projectId)',
-          }
-      },
-  ]
+  resource = []
+  for firewall in DEFAULT_NETWORK_FIREWALLS:
+    resource.append(model.Action(
+        'delete-' + firewall,
+        'gcp-types/compute-beta:compute.firewalls.delete',
+        {
+            'firewall': firewall,
+            'project': PROJECT_ID,
+        },
+        depends_on=api_names_list))
 
   # Ensure all firewall rules are removed before deleting the VPC.
-  network_dependency = copy.copy(api_names_list)
-  network_dependency.extend([icmp_name, internal_name, rdp_name, ssh_name])
-
-  resource.append({
-      'name': 'delete-default-network',
-      'action': 'gcp-types/compute-beta:compute.networks.delete',
-      'metadata': {
-          'dependsOn': network_dependency
+  network_dependency = list(api_names_list) + resource
+
+  resource.append(model.Action(
+      'delete-default-network',
+      'gcp-types/compute-beta:compute.networks.delete',
+      {
+          'network': DEFAULT_NETWORK,
+          'project': PROJECT_ID
       },
-      'properties': {
-          'network': 'default',
-          'project': '$(ref.project.projectId)'
-      }
-  })
+      depends_on=network_dependency))
 
   return resource
 
@@ -419,29 +651,67 @@ def delete_default_service_account(api_names_list):
       A list of DM actions to remove the default project service account.
   """
 
-  resource = [{
-      'name': 'delete-default-sa',
-      'action': 'gcp-types/iam-v1:iam.projects.serviceAccounts.delete',
-      'metadata': {
-          'dependsOn': api_names_list,
-          'runtimePolicy': ['CREATE']
+  resource = [model.Action(
+      'delete-default-sa',
+      'gcp-types/iam-v1:iam.projects.serviceAccounts.delete',
+      {
+          'name': model.Concat('projects/', PROJECT_ID, '/serviceAccounts/',
+                               PROJECT_NUMBER, '-compute@',
+                               'developer.gserviceaccount.com'),
       },
-      'properties': {
-          'name': ('projects/$(ref.project.projectId)/serviceAccounts/' +
-                   '$(ref.project.projectNumber)-compute@' +
-                   'developer.gserviceaccount.com'),
-      }
-  }]
+      depends_on=api_names_list,
+      runtime_policy=['CREATE'])]
 
   return resource
 
 
+def check_teardown_buckets(context):
+  """Refuses to tear down a project with a usage export bucket, unless confirmed.
+
+  Deleting the project deletes its buckets along with it. The usage export
+  bucket keeps its reports indefinitely, so tearing down such a project
+  requires the teardownConfirmBucketDeletion property, to be set once the
+  reports have been copied elsewhere or are known to be unneeded. The storage
+  logs bucket needs no confirmation: its lifecycle deletes the logs after
+  storageBucketLifecycle days in any case.
+
+  Arguments:
+      context: the DM context object.
+
+  Raises:
+      ValueError: if the usage export bucket would be deleted without
+        confirmation.
+  """
+  if (context.properties.get('createUsageExportBucket', False) and
+      not context.properties.get('teardownConfirmBucketDeletion', False)):
+    raise ValueError(
+        'Tearing down project {} deletes its usage export bucket; set '
+        'teardownConfirmBucketDeletion to proceed.'.format(
+            context.properties.get('projectId')))
+
+
 def label_safe_string(s, prefix = "fc-"):
   # https://cloud.google.com/compute/docs/labeling-resources#restrictions
   # note that label keys (but not values) have a 64-char length maximum which is not enforced here.
   return prefix + re.sub("[^a-z0-9\\-_]", "-", s.lower())
 
 
+def create_labels(context):
+  """Creates the project labels, adding the billing account to the given ones.
+
+  Arguments:
+      context: the DM context object.
+
+  Returns:
+      A dict of project labels.
+  """
+  project_labels = dict(context.properties.get('labels', {}))
+  project_labels.update({
+      "billingaccount": label_safe_string(context.properties.get('billingAccountFriendlyName'))
+  })
+  return project_labels
+
+
 def generate_config(context):
   """Entry point, called by deployment manager.
 
@@ -454,81 +724,88 @@ def generate_config(context):
 
   project_id = context.properties.get('projectId')
   project_name = context.properties.get('name', project_id)
-  project_labels = context.properties.get('labels', {})
-  project_labels.update({
-      "billingaccount": label_safe_string(context.properties.get('billingAccountFriendlyName'))
-  })
+  project_labels = create_labels(context)
 
   # Ensure that the parent ID is a string.
-  context.properties['parent']['id'] = str(context.properties['parent']['id'])
+  parent = dict(context.properties['parent'])
+  parent['id'] = str(parent['id'])
 
   resources = [
-      {
-          'name': 'project',
-          'type': 'cloudresourcemanager.v1.project',
-          'properties': {
+      model.Resource(
+          'project',
+          'cloudresourcemanager.v1.project',
+          {
               'name': project_name,
               'projectId': project_id,
-              'parent': context.properties['parent'],
+              'parent': parent,
               'labels': project_labels
-          }
-      },
-      {
-          'name': 'billing',
-          'type': 'deploymentmanager.v2.virtual.projectBillingInfo',
-          'properties': {
+          }),
+      model.Resource(
+          'billing',
+          'deploymentmanager.v2.virtual.projectBillingInfo',
+          {
               'name':
-                  'projects/$(ref.project.projectId)',
+                  model.Concat('projects/', PROJECT_ID),
               'billingAccountName':
                   context.properties['billingAccountId']
-          }
-      }
+          })
   ]
 
+  if context.properties.get('teardown', False):
+    check_teardown_buckets(context)
+    # Keep the project resource exactly as created, so that DM leaves it
+    # untouched when the teardown config is applied and every other resource
+    # is abandoned.
+    return naming.namespace_config(
+        resources[:1], [
+            ('projectId', PROJECT_ID),
+            ('resourceNames', [resources[0].name]),
+        ], context.properties.get('resourceNamePrefix'))
+
   resources.extend(create_iam_policies(context))
 
   api_resources = create_apis(context)
   resources.extend(api_resources)
-  api_resource_names = [resource['name'] for resource in api_resources]
+  api_resource_names = [resource.name for resource in api_resources]
 
   if context.properties.get('createUsageExportBucket', False):
     resources.extend(create_usage_export_bucket(context, api_resource_names))
 
+  storage_logs_bucket = []
   if context.properties.get('storageLogsBucket', True):
-    resources.extend(create_storage_logs_bucket(context, api_resource_names))
+    storage_logs_bucket = create_storage_logs_bucket(context, api_resource_names)
+    resources.extend(storage_logs_bucket)
 
   if context.properties.get('cromwellAuthBucket', True):
     resources.extend(create_cromwell_auth_bucket(context, api_resource_names))
 
+  if 'parameterRecord' in context.properties:
+    if not storage_logs_bucket:
+      raise ValueError('The parameterRecord is stored in the storage logs '
+                       'bucket, so it requires storageLogsBucket.')
+    resources.extend(
+        create_parameter_record_object(context, storage_logs_bucket))
+
   if context.properties.get('removeDefaultVPC', True):
     resources.extend(delete_default_network(api_resource_names))
 
   if context.properties.get('removeDefaultSA', True):
     resources.extend(delete_default_service_account(api_resource_names))
 
-  return {
-      'resources':
-          resources,
-      'outputs': [
-          {
-              'name': 'projectId',
-              'value': '$(ref.project.projectId)'
-          },
-          {
-              'name': 'usageExportBucketName',
-              'value': '$(ref.project.projectId)-usage-export'
-          },
-          {
-              'name': 'storageLogsBucketName',
-              'value': 'storage-logs-$(ref.project.projectId)'
-          },
-          {
-              'name': 'cromwellAuthBucketName',
-              'value': 'cromwell-auth-$(ref.project.projectId)'
-          },
-          {
-              'name': 'resourceNames',
-              'value': [resource['name'] for resource in resources]
-          },
-      ]
-  }
+  optional_api_resources = create_optional_apis(context, api_resource_names)
+
+  outputs = [
+      ('projectId', PROJECT_ID),
+      ('projectNumber', PROJECT_NUMBER),
+      ('usageExportBucketName', model.Concat(PROJECT_ID, '-usage-export')),
+      ('storageLogsBucketName', model.Concat('storage-logs-', PROJECT_ID)),
+      ('cromwellAuthBucketName', model.Concat('cromwell-auth-', PROJECT_ID)),
+      ('resourceNames', [resource.name for resource in resources]),
+      ('optionalApiResourceNames',
+       [resource.name for resource in optional_api_resources]),
+      ('iamPolicies', context.properties.get('iamPolicies', [])),
+  ]
+
+  return naming.namespace_config(
+      resources + optional_api_resources, outputs,
+      context.properties.get('resourceNamePrefix'))
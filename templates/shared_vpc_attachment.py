@@ -0,0 +1,116 @@
+""" This template attaches a project to a Shared VPC host project.
+
+The project becomes a service project of the host, and the given members are
+granted roles/compute.networkUser on each of the host's subnetworks it may
+use, rather than on the whole host project. Nothing else is created in the
+service project: the network, its firewall rules, routes and DNS are managed
+in the host project.
+"""
+
+from templates import model
+from templates import naming
+
+NETWORK_USER_ROLE = 'roles/compute.networkUser'
+
+COMPUTE_V1 = 'https://www.googleapis.com/compute/v1/'
+
+
+def network_self_link(host_project, network):
+  """ Returns the self link of a host project's network. """
+  return '{}projects/{}/global/networks/{}'.format(
+    COMPUTE_V1, host_project, network)
+
+
+def subnetwork_self_link(host_project, subnetwork):
+  """ Returns the self link of a host project's subnetwork. """
+  return '{}projects/{}/regions/{}/subnetworks/{}'.format(
+    COMPUTE_V1, host_project, subnetwork['region'], subnetwork['name'])
+
+
+def validate_subnetworks(subnetworks):
+  """ Raises a ValueError unless there is one subnetwork per region. """
+  if not subnetworks:
+    raise ValueError('A Shared VPC attachment needs at least one subnetwork.')
+  regions = [subnetwork['region'] for subnetwork in subnetworks]
+  duplicates = sorted(set(r for r in regions if regions.count(r) > 1))
+  if duplicates:
+    raise ValueError('Shared VPC subnetworks must be in distinct regions; '
+                     'found several in {}.'.format(', '.join(duplicates)))
+
+
+def create_subnetwork_iam_policy(host_project, subnetwork, members, depends_on):
+  """ Grants the network user role on a subnetwork, keeping other bindings.
+
+  As for the project IAM policy, the policy is read and patched by a pair of
+  actions, so that grants to other service projects are left in place.
+  """
+  suffix = '{}-{}'.format(subnetwork['region'], subnetwork['name'])
+  get_policy = model.Action(
+    'get-subnetwork-iam-policy-' + suffix,
+    'gcp-types/compute-v1:compute.subnetworks.getIamPolicy',
+    {
+      'project': host_project,
+      'region': subnetwork['region'],
+      'resource': subnetwork['name'],
+    },
+    depends_on=depends_on,
+    runtime_policy=['CREATE', 'UPDATE_ON_CHANGE'])
+
+  patch_policy = model.Action(
+    'patch-subnetwork-iam-policy-' + suffix,
+    'gcp-types/compute-v1:compute.subnetworks.setIamPolicy',
+    {
+      'project': host_project,
+      'region': subnetwork['region'],
+      'resource': subnetwork['name'],
+      'policy': get_policy.ref(),
+      'gcpIamPolicyPatch': {
+        'add': [{'role': NETWORK_USER_ROLE, 'members': members}]
+      }
+    },
+    depends_on=[get_policy],
+    runtime_policy=['CREATE', 'UPDATE_ON_CHANGE'])
+
+  return [get_policy, patch_policy]
+
+
+def generate_config(context):
+  """ Entry point for the deployment resources. """
+  host_project = context.properties['hostProject']
+  subnetworks = context.properties['subnetworks']
+  validate_subnetworks(subnetworks)
+
+  # Only the host can take the project on; this requires the deploying
+  # account to be a Shared VPC Admin of the host project (or its folder).
+  attach = model.Action(
+    context.properties['resourceName'],
+    'gcp-types/compute-v1:compute.projects.enableXpnResource',
+    {
+      'project': host_project,
+      'xpnResource': {
+        'id': context.properties['projectId'],
+        'type': 'PROJECT'
+      }
+    },
+    # If a dependsOn property was passed in, the attachment should depend on
+    # that.
+    depends_on=context.properties.get('dependsOn'),
+    # The attachment goes away with the service project.
+    runtime_policy=['CREATE'])
+
+  resources = [attach]
+  for subnetwork in subnetworks:
+    resources.extend(create_subnetwork_iam_policy(
+      host_project, subnetwork, context.properties['networkUsers'], [attach]))
+
+  # The same outputs as network.py, so that callers can use either.
+  outputs = [
+    ('name', attach.name),
+    ('selfLink',
+     network_self_link(host_project, context.properties['network'])),
+    ('resourceNames', [resource.name for resource in resources]),
+  ]
+
+  return naming.namespace_config(
+    resources, outputs,
+    context.properties.get('resourceNamePrefix'))
@@ -13,16 +13,19 @@
 # limitations under the License.
 """ This template creates a subnetwork. """
 
+from templates import model
+from templates import naming
+
 
 def generate_config(context):
   """ Entry point for the deployment resources. """
 
   enable_flow_logs = context.properties.get('enableFlowLogs', False)
 
-  subnetwork_resource = {
-      'name': context.properties['resourceName'],
-      'type': 'gcp-types/compute-beta:subnetworks',
-      'properties': {
+  subnetwork_resource = model.Resource(
+      context.properties['resourceName'],
+      'gcp-types/compute-beta:subnetworks',
+      {
           # Required properties.
           'name':
               context.properties['name'],
@@ -42,36 +45,27 @@ def generate_config(context):
               context.properties.get('privateIpGoogleAccess', False),
           'secondaryIpRanges':
               context.properties.get('secondaryIpRanges', []),
-      }
-  }
-  
+      },
+      # Pass the 'dependsOn' property to the subnetwork resource if present.
+      depends_on=context.properties.get('dependsOn'))
+
   if enable_flow_logs:
     # If flow logs are enabled, we want to adjust the default config in two ways:
     # (1) Increase the sampling ratio (defaults to 0.5) so we sample all traffic.
     # (2) Reduce the aggregation interval to 30 seconds (default is 5secs) to save on
     #     storage.
-    subnetwork_resource['properties']['logConfig'] = {
+    subnetwork_resource.properties['logConfig'] = {
         'aggregationInterval': 'INTERVAL_30_SEC',
         'enable': True,
         'flowSampling': 1.0,
         'metadata': 'INCLUDE_ALL_METADATA',
     }
 
-  # Pass the 'dependsOn' property to the subnetwork resource if present.
-  if 'dependsOn' in context.properties:
-    subnetwork_resource['metadata'] = {
-        'dependsOn': context.properties['dependsOn']
-    }
-
-  output = [
-      {
-          'name': 'name',
-          'value': subnetwork_resource['name'],
-      },
-      {
-          'name': 'selfLink',
-          'value': '$(ref.{}.selfLink)'.format(subnetwork_resource['name']),
-      },
+  outputs = [
+      ('name', subnetwork_resource.name),
+      ('selfLink', subnetwork_resource.ref('selfLink')),
   ]
 
-  return {'resources': [subnetwork_resource], 'outputs': output}
+  return naming.namespace_config(
+      [subnetwork_resource], outputs,
+      context.properties.get('resourceNamePrefix'))
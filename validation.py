@@ -0,0 +1,220 @@
+"""Pre-flight validation of template properties and expanded manifests.
+
+validate_properties checks properties against the subset of the .py.schema
+format used in this repository (required, type, enum, pattern, items,
+minItems), the way Deployment Manager does before running a template.
+check_imports checks that a template's schema imports every repository module
+the template needs, so that it can also be deployed on its own.
+check_template_call does both for use during expansion, so that each child
+template call is checked against its own schema, as Deployment Manager does.
+validate_manifest checks an expanded configuration (see expansion.py) for
+problems Deployment Manager would only report once a deployment is under way:
+duplicate resource names, and dependencies or references on resources that do
+not exist.
+"""
+import ast
+import os
+import re
+
+import yaml
+
+import expansion
+
+SCHEMA_TYPES = {
+  'array': (list,),
+  'boolean': (bool,),
+  'integer': (int,),
+  'number': (int, float),
+  'object': (dict,),
+  'string': (str,),
+}
+
+_schemas = {}
+_import_errors = {}
+
+
+class ValidationError(ValueError):
+  """Raised when a template's properties don't match its schema."""
+
+  def __init__(self, errors):
+    super(ValidationError, self).__init__('; '.join(errors))
+    self.errors = errors
+
+
+def load_schema(template):
+  """Loads the schema of a template, given the template's path.
+
+  Returns:
+    The parsed schema, or None if the template has no schema.
+  """
+  path = os.path.join(expansion.ROOT_DIR, template) + '.schema'
+  if path not in _schemas:
+    if not os.path.exists(path):
+      _schemas[path] = None
+    else:
+      with open(path) as f:
+        _schemas[path] = yaml.safe_load(f)
+  return _schemas[path]
+
+
+def _type_matches(value, schema_type):
+  types = schema_type if isinstance(schema_type, list) else [schema_type]
+  for t in types:
+    # bool is a subclass of int, but not a schema integer.
+    if isinstance(value, bool) and t in ('integer', 'number'):
+      continue
+    if isinstance(value, SCHEMA_TYPES.get(t, object)):
+      return True
+  return False
+
+
+def _validate_value(value, schema, path, errors):
+  if isinstance(value, str) and '$(ref.' in value:
+    # References are only resolved at deployment time.
+    return
+  if 'type' in schema and not _type_matches(value, schema['type']):
+    errors.append('{}: expected {}, got {!r}'.format(path, schema['type'], value))
+    return
+  if 'enum' in schema and value not in schema['enum']:
+    errors.append('{}: {!r} is not one of {}'.format(path, value, schema['enum']))
+  if ('pattern' in schema and isinstance(value, str) and
+      not re.search(schema['pattern'], value)):
+    errors.append('{}: {!r} does not match {}'.format(
+      path, value, schema['pattern']))
+  if isinstance(value, list):
+    if len(value) < schema.get('minItems', 0):
+      errors.append('{}: expected at least {} items'.format(
+        path, schema['minItems']))
+    for i, item in enumerate(value):
+      _validate_value(item, schema.get('items', {}), '{}[{}]'.format(path, i),
+                      errors)
+  if isinstance(value, dict):
+    for name in schema.get('required', []):
+      if name not in value:
+        errors.append('{}: missing required property {}'.format(path, name))
+    for name, property_schema in schema.get('properties', {}).items():
+      if name in value:
+        _validate_value(value[name], property_schema,
+                        '{}.{}'.format(path, name), errors)
+
+
+def validate_properties(template, properties):
+  """Validates a template's properties against its schema.
+
+  Returns:
+    A list of error messages; empty if the properties are valid.
+  """
+  schema = load_schema(template)
+  if schema is None:
+    return []
+  errors = []
+  _validate_value(properties, schema, 'properties', errors)
+  return errors
+
+
+def _module_imports(module):
+  """Returns the repository modules a Python module imports, by path."""
+  with open(os.path.join(expansion.ROOT_DIR, module)) as f:
+    tree = ast.parse(f.read(), module)
+  names = []
+  for node in ast.walk(tree):
+    if isinstance(node, ast.Import):
+      names.extend(alias.name for alias in node.names)
+    elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+      names.extend(node.module + '.' + alias.name for alias in node.names)
+  paths = [name.replace('.', '/') + '.py' for name in names]
+  return [path for path in paths
+          if os.path.exists(os.path.join(expansion.ROOT_DIR, path))]
+
+
+def check_imports(template):
+  """Checks that a template's schema imports the modules the template needs.
+
+  Deployment Manager only makes the files listed under a schema's imports
+  available to a template deployed on its own, so these must include every
+  repository module the template imports, directly or indirectly. Imports are
+  matched by their name, or else by their path relative to the schema.
+
+  Returns:
+    A list of error messages; empty if all imports are covered, or if the
+    template has no schema.
+  """
+  if template not in _import_errors:
+    schema = load_schema(template)
+    errors = []
+    if schema is not None:
+      imported = set()
+      for entry in schema.get('imports', []):
+        imported.add(entry.get('name') or os.path.normpath(
+          os.path.join(os.path.dirname(template), entry['path'])))
+      needed, pending = set(), [template]
+      while pending:
+        for module in _module_imports(pending.pop()):
+          if module not in needed:
+            needed.add(module)
+            pending.append(module)
+      errors = ['imports {} without listing it in its schema'.format(module)
+                for module in sorted(needed - imported)]
+    _import_errors[template] = errors
+  return _import_errors[template]
+
+
+def check_template_call(path, properties):
+  """Raises a ValidationError unless a template's properties are valid.
+
+  Meant as the check of expansion.expand, so that every template call of the
+  expansion is validated against the schema of the template it calls. The
+  schema's imports are checked too (see check_imports).
+  """
+  template = os.path.relpath(path, expansion.ROOT_DIR)
+  errors = check_imports(template) + validate_properties(template, properties)
+  if errors:
+    raise ValidationError(['{}: {}'.format(template, e) for e in errors])
+
+
+def _referenced_names(value):
+  """Yields the names of the resources referenced within a property value."""
+  if isinstance(value, dict):
+    for v in value.values():
+      for name in _referenced_names(v):
+        yield name
+  elif isinstance(value, list):
+    for v in value:
+      for name in _referenced_names(v):
+        yield name
+  elif isinstance(value, str):
+    for match in expansion.REFERENCE_PATTERN.finditer(value):
+      yield match.group(1)
+
+
+def validate_manifest(config):
+  """Validates an expanded configuration.
+
+  Returns:
+    A list of error messages; empty if the configuration is valid.
+  """
+  errors = []
+  names = set()
+  for resource in config['resources']:
+    if resource['name'] in names:
+      errors.append('duplicate resource name {}'.format(resource['name']))
+    names.add(resource['name'])
+    if expansion.is_template(resource.get('type', '')):
+      errors.append('{}: unexpanded template {}'.format(
+        resource['name'], resource['type']))
+
+  for resource in config['resources']:
+    depends_on = resource.get('metadata', {}).get('dependsOn', [])
+    if not isinstance(depends_on, list):
+      errors.append('{}: unresolved dependsOn {!r}'.format(
+        resource['name'], depends_on))
+      depends_on = []
+    for dependency in depends_on:
+      if dependency not in names:
+        errors.append('{}: depends on unknown resource {}'.format(
+          resource['name'], dependency))
+    for name in _referenced_names(resource.get('properties', {})):
+      if name not in names:
+        errors.append('{}: references unknown resource {}'.format(
+          resource['name'], name))
+  return errors
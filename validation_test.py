@@ -0,0 +1,57 @@
+import copy
+import glob
+import os
+import unittest
+
+import expansion
+import validation
+
+
+class ValidationTest(unittest.TestCase):
+
+  def test_schemas_import_what_templates_need(self):
+    """Every template can be deployed on its own with its schema's imports."""
+    templates = [os.path.relpath(path, expansion.ROOT_DIR) for path in
+                 glob.glob(os.path.join(expansion.ROOT_DIR, '*.py')) +
+                 glob.glob(os.path.join(expansion.ROOT_DIR, 'templates', '*.py'))]
+    for template in templates:
+      self.assertEqual(validation.check_imports(template), [], template)
+
+  def test_missing_import_is_reported(self):
+    template = 'templates/firewall_policy.py'
+    schema = copy.deepcopy(validation.load_schema(template))
+    schema['imports'] = [x for x in schema['imports']
+                         if x['name'] != 'templates/naming.py']
+    path = os.path.join(expansion.ROOT_DIR, template) + '.schema'
+    self.addCleanup(validation._schemas.pop, path)
+    self.addCleanup(validation._import_errors.pop, template)
+    validation._schemas[path] = schema
+    validation._import_errors.pop(template, None)
+
+    self.assertEqual(validation.check_imports(template), [
+        'imports templates/naming.py without listing it in its schema'])
+    with self.assertRaises(validation.ValidationError) as e:
+      validation.check_template_call(
+          os.path.join(expansion.ROOT_DIR, template),
+          {'parentId': 'folders/1', 'resourceName': 'p', 'shortName': 'p'})
+    self.assertEqual(e.exception.errors, [
+        'templates/firewall_policy.py: imports templates/naming.py without '
+        'listing it in its schema'])
+
+
+  def test_manifest_references(self):
+    """Only references within property values must name a resource."""
+    config = {'resources': [
+        {'name': 'network', 'type': 'gcp-types/compute-v1:networks',
+         'properties': {'description': 'Refer to it as $(ref.network...',
+                        '$(ref.key.name)': 'keys are not references'}},
+        {'name': 'route', 'type': 'gcp-types/compute-v1:routes',
+         'properties': {'network': '$(ref.network.selfLink)',
+                        'nextHopGateway': ['$(ref.gateway.selfLink)']}},
+    ]}
+    self.assertEqual(validation.validate_manifest(config), [
+        'route: references unknown resource gateway'])
+
+
+if __name__ == '__main__':
+  unittest.main()